@@ -0,0 +1,364 @@
+"""
+離線端對端爬取基準測試：啟動本機假 Ollama (/api/generate) 與合成網站語料伺服器，
+以各爬取模式 (循序、asyncio 管線、批次清單) 分別在獨立子行程中執行 main()，
+回報每分鐘域名數、每域名延遲 p50 / p99、峰值 RSS 與 SQLite 寫入次數。全程離線、只需 CPU。
+
+合成網站以 siteN.bench 為主機名稱，子行程中將 *.bench 解析至 127.0.0.1 (所有主機共用同一個 IP，
+因此預設關閉每 IP 禮貌延遲)。語料包含連結圖、慢速主機、封鎖頁 (403 與 200 的驗證頁) 與停放頁。
+
+用法：python benchmarks/crawl_benchmark.py --modes sequential,pipeline,bulk --domains 200 --corpus 5000 \\
+          --ollama-latency-ms 40 --ollama-tps 200 --think-tokens 30
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import web_classifier as wc
+
+BENCH_TLD = ".bench"
+SITE_PATTERN = re.compile(r"site(\d+)\.bench")
+CODES = sorted(code for code in wc.SUBCATEGORY_MAP if not code.startswith("999"))
+WORDS = ("news market video music game travel health school bank cloud shop review forum weather sport food "
+         "movie anime recipe finance stock coding science art photo fashion car phone laptop garden pet").split()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 抓取器讀到位元組上限或提前結束生成時會主動斷線，屬預期行為
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+def start_server(handler, **attributes):
+    server = StubServer(("127.0.0.1", 0), type("Handler", (handler,), attributes))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def site_code(index):
+    """每個合成網站固定的「正確」子類別，假 Ollama 依此作答"""
+    return CODES[index * 7919 % len(CODES)]
+
+
+def site_kind(index, args):
+    """依索引決定網站類型：normal、slow、blocked (403)、challenge (200 驗證頁)、parked、error (500)"""
+    roll = random.Random(index * 31 + 7).random()
+    for kind, rate in (("slow", args.slow_rate), ("blocked", args.block_rate), ("challenge", args.challenge_rate),
+                       ("parked", args.parked_rate), ("error", args.error_rate)):
+        if roll < rate:
+            return kind
+        roll -= rate
+    return "normal"
+
+
+class CorpusHandler(BaseHTTPRequestHandler):
+    """以 Host 標頭區分網站；每頁含標題、描述、約 page_words 個字的內文，以及指向其他網站的連結"""
+    protocol_version = "HTTP/1.1"
+    args = None
+
+    def _send(self, status, body, content_type="text/html; charset=utf-8"):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        match = SITE_PATTERN.search(self.headers.get("Host", ""))
+        if not match:
+            self._send(404, "unknown host")
+            return
+        index = int(match.group(1))
+        kind = site_kind(index, self.args)
+        if self.path == "/robots.txt":
+            self._send(404, "", "text/plain")
+            return
+        if kind == "slow":
+            time.sleep(self.args.slow_ms / 1000)
+        if kind == "error":
+            self._send(500, "<html><body>Internal Server Error</body></html>")
+        elif kind == "blocked":
+            self._send(403, "<html><head><title>Access denied</title></head><body>Access denied | Cloudflare</body></html>")
+        else:
+            self._send(200, self.page(index, kind))
+
+    def page(self, index, kind):
+        port = self.server.server_port
+        rng = random.Random(index)
+        links = "".join(f'<a href="http://site{rng.randrange(self.args.corpus)}{BENCH_TLD}:{port}/">link</a>'
+                        for _ in range(self.args.links_per_page))
+        if kind == "challenge":
+            return (f"<html><head><title>Just a moment...</title></head><body><p>Checking your browser before accessing "
+                    f"site{index}{BENCH_TLD}. This process is automatic. Please enable JavaScript and cookies. "
+                    f"Performance and security by Cloudflare. Ray ID {index:016x}.</p></body></html>")
+        if kind == "parked":
+            return (f"<html><head><title>site{index}{BENCH_TLD}</title></head><body><p>This domain is for sale! "
+                    f"Buy this domain today. Contact the owner for the price and transfer details. "
+                    f"Related searches and sponsored listings.</p>{links}</body></html>")
+        code = site_code(index)
+        words = " ".join(rng.choice(WORDS) for _ in range(self.args.page_words))
+        return (f"<html><head><title>site{index} - {wc.SUBCATEGORY_MAP[code]}</title>"
+                f"<meta name=\"description\" content=\"site{index} {wc.SUBCATEGORY_MAP[code]}\"></head>"
+                f"<body><nav>home about contact</nav><p>site{index} {words}</p>{links}"
+                f"<script>var tracking = 1;</script></body></html>")
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """
+    模擬 Ollama /api/generate：依提示長度與 prompt_tps 計算 prompt eval 時間，再以 tps 逐 token 串流輸出，
+    可在回覆前輸出 <think> 思考內容；parallel 限制同時生成的請求數 (模擬 CPU 上的 OLLAMA_NUM_PARALLEL)。
+    """
+    protocol_version = "HTTP/1.1"
+    args = None
+    slots = None
+
+    def do_GET(self):
+        body = b'{"models": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, request):
+        prompt = request.get("prompt", "")
+        if "**Websites:**" in prompt:
+            urls = [line[2:].strip() for line in prompt.splitlines() if line.startswith("- http")]
+            return json.dumps({"results": [dict(self.knowledge(url), url=url) for url in urls]}, ensure_ascii=False)
+        if "Website Text Content" in prompt:
+            if "Cloudflare" in prompt or "Access denied" in prompt:
+                return "這是一個防火牆或安全檢查頁面。"
+            match = re.search(r"site(\d+)", prompt)
+            code = site_code(int(match.group(1))) if match else CODES[0]
+            return f"這是一個提供{wc.SUBCATEGORY_MAP[code]}內容的網站。"
+        if "Evidence to Analyze" in prompt:
+            if "防火牆或安全檢查" in prompt:
+                return json.dumps({"main_category_code": "020", "subcategory_code": "020-06"})
+            match = SITE_PATTERN.search(prompt, prompt.find("Evidence to Analyze"))
+            code = site_code(int(match.group(1))) if match else CODES[0]
+            return json.dumps({"main_category_code": code[:3], "subcategory_code": code})
+        match = re.search(r"classify the website `([^`]+)`", prompt)
+        return json.dumps(self.knowledge(match.group(1) if match else ""), ensure_ascii=False)
+
+    def knowledge(self, url):
+        match = SITE_PATTERN.search(url)
+        if not match or random.Random(url).random() >= self.args.known_rate:
+            return {"known": False}
+        code = site_code(int(match.group(1)))
+        return {"known": True, "main_category_code": code[:3], "subcategory_code": code, "summary": "已知網站。"}
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        think = self.args.think_tokens if request.get("think", True) else 0
+        answer = self.answer(request)
+        tokens = ["<think>"] + ["thinking "] * think + ["</think>"] if think else []
+        tokens += [answer[i:i + 4] for i in range(0, len(answer), 4)]
+        prompt_tokens = (len(request.get("prompt", "")) + len(request.get("system") or "")) // 4
+        with self.slots:
+            prompt_eval = self.args.ollama_latency_ms / 1000 + prompt_tokens / self.args.ollama_prompt_tps
+            time.sleep(prompt_eval)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            started = time.perf_counter()
+            try:
+                if not request.get("stream"):
+                    time.sleep(len(tokens) / self.args.ollama_tps)
+                    self.wfile.write(json.dumps(self.stats("".join(tokens), prompt_tokens, prompt_eval, len(tokens),
+                                                           time.perf_counter() - started)).encode("utf-8"))
+                    return
+                for token in tokens:
+                    time.sleep(1 / self.args.ollama_tps)
+                    self.wfile.write((json.dumps({"response": token, "done": False}) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                final = self.stats("", prompt_tokens, prompt_eval, len(tokens), time.perf_counter() - started)
+                self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                self.close_connection = True
+
+    @staticmethod
+    def stats(response, prompt_tokens, prompt_eval, eval_tokens, eval_seconds):
+        return {"response": response, "done": True, "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_eval * 1e9), "eval_count": eval_tokens,
+                "eval_duration": int(eval_seconds * 1e9), "load_duration": 0}
+
+    def log_message(self, *args):
+        pass
+
+
+def resolve_bench_hosts():
+    """將 *.bench 主機名稱解析至 127.0.0.1 (requests、aiohttp 的 ThreadedResolver 與禮貌排程器皆經由 getaddrinfo)"""
+    original = socket.getaddrinfo
+
+    def getaddrinfo(host, *args, **kwargs):
+        if isinstance(host, str) and host.endswith(BENCH_TLD):
+            host = "127.0.0.1"
+        return original(host, *args, **kwargs)
+
+    socket.getaddrinfo = getaddrinfo
+    if wc.AIOHTTP_AVAILABLE:
+        wc.aiohttp.connector.DefaultResolver = wc.aiohttp.ThreadedResolver
+
+
+def run_mode(args):
+    """子行程：在暫存目錄中以指定模式執行 main()，將量測結果寫入 --result-path"""
+    resolve_bench_hosts()
+    seeds = [f"http://site{i}{BENCH_TLD}:{args.corpus_port}/" for i in range(args.seeds)]
+    wc.SELENIUM_AVAILABLE = False
+    wc.LOCAL_AI_URL = f"http://127.0.0.1:{args.ollama_port}/api/generate"
+    wc.OLLAMA_ENDPOINTS = [wc.LOCAL_AI_URL]
+    wc.MAX_DOMAINS_TO_CRAWL = args.domains
+    wc.POLITENESS_PER_IP_DELAY = args.per_ip_delay
+    wc.METRICS_HTTP_PORT = None
+    wc.USE_ASYNC_PIPELINE = args.run_mode == "pipeline"
+    if args.fetcher == "requests":
+        wc.USE_ASYNC_FETCHER = False
+    latencies = []
+    writes = {"statements": 0, "commits": 0, "rows": 0}
+
+    def count_statement(sql):
+        verb = sql.lstrip().split(" ", 1)[0].upper()
+        if verb in ("INSERT", "UPDATE", "DELETE", "REPLACE"):
+            writes["statements"] += 1
+        elif verb == "COMMIT":
+            writes["commits"] += 1
+
+    def timed(method, latency_of):
+        def wrapper(*call_args):
+            started = time.perf_counter()
+            result = method(*call_args)
+            latencies.append(latency_of(started, *call_args))
+            return result
+        return wrapper
+
+    def job(crawler):
+        crawler.db_manager.conn.set_trace_callback(count_statement)
+        changes_before = crawler.db_manager.conn.total_changes
+        if args.run_mode == "bulk":
+            input_path = os.path.abspath("domains.txt")
+            with open(input_path, "w", encoding="utf-8") as f:
+                f.writelines(f"http://site{i}{BENCH_TLD}:{args.corpus_port}/\n" for i in range(args.domains))
+            crawler._classify_url = timed(crawler._classify_url, lambda started, *_: time.perf_counter() - started)
+            bulk = wc.BulkClassificationJob(crawler, os.path.abspath("bulk.jsonl"))
+            bulk.run(input_path)
+            crawler.crawled_count = bulk.classified
+        elif args.run_mode == "pipeline":
+            crawler._pipeline_done = timed(crawler._pipeline_done, lambda started, item, outcome: started - item["started"])
+            wc.asyncio.run(crawler.run_pipeline(max_domains=args.domains))
+        else:
+            crawler._process_url = timed(crawler._process_url, lambda started, *_: time.perf_counter() - started)
+            crawler.run(max_domains=args.domains)
+        crawler.db_manager.flush()
+        writes["rows"] = crawler.db_manager.conn.total_changes - changes_before
+        crawler.db_manager.conn.set_trace_callback(None)
+        result["domains"] = crawler.crawled_count
+
+    result = {"mode": args.run_mode, "domains": 0}
+    log = open(os.devnull if not args.verbose else "/dev/stderr", "w")
+    stdout, sys.stdout = sys.stdout, log
+    started = time.perf_counter()
+    try:
+        wc.main(start_urls=[] if args.run_mode == "bulk" else seeds, job=job)
+    finally:
+        sys.stdout = stdout
+        log.close()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    snapshot = wc.METRICS.snapshot()
+    llm_calls = sum(h["count"] for name, h in snapshot["histograms"].items() if name.startswith("llm_request_seconds"))
+    result.update({
+        "elapsed": elapsed,
+        "domains_per_minute": result["domains"] / elapsed * 60 if elapsed else 0,
+        "p50": latencies[len(latencies) // 2] if latencies else None,
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else None,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "sqlite_write_statements": writes["statements"],
+        "sqlite_commits": writes["commits"],
+        "sqlite_rows_changed": writes["rows"],
+        "llm_calls": llm_calls,
+    })
+    with open(args.result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="離線端對端爬取基準測試")
+    parser.add_argument("--modes", default="sequential,pipeline,bulk", help="以逗號分隔：sequential、pipeline、bulk")
+    parser.add_argument("--domains", type=int, default=200, help="每個模式要分類的域名數")
+    parser.add_argument("--corpus", type=int, default=5000, help="合成網站數量")
+    parser.add_argument("--seeds", type=int, default=20)
+    parser.add_argument("--links-per-page", type=int, default=8)
+    parser.add_argument("--page-words", type=int, default=400)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=2000)
+    parser.add_argument("--block-rate", type=float, default=0.03, help="回應 403 封鎖頁的網站比例")
+    parser.add_argument("--challenge-rate", type=float, default=0.03, help="回應 200 驗證 (challenge) 頁的網站比例")
+    parser.add_argument("--parked-rate", type=float, default=0.03)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--known-rate", type=float, default=0.3, help="假 Ollama 以知識庫直接分類的網站比例")
+    parser.add_argument("--ollama-latency-ms", type=float, default=40, help="每次請求的固定延遲 (含模型排程)")
+    parser.add_argument("--ollama-prompt-tps", type=float, default=2000, help="prompt eval 速度 (tokens/秒)")
+    parser.add_argument("--ollama-tps", type=float, default=200, help="生成速度 (tokens/秒)")
+    parser.add_argument("--ollama-parallel", type=int, default=2, help="同時生成的請求數上限")
+    parser.add_argument("--think-tokens", type=int, default=30, help="每次回覆前的 <think> token 數，0 表示不思考")
+    parser.add_argument("--per-ip-delay", type=float, default=0, help="合成主機共用 127.0.0.1，預設關閉每 IP 延遲")
+    parser.add_argument("--fetcher", choices=["auto", "requests"], default="auto")
+    parser.add_argument("--verbose", action="store_true", help="將爬蟲輸出導向 stderr")
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--ollama-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args)
+        return
+
+    corpus = start_server(CorpusHandler, args=args)
+    ollama = start_server(FakeOllamaHandler, args=args, slots=threading.BoundedSemaphore(args.ollama_parallel))
+    print(f"語料 {args.corpus} 個網站、每模式 {args.domains} 個域名；假 Ollama 延遲 {args.ollama_latency_ms} ms、"
+          f"{args.ollama_tps} tokens/秒、思考 {args.think_tokens} tokens、並行 {args.ollama_parallel}")
+    print(f"{'模式':<12}{'域名':>6}{'秒':>9}{'域名/分':>10}{'p50 秒':>9}{'p99 秒':>9}{'RSS MB':>9}"
+          f"{'寫入句':>8}{'交易':>7}{'變更列':>8}{'LLM':>6}")
+    try:
+        for mode in filter(None, (m.strip() for m in args.modes.split(","))):
+            with tempfile.TemporaryDirectory() as workdir:
+                result_path = os.path.join(workdir, "result.json")
+                subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--run-mode", mode,
+                                "--corpus-port", str(corpus.server_port), "--ollama-port", str(ollama.server_port),
+                                "--result-path", result_path], cwd=workdir, check=True)
+                with open(result_path, encoding="utf-8") as f:
+                    r = json.load(f)
+            print(f"{r['mode']:<12}{r['domains']:>6}{r['elapsed']:>9.1f}{r['domains_per_minute']:>10.1f}"
+                  f"{r['p50'] or 0:>9.2f}{r['p99'] or 0:>9.2f}{r['peak_rss_mb']:>9.1f}{r['sqlite_write_statements']:>8}"
+                  f"{r['sqlite_commits']:>7}{r['sqlite_rows_changed']:>8}{r['llm_calls']:>6}")
+    finally:
+        for server in (corpus, ollama):
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+離線抓取吞吐量基準測試：啟動本機樁 (stub) HTTP 伺服器，比較 requests 與 aiohttp 抓取器。
+
+用法：python benchmarks/fetch_benchmark.py --hosts 8 --pages 400 --latency-ms 50 --connect-ms 30 --page-kb 200 --concurrency 32
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import web_classifier as wc
+
+
+def build_page(page_kb, link_count=20):
+    """產生固定大小的 HTML 頁面 (含 head、內文與對外連結)"""
+    head = b"<html><head><title>Stub</title><meta name=\"description\" content=\"stub page\"></head><body>"
+    links = b"".join(f'<a href="http://stub{i}.example/">l</a>'.encode() for i in range(link_count))
+    filler = b"<p>" + b"lorem ipsum " * max(1, (page_kb * 1024 - len(head) - len(links)) // 12) + b"</p>"
+    return head + links + filler + b"</body></html>"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    page = b""
+    latency = 0.0
+    connect_latency = 0.0
+
+    def setup(self):
+        # 模擬每條新連線的 TCP / TLS 交握成本，連線重用時不會再付出
+        time.sleep(self.connect_latency)
+        super().setup()
+
+    def do_GET(self):
+        if self.path == "/robots.txt":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(self.page)))
+        self.end_headers()
+        try:
+            self.wfile.write(self.page)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 抓取器讀到位元組上限後會主動斷線，屬預期行為
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+
+def start_stub_servers(host_count, page, latency, connect_latency):
+    """每個「主機」以不同埠號的本機伺服器模擬"""
+    handler = type("Handler", (StubHandler,), {"page": page, "latency": latency, "connect_latency": connect_latency})
+    servers = []
+    for _ in range(host_count):
+        server = StubServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def run_sync(scraper, urls, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(scraper.fetch, urls))
+
+
+async def run_async(scraper, urls, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(url):
+        async with slots:
+            return await scraper.fetch_async(url)
+
+    return await asyncio.gather(*(fetch_one(url) for url in urls))
+
+
+def report(name, results, elapsed):
+    ok = [content for content, _ in results if content]
+    total_bytes = sum(len(content) for content in ok)
+    print(f"{name:<10} {len(ok):>5}/{len(results)} 頁  {elapsed:6.2f} 秒  "
+          f"{len(results) / elapsed:8.1f} 頁/秒  {total_bytes / elapsed / 1e6:7.1f} MB/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="離線抓取吞吐量基準測試")
+    parser.add_argument("--hosts", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--connect-ms", type=float, default=30)
+    parser.add_argument("--page-kb", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    servers = start_stub_servers(args.hosts, build_page(args.page_kb), args.latency_ms / 1000, args.connect_ms / 1000)
+    urls = [f"http://127.0.0.1:{servers[i % args.hosts].server_port}/page/{i}" for i in range(args.pages)]
+    # 基準測試只量測抓取器本身，關閉禮貌延遲
+    scheduler = wc.PolitenessScheduler("fetch-benchmark", default_delay=0, per_ip_delay=0)
+
+    print(f"{args.hosts} 個主機、{args.pages} 頁、延遲 {args.latency_ms} ms、連線 {args.connect_ms} ms、頁面 {args.page_kb} KB、並行 {args.concurrency}")
+    wc.ASYNC_FETCH_PER_HOST = max(wc.ASYNC_FETCH_PER_HOST, args.concurrency // args.hosts)
+    devnull = open(os.devnull, "w")
+    try:
+        scraper = wc.WebScraper(scheduler=scheduler)
+        stdout, sys.stdout = sys.stdout, devnull
+        started = time.perf_counter()
+        results = run_sync(scraper, urls, args.concurrency)
+        elapsed = time.perf_counter() - started
+        sys.stdout = stdout
+        report("requests", results, elapsed)
+
+        if wc.AIOHTTP_AVAILABLE:
+            scraper = wc.AsyncWebScraper(scheduler=scheduler)
+            stdout, sys.stdout = sys.stdout, devnull
+            started = time.perf_counter()
+            results = asyncio.run(run_async(scraper, urls, args.concurrency))
+            elapsed = time.perf_counter() - started
+            sys.stdout = stdout
+            report("aiohttp", results, elapsed)
+            scraper.close()
+        else:
+            print("未安裝 aiohttp，略過非同步抓取器。")
+    finally:
+        sys.stdout = sys.__stdout__
+        devnull.close()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+域名快照查詢基準測試：以合成的 classified_domains 匯出快照，量測單核心查詢吞吐量與延遲分位數。
+
+用法：python benchmarks/lookup_benchmark.py --domains 1000000 --queries 200000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import web_classifier as wc
+
+
+def build_snapshot(workdir, domain_count):
+    db_path = os.path.join(workdir, "bench.db")
+    snapshot_path = os.path.join(workdir, "bench_snapshot.bin")
+    codes = sorted(wc.SUBCATEGORY_MAP)
+    db_manager = wc.DatabaseManager(db_path)
+    try:
+        db_manager.setup_tables()
+        with db_manager.conn:
+            db_manager.conn.executemany(
+                "INSERT INTO classified_domains (domain, main_category_code, subcategory_code) VALUES (?, ?, ?)",
+                ((f"site{i}.com", codes[i % len(codes)][:3], codes[i % len(codes)]) for i in range(domain_count))
+            )
+        wc.export_domain_snapshot(db_manager, snapshot_path)
+    finally:
+        db_manager.close()
+    return snapshot_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="域名快照查詢基準測試")
+    parser.add_argument("--domains", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200_000)
+    parser.add_argument("--miss-rate", type=float, default=0.5, help="查無分類的查詢比例")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        snapshot = wc.DomainSnapshot(build_snapshot(workdir, args.domains))
+        miss_offset = args.domains
+        hosts = [f"www.site{random.randrange(args.domains) + (miss_offset if random.random() < args.miss_rate else 0)}.com"
+                 for _ in range(args.queries)]
+
+        started = time.perf_counter()
+        snapshot.lookup_many(hosts)
+        elapsed = time.perf_counter() - started
+
+        latencies = []
+        for host in hosts[:50_000]:
+            t0 = time.perf_counter_ns()
+            snapshot.lookup(host)
+            latencies.append(time.perf_counter_ns() - t0)
+        latencies.sort()
+        snapshot.close()
+
+    print(f"{args.domains} 筆快照、{args.queries} 次查詢 (含 www. 後綴逐層比對，未命中比例 {args.miss_rate:.0%})")
+    print(f"吞吐量 {args.queries / elapsed:,.0f} 次/秒 (單核心)")
+    print(f"延遲 p50 {latencies[len(latencies) // 2] / 1000:.1f} µs、p99 {latencies[int(len(latencies) * 0.99)] / 1000:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import web_classifier as wc
+
+
+def test_batch_size_is_capped_by_context_window():
+    sizer = wc.AdaptiveBatchSizer(initial_size=8, max_size=32, context_window=1000, tokens_per_item=100, reserved_tokens=400)
+    assert sizer.max_size == 6
+    assert sizer.size == 6
+
+
+def test_batch_size_grows_on_full_successful_batches():
+    sizer = wc.AdaptiveBatchSizer(4, 6, 10000, 100, 0)
+    sizer.record(2, 0)  # 未填滿的批次不代表可以加大
+    assert sizer.size == 4
+    for _ in range(5):
+        sizer.record(sizer.size, 0)
+    assert sizer.size == 6
+
+
+def test_batch_size_halves_on_high_failure_rate():
+    sizer = wc.AdaptiveBatchSizer(8, 32, 10000, 100, 0)
+    sizer.record(8, 2)  # 失敗率剛好等於門檻時不調整
+    assert sizer.size == 8
+    sizer.record(8, 3)
+    assert sizer.size == 4
+    for _ in range(5):
+        sizer.record(sizer.size, sizer.size)
+    assert sizer.size == 1
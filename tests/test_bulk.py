@@ -0,0 +1,52 @@
+import json
+
+import web_classifier as wc
+
+
+class FakeClassifier:
+    def classify_many_from_knowledge(self, urls):
+        return {}
+
+
+def make_job(tmp_path, db_manager, outage=()):
+    crawler = wc.WebCrawler(start_urls=[], db_manager=db_manager, classifier=FakeClassifier(), scraper=None)
+    job = wc.BulkClassificationJob(crawler, str(tmp_path / "out.jsonl"), workers=1, chunk_size=2)
+
+    def classify(url, domain):
+        if domain in outage:
+            raise wc.OllamaUnavailableError("down")
+        return url, {"main_category_code": "010", "subcategory_code": "010-06", "summary": domain}, None
+    job._classify = classify
+    return job
+
+
+def test_chunk_does_not_look_up_domains_one_by_one(tmp_path, monkeypatch):
+    db_manager = wc.DatabaseManager(str(tmp_path / "crawl.db"))
+    db_manager.setup_tables()
+    try:
+        job = make_job(tmp_path, db_manager)
+        monkeypatch.setattr(db_manager, "domain_exists", lambda domain: (_ for _ in ()).throw(AssertionError(domain)))
+        source = tmp_path / "domains.txt"
+        source.write_text("a.com\nb.com\nc.com\n", encoding="utf-8")
+        assert job.run(str(source)) == 3
+    finally:
+        db_manager.close()
+
+
+def test_resume_does_not_repeat_rows_written_after_the_checkpoint(tmp_path):
+    db_manager = wc.DatabaseManager(str(tmp_path / "crawl.db"))
+    db_manager.setup_tables()
+    try:
+        source = tmp_path / "domains.txt"
+        source.write_text("a.com\nb.com\nc.com\nd.com\n", encoding="utf-8")
+        # 第二批寫出 c.com 後 Ollama 中斷，檢查點停在第一批
+        make_job(tmp_path, db_manager, outage={"d.com"}).run(str(source))
+        db_manager.flush()
+        assert json.load(open(str(tmp_path / "out.jsonl.checkpoint"), encoding="utf-8"))["lines"] == 2
+        make_job(tmp_path, db_manager).run(str(source))
+        with open(str(tmp_path / "out.jsonl"), encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        assert sorted(row["domain"] for row in rows) == ["a.com", "b.com", "c.com", "d.com"]
+        assert [row["cached"] for row in rows if row["domain"] == "c.com"] == [False]
+    finally:
+        db_manager.close()
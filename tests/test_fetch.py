@@ -0,0 +1,95 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import web_classifier as wc
+
+
+def test_bounded_body_stops_at_byte_limit():
+    reader = wc.BoundedBodyReader(max_bytes=10, body_bytes_after_head=0)
+    assert not reader.feed(b"<html>")
+    assert not reader.feed(b"")
+    assert reader.feed(b"<body>hello")
+    assert reader.content() == b"<html><bod"
+
+
+def test_bounded_body_stops_after_head_split_across_chunks():
+    reader = wc.BoundedBodyReader(max_bytes=1000, body_bytes_after_head=16)
+    assert not reader.feed(b"<html><head><title>t</title></he")
+    assert not reader.feed(b"ad><bo")
+    assert reader.head_end == len(b"<html><head><title>t</title>")
+    assert reader.feed(b"dy>text")
+    assert reader.content() == b"<html><head><title>t</title></head><body>text"
+
+
+def test_bounded_body_reads_to_limit_without_head():
+    reader = wc.BoundedBodyReader(max_bytes=20, body_bytes_after_head=4)
+    assert not reader.feed(b"no head here, ")
+    assert reader.head_end is None
+    assert reader.feed(b"just text")
+    assert len(reader.content()) == 20
+
+
+PAGE = "<html><head><title>中文新聞</title></head><body>內容</body></html>"
+
+
+def test_decode_html_prefers_http_charset_over_utf8_default():
+    content = PAGE.encode("big5")
+    assert wc.decode_html(content, wc.content_type_charset("text/html; charset=Big5")) == PAGE
+    assert wc.decode_html(content) != PAGE
+
+
+def test_decode_html_charset_precedence():
+    meta_page = '<meta charset="gbk"><p>中文</p>'
+    assert wc.decode_html(meta_page.encode("gbk")) == meta_page
+    # HTTP 標頭優先於 meta，BOM 又優先於兩者
+    assert wc.decode_html(meta_page.encode("utf-8"), "utf-8") == meta_page
+    assert wc.decode_html(b"\xef\xbb\xbf" + PAGE.encode("utf-8"), "big5") == PAGE
+    assert wc.decode_html(PAGE.encode("utf-8"), "no-such-codec") == PAGE
+
+
+def test_content_type_charset():
+    assert wc.content_type_charset('text/html; Charset="GBK"') == "GBK"
+    assert wc.content_type_charset("text/html") is None
+    assert wc.content_type_charset(None) is None
+
+
+def test_extract_page_scans_links_after_text_limit(monkeypatch):
+    monkeypatch.setattr(wc, "PAGE_TEXT_MAX_CHARS", 10)
+    monkeypatch.setattr(wc, "PAGE_PARSE_CHUNK_CHARS", 64)
+    html = ("<html><head><title>t</title></head><body>" + "<p>word</p>" * 50
+            + '<a href="https://late.example.com/x">late</a></body></html>')
+    page = wc.extract_page(html.encode("utf-8"), "http://example.com")
+    assert page["title"] == "t"
+    assert "https://late.example.com" in page["links"]
+
+
+class Big5Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = PAGE.encode("big5") if self.path == "/" else b""
+        self.send_response(200 if body else 404)
+        self.send_header("Content-Type", "text/html; charset=big5")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("scraper_class", ["WebScraper", "AsyncWebScraper"])
+def test_fetch_decodes_with_declared_charset(scraper_class, monkeypatch):
+    if scraper_class == "AsyncWebScraper":
+        pytest.importorskip("aiohttp")
+    monkeypatch.setattr(wc, "FETCH_HEAD_PROBE", False)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Big5Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scraper = getattr(wc, scraper_class)(scheduler=wc.PolitenessScheduler("test", default_delay=0, per_ip_delay=0))
+    try:
+        content, _ = scraper.fetch(f"http://127.0.0.1:{server.server_port}/")
+        assert wc.extract_page(content, "http://127.0.0.1/")["title"] == "中文新聞"
+    finally:
+        scraper.close()
+        server.shutdown()
+        server.server_close()
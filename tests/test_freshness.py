@@ -0,0 +1,127 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import web_classifier as wc
+
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda sigma".split()
+
+
+def page_html(seed):
+    text = " ".join(WORDS[(i * seed) % len(WORDS)] + str(i % 7) for i in range(200))
+    return f"<html><head><title>t</title></head><body><p>{text}</p></body></html>"
+
+
+class FakeClassifier:
+    def __init__(self, sub_code):
+        self.sub_code = sub_code
+        self.calls = 0
+
+    def get_summary_from_content(self, text_content, url):
+        self.calls += 1
+        return "測試網站摘要。"
+
+    def classify_from_metadata(self, url, title, description, summary, examples=None):
+        return {"main_category_code": self.sub_code[:3], "subcategory_code": self.sub_code}
+
+
+class FakeScraper:
+    def __init__(self, html):
+        self.html = html
+        self.requested = []
+
+    def fetch(self, url, conditional=False):
+        self.requested.append((url, conditional))
+        return self.html, url
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    db_manager = wc.DatabaseManager(str(tmp_path / "crawl.db"))
+    db_manager.setup_tables()
+    yield db_manager
+    db_manager.close()
+
+
+def test_first_classification_stores_fingerprint_and_recheck_reclassifies(db_manager):
+    sub_codes = sorted(wc.SUBCATEGORY_MAP)
+    classifier = FakeClassifier(sub_codes[0])
+    scraper = FakeScraper(page_html(5))
+    crawler = wc.WebCrawler(start_urls=[], db_manager=db_manager, classifier=classifier, scraper=scraper)
+    page, final_url = crawler._fetch_page("http://example.com")
+    crawler._save_classification("example.com", final_url, crawler._classify_from_content("example.com", final_url, page))
+    db_manager.flush()
+    stored = db_manager.conn.execute("SELECT content_fingerprint FROM classified_domains").fetchone()[0]
+    assert stored == wc.format_fingerprint(wc.simhash_fingerprint(page["text_content"]))
+
+    job = wc.FreshnessRecheckJob(crawler)
+    db_manager.conn.execute("UPDATE classified_domains SET next_check_at = 0")
+    db_manager.conn.commit()
+    job.run()
+    assert job.stats["unchanged"] == 1 and classifier.calls == 1
+
+    scraper.html = page_html(7)
+    classifier.sub_code = sub_codes[1]
+    db_manager.conn.execute("UPDATE classified_domains SET next_check_at = 0")
+    db_manager.conn.commit()
+    job.run()
+    assert job.stats["reclassified"] == 1 and classifier.calls == 2
+    row = db_manager.conn.execute("SELECT subcategory_code, check_attempts FROM classified_domains").fetchone()
+    assert row == (sub_codes[1], 0)
+
+
+def test_unreachable_domains_back_off_exponentially(db_manager):
+    db_manager.add_domain_classification("down.com", "999", None, "999-02", None, "s", "http://down.com")
+    db_manager.flush()
+    crawler = wc.WebCrawler(start_urls=[], db_manager=db_manager, classifier=FakeClassifier("010-06"), scraper=FakeScraper(None))
+    job = wc.FreshnessRecheckJob(crawler)
+    delays = []
+    for _ in range(3):
+        db_manager.conn.execute("UPDATE classified_domains SET next_check_at = 0")
+        db_manager.conn.commit()
+        job.run()
+        delays.append(db_manager.conn.execute("SELECT next_check_at - checked_at FROM classified_domains").fetchone()[0])
+    assert delays == pytest.approx([wc.recheck_delay(2), wc.recheck_delay(3), wc.recheck_delay(4)])
+    assert delays[1] == pytest.approx(delays[0] * 2)
+
+
+class RedirectingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/":
+            self.send_response(302)
+            self.send_header("Location", "/final")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = page_html(5).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_validators_are_stored_under_final_url(tmp_path, monkeypatch):
+    monkeypatch.setattr(wc, "FETCH_HEAD_PROBE", False)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RedirectingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scraper = wc.WebScraper(scheduler=wc.PolitenessScheduler("test", default_delay=0, per_ip_delay=0),
+                            validator_store=wc.FetchValidatorStore(str(tmp_path / "validators.db")))
+    try:
+        content, final_url = scraper.fetch(f"http://127.0.0.1:{server.server_port}/")
+        assert content and final_url.endswith("/final")
+        # 新鮮度檢查以分類紀錄中的最終 URL 發出條件式請求
+        assert scraper.fetch(final_url, conditional=True)[0] is wc.NOT_MODIFIED
+    finally:
+        scraper.close()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,116 @@
+import asyncio
+import sqlite3
+import threading
+from http.server import HTTPServer
+
+import pytest
+import requests
+
+import web_classifier as wc
+
+
+class FakeFrontier:
+    """只實作測試用到的 RPC 方法"""
+    def queue_size(self):
+        return 3
+
+    def classified_count(self):
+        raise RuntimeError("boom")
+
+
+@pytest.fixture
+def service_url():
+    handler = type("Handler", (wc.FrontierRPCHandler,), {"db_manager": FakeFrontier(), "token": "secret"})
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_rpc_requires_token(service_url):
+    assert wc.RemoteDatabaseManager(service_url, token="secret")._call("queue_size") == 3
+    with pytest.raises(requests.exceptions.HTTPError) as excinfo:
+        wc.RemoteDatabaseManager(service_url, token="wrong")._call("queue_size")
+    assert excinfo.value.response.status_code == 401
+    response = requests.post(service_url + "/rpc", json={"method": "queue_size", "args": []}, timeout=5)
+    assert response.status_code == 401
+
+
+def test_rpc_reports_unexpected_errors_as_500(service_url):
+    headers = {wc.FRONTIER_TOKEN_HEADER: "secret"}
+    response = requests.post(service_url + "/rpc", json={"method": "classified_count", "args": []}, headers=headers, timeout=5)
+    assert response.status_code == 500
+    assert response.json()["error"] == "boom"
+    response = requests.post(service_url + "/rpc", json=["queue_size"], headers=headers, timeout=5)
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    db_manager = wc.DatabaseManager(str(tmp_path / "crawl.db"))
+    db_manager.setup_tables()
+    yield db_manager
+    db_manager.close()
+
+
+def queue_row(db_manager, url):
+    db_manager.flush()
+    return db_manager.conn.execute("SELECT status, attempts FROM crawl_queue WHERE url = ?", (url,)).fetchone()
+
+
+def test_expired_leases_stop_after_max_attempts(db_manager):
+    url = "http://example.com"
+    db_manager.add_to_queue(url)
+    for attempt in range(1, wc.FRONTIER_MAX_ATTEMPTS + 1):
+        # lease_seconds 為負值時，先前的租約立即視為過期
+        assert db_manager.claim_batch(1, lease_seconds=-1) == [(url, "example.com")]
+        assert queue_row(db_manager, url) == ("leased", attempt)
+    assert db_manager.claim_batch(1, lease_seconds=-1) == []
+    assert queue_row(db_manager, url) == ("failed", wc.FRONTIER_MAX_ATTEMPTS)
+
+
+def test_sequential_run_nacks_failed_urls(db_manager, monkeypatch):
+    monkeypatch.setattr(wc, "USE_BATCH_KNOWLEDGE", False)
+    url = "http://example.com"
+    db_manager.add_to_queue(url)
+    scraper = type("Scraper", (), {"scheduler": wc.PolitenessScheduler("test", default_delay=0, per_ip_delay=0)})()
+    crawler = wc.WebCrawler(start_urls=[], db_manager=db_manager, classifier=None, scraper=scraper)
+    calls = []
+
+    def broken(url, domain):
+        calls.append(url)
+        raise RuntimeError("boom")
+    monkeypatch.setattr(crawler, "_process_url", broken)
+    crawler.run(10)
+    assert len(calls) == wc.FRONTIER_MAX_ATTEMPTS
+    assert queue_row(db_manager, url) == ("failed", wc.FRONTIER_MAX_ATTEMPTS)
+
+
+def committed_classifications(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM classified_domains").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_pipeline_timer_flushes_without_new_writes(tmp_path):
+    path = str(tmp_path / "timer.db")
+    db_manager = wc.DatabaseManager(path, flush_interval=0.5)
+    db_manager.setup_tables()
+    try:
+        crawler = wc.WebCrawler(start_urls=[], db_manager=db_manager, classifier=None, scraper=None)
+        db_manager.add_domain_classification("example.com", "010", wc.MAIN_CATEGORY_MAP["010"], "010-06",
+                                             wc.SUBCATEGORY_MAP["010-06"], None, "http://example.com")
+        assert committed_classifications(path) == 0
+
+        async def run_timer():
+            timer = asyncio.create_task(crawler._pipeline_flush_timer())
+            await asyncio.sleep(1.2)
+            timer.cancel()
+        asyncio.run(run_timer())
+        assert committed_classifications(path) == 1
+    finally:
+        db_manager.close()
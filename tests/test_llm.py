@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import web_classifier as wc
+
+
+class FakeOllamaClient:
+    """依序回傳預先設定的回覆，並記錄呼叫次數"""
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def generate(self, payload, parser=None):
+        self.calls += 1
+        reply = self.replies.pop(0)
+        if parser:
+            parser.feed(reply)
+        return {"response": reply, "prompt_eval_count": 10, "eval_count": 5}
+
+
+VALID = {"main_category_code": "010", "subcategory_code": "010-06", "confidence": 0.9}
+INVALID = {"main_category_code": "010", "subcategory_code": "020-01"}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = wc.LLMResponseCache(str(tmp_path / "llm_cache.db"))
+    yield cache
+    cache.close()
+
+
+def make_classifier(replies, cache, stage_models=None):
+    client = FakeOllamaClient([json.dumps(reply, ensure_ascii=False) for reply in replies])
+    classifier = wc.LocalOllamaClassifier("test-model", "http://127.0.0.1:1/api/generate", wc.CLASSIFICATION_SCHEMA_JSON,
+                                          client=client, cache=cache, stage_models=stage_models or {})
+    return classifier, client
+
+
+def test_invalid_classification_is_not_cached(cache):
+    classifier, client = make_classifier([INVALID, VALID], cache)
+    first = classifier.classify_from_metadata("http://example.com", "t", "d", "s")
+    second = classifier.classify_from_metadata("http://example.com", "t", "d", "s")
+    assert not wc.is_classification_valid(first)
+    assert wc.is_classification_valid(second)
+    assert client.calls == 2
+    # 有效結果已快取，第三次直接命中
+    assert classifier.classify_from_metadata("http://example.com", "t", "d", "s") == second
+    assert client.calls == 2
+
+
+def test_metadata_retry_reaches_model_after_invalid_answer(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(wc, "RETRY_DELAY", 0)
+    classifier, client = make_classifier([INVALID, VALID], cache)
+    client.replies.insert(0, "這是一個測試網站的摘要。")
+    db_manager = wc.DatabaseManager(str(tmp_path / "crawl.db"))
+    db_manager.setup_tables()
+    try:
+        crawler = wc.WebCrawler(start_urls=[], db_manager=db_manager, classifier=classifier, scraper=None)
+        page = {"title": "t", "description": "d", "text_content": "內容" * 100}
+        result = crawler._summarize_and_classify("example.com", "http://example.com", page)
+    finally:
+        db_manager.close()
+    assert result["subcategory_code"] == "010-06"
+    assert client.calls == 3
+
+
+def test_unknown_knowledge_answer_is_cached(cache):
+    classifier, client = make_classifier([{"known": False}], cache)
+    assert classifier.classify_from_knowledge("http://example.com") == {"known": False}
+    assert classifier.classify_from_knowledge("http://example.com") == {"known": False}
+    assert client.calls == 1
+
+
+CASCADE = {"knowledge": ["small-model", "test-model"], "metadata": ["small-model", "test-model"]}
+
+
+def test_cascade_is_disabled_by_default():
+    assert all(len(models) == 1 for models in wc.OLLAMA_STAGE_MODELS.values())
+
+
+def test_cascade_escalates_answer_without_confidence(cache):
+    no_confidence = {key: value for key, value in VALID.items() if key != "confidence"}
+    classifier, client = make_classifier([no_confidence, VALID], cache, CASCADE)
+    assert classifier.classify_from_metadata("http://example.com", "t", "d", "s") == VALID
+    assert client.calls == 2
+    assert classifier.cascade_stats["metadata"]["reasons"] == {"low_confidence": 1}
+
+
+def test_cascade_escalates_unknown_to_large_model(cache):
+    known = dict(VALID, known=True, summary="測試網站")
+    classifier, client = make_classifier([{"known": False}, known], cache, CASCADE)
+    assert classifier.classify_from_knowledge("http://example.com") == known
+    assert client.calls == 2
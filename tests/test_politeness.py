@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import web_classifier as wc
+
+
+class RobotsHandler(BaseHTTPRequestHandler):
+    user_agents = []
+
+    def do_GET(self):
+        self.user_agents.append(self.headers.get("User-Agent"))
+        if self.path == "/robots.txt":
+            body, content_type = b"User-agent: *\nCrawl-delay: 2\n", "text/plain"
+        else:
+            body, content_type = b"<html><head><title>t</title></head><body>ok</body></html>", "text/html"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def robots_url():
+    RobotsHandler.user_agents = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RobotsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/page"
+    server.shutdown()
+    server.server_close()
+
+
+def test_robots_txt_uses_scraper_session(robots_url, monkeypatch):
+    def no_module_requests(*args, **kwargs):
+        raise AssertionError("robots.txt 應經由抓取器的連線池取得")
+    monkeypatch.setattr(wc.requests, "get", no_module_requests)
+    scraper = wc.WebScraper(scheduler=wc.PolitenessScheduler("test", default_delay=0, per_ip_delay=0))
+    try:
+        assert scraper.scheduler.host_delay(robots_url) == 2
+        assert RobotsHandler.user_agents == [scraper.headers["User-Agent"]]
+        # 解析結果有快取，不會再次請求
+        assert scraper.scheduler.host_delay(robots_url) == 2
+        assert len(RobotsHandler.user_agents) == 1
+    finally:
+        scraper.close()
+
+
+def test_reserve_async_returns_delay_without_blocking():
+    scheduler = wc.PolitenessScheduler("test", default_delay=0, per_ip_delay=0)
+    requested = []
+
+    async def fetch_robots(robots_url):
+        requested.append(robots_url)
+        return "User-agent: *\nCrawl-delay: 3\n"
+
+    async def reserve_twice():
+        first = await scheduler.reserve_async("http://localhost:1/a", fetch_robots)
+        second = await scheduler.reserve_async("http://localhost:1/b", fetch_robots)
+        return first, second
+
+    first, second = asyncio.run(reserve_twice())
+    assert first == 0
+    assert 2.9 < second <= 3
+    assert requested == ["http://localhost:1/robots.txt"]
+
+
+def test_async_scraper_fetches_robots_with_aiohttp(robots_url, monkeypatch):
+    pytest.importorskip("aiohttp")
+    scraper = wc.AsyncWebScraper(scheduler=wc.PolitenessScheduler("test", default_delay=0, per_ip_delay=0))
+
+    def no_sync_fetch(*args, **kwargs):
+        raise AssertionError("非同步抓取器不應以執行緒抓取 robots.txt")
+    monkeypatch.setattr(scraper, "_fetch_robots", no_sync_fetch)
+    monkeypatch.setattr(scraper.scheduler, "fetch_robots", no_sync_fetch)
+    monkeypatch.setattr(wc, "FETCH_HEAD_PROBE", False)
+    try:
+        content, _ = scraper.fetch(robots_url)
+        assert "<title>t</title>" in content
+        assert scraper.scheduler.host_delay(robots_url) == 2
+        assert RobotsHandler.user_agents == [scraper.headers["User-Agent"]] * 2
+    finally:
+        scraper.close()
@@ -0,0 +1,29 @@
+import web_classifier as wc
+
+
+def test_preclassified_row_has_no_fabricated_summary(tmp_path):
+    db_manager = wc.DatabaseManager(str(tmp_path / "crawl.db"))
+    db_manager.setup_tables()
+    try:
+        crawler = wc.WebCrawler(start_urls=[], db_manager=db_manager, classifier=None, scraper=None,
+                                preclassifier=wc.PreClassifier())
+        result = crawler._preclassify("http://sedoparking.com")
+        assert result["source"] == "domain" and result["summary"] is None
+        crawler._save_classification("sedoparking.com", "http://sedoparking.com", result)
+        crawler._save_classification("example.com", "http://example.com",
+                                     {"main_category_code": "010", "subcategory_code": "010-06", "summary": None})
+        db_manager.flush()
+        rows = db_manager.conn.execute("SELECT domain, summary, classified_by FROM classified_domains ORDER BY domain").fetchall()
+        assert rows == [("example.com", None, "llm"), ("sedoparking.com", None, "domain")]
+        # 只有 LLM 的結果可作為訓練資料，摘要為 NULL 也不影響來源判斷
+        assert [row[1] for row in db_manager.iter_classified_rows(llm_only=True)] == ["example.com"]
+    finally:
+        db_manager.close()
+
+
+def test_cdn_hosts_are_left_to_the_llm():
+    # CDN 上可能是任何類型的網站，分類表中也沒有對應的基礎設施類別
+    preclassifier = wc.PreClassifier()
+    for url in ("http://cloudfront.net", "http://akamaihd.net", "http://fastly.net"):
+        result = preclassifier.classify(url)
+        assert result is None or result["source"] != "domain"
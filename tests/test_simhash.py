@@ -0,0 +1,75 @@
+import pytest
+
+import web_classifier as wc
+
+TEXT = " ".join(f"word{i}" for i in range(200))
+RESULT = {"main_category_code": "010", "subcategory_code": "010-06", "summary": "測試摘要"}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = wc.NearDuplicateIndex(str(tmp_path / "simhash.db"))
+    yield index
+    index.conn.close()
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def test_fingerprint_is_stable_and_tolerates_small_edits():
+    fingerprint = wc.simhash_fingerprint(TEXT)
+    assert fingerprint == wc.simhash_fingerprint(TEXT.upper())
+    assert distance(fingerprint, wc.simhash_fingerprint(TEXT.replace("word100", "changed"))) <= wc.SIMHASH_MAX_DISTANCE
+    assert distance(fingerprint, wc.simhash_fingerprint(" ".join(f"other{i}" for i in range(200)))) > wc.SIMHASH_MAX_DISTANCE
+
+
+def test_fingerprint_needs_enough_tokens():
+    assert wc.simhash_fingerprint("too short") is None
+    assert wc.simhash_fingerprint("中文內容也可以") is not None
+    assert wc.format_fingerprint(None) is None
+    assert wc.format_fingerprint(0xABC) == "0000000000000abc"
+
+
+def test_index_finds_near_duplicates(index):
+    fingerprint = wc.simhash_fingerprint(TEXT)
+    assert index.find(fingerprint) is None
+    index.add(fingerprint, "example.com", RESULT)
+    # 最高位元為 1 的指紋在 SQLite 中以有號整數儲存
+    high = fingerprint | 1 << 63
+    index.add(high ^ 0xFFFF, "high.example.com", RESULT)
+
+    cluster = index.find(fingerprint ^ 0b101)
+    assert cluster["domain"] == "example.com" and cluster["distance"] == 2
+    assert index.find(high ^ 0xFFFF ^ 1)["domain"] == "high.example.com"
+    assert index.find(fingerprint ^ 0b1111) is None
+    assert index.stats == {"lookups": 4, "hits": 0, "clusters_added": 2}
+
+
+def members(index):
+    return dict(index.conn.execute("SELECT domain, members FROM simhash_clusters").fetchall())
+
+
+def test_find_has_no_side_effects_until_inherited(index):
+    fingerprint = wc.simhash_fingerprint(TEXT)
+    index.add(fingerprint, "example.com", RESULT)
+    cluster = index.find(fingerprint)
+    index.find(fingerprint)
+    assert members(index) == {"example.com": 1}
+    index.mark_inherited(cluster)
+    assert members(index) == {"example.com": 2}
+    assert index.stats["hits"] == 1
+
+
+def test_find_is_exact_when_many_clusters_share_a_band(index):
+    # 300 個群集共用最低的 16 位元分段，但與查詢指紋的距離都超過門檻
+    for i in range(1, 301):
+        index.add(i << 16 | i << 32 | i << 48, f"noise{i}.example.com", RESULT)
+    target = 0xFFFF << 16
+    index.add(target, "target.example.com", RESULT)
+    assert index.find(target ^ 1 << 20)["domain"] == "target.example.com"
+
+
+def test_index_ignores_invalid_results(index):
+    index.add(wc.simhash_fingerprint(TEXT), "example.com", {"main_category_code": "010", "subcategory_code": "020-01"})
+    assert index.find(wc.simhash_fingerprint(TEXT)) is None
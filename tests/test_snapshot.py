@@ -0,0 +1,83 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import web_classifier as wc
+
+
+def classify(db_manager, domain, sub_code):
+    db_manager.add_domain_classification(domain, sub_code[:3], wc.MAIN_CATEGORY_MAP[sub_code[:3]], sub_code,
+                                         wc.SUBCATEGORY_MAP[sub_code], None, f"http://{domain}")
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    db_manager = wc.DatabaseManager(str(tmp_path / "crawl.db"))
+    db_manager.setup_tables()
+    classify(db_manager, "example.com", "010-06")
+    classify(db_manager, "shop.example.org", "010-06")
+    classify(db_manager, "down.example.net", "999-02")
+    classify(db_manager, "failed.example.net", "999-99")
+    classify(db_manager, "parked.example.net", "999-03")
+    path = str(tmp_path / "snapshot.bin")
+    try:
+        count = wc.export_domain_snapshot(db_manager, path)
+    finally:
+        db_manager.close()
+    snapshot = wc.DomainSnapshot(path)
+    yield snapshot, count
+    snapshot.close()
+
+
+def test_export_skips_failure_codes(snapshot):
+    snapshot, count = snapshot
+    assert count == 3
+    assert snapshot.lookup("down.example.net") == (None, None)
+    assert snapshot.lookup("failed.example.net") == (None, None)
+    assert snapshot.lookup("parked.example.net") == ("parked.example.net", "999-03")
+
+
+def test_lookup_round_trip_matches_parent_domains(snapshot):
+    snapshot, _ = snapshot
+    assert snapshot.lookup("www.example.com") == ("example.com", "010-06")
+    assert snapshot.lookup("https://a.b.example.com:443/path") == ("example.com", "010-06")
+    assert snapshot.lookup("example.org") == (None, None)
+    assert snapshot.describe("shop.example.org")["subcategory_name"] == wc.SUBCATEGORY_MAP["010-06"]
+
+
+@pytest.fixture
+def lookup_url(snapshot):
+    snapshot, _ = snapshot
+    server = ThreadingHTTPServer(("127.0.0.1", 0), type("Handler", (wc.LookupHTTPHandler,), {"snapshot": snapshot}))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/lookup"
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_post_lookup(lookup_url):
+    status, body = post(lookup_url, ["www.example.com", "unknown.test"])
+    assert status == 200
+    assert body["www.example.com"]["matched"] == "example.com"
+    assert body["unknown.test"] is None
+
+
+@pytest.mark.parametrize("payload", [{"domain": "example.com"}, ["example.com", 1], [None]])
+def test_post_lookup_rejects_non_string_domains(lookup_url, payload):
+    status, body = post(lookup_url, payload)
+    assert status == 400
+    assert "error" in body
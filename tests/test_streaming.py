@@ -0,0 +1,93 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import web_classifier as wc
+
+
+def test_find_json_object_end_handles_nesting_and_strings():
+    text = 'noise {"a": {"b": "}"}, "c": "\\"{"} trailing'
+    end = wc.find_json_object_end(text)
+    assert json.loads(text[text.find("{"):end]) == {"a": {"b": "}"}, "c": "\"{"}
+    assert wc.find_json_object_end('{"a": {"b": 1}') == -1
+    assert wc.find_json_object_end("no json") == -1
+
+
+def test_parser_strips_split_think_tags():
+    parser = wc.StreamingResponseParser(expect_json=True)
+    for piece in ["<thi", "nk>ponder {\"x\": 1}</th", "ink>", '{"main_category_code": "010"', ', "subcategory_code": "010-06"}']:
+        parser.feed(piece)
+    assert parser.done
+    assert parser.finish() == {"main_category_code": "010", "subcategory_code": "010-06"}
+    assert parser.thinking_tokens > 0
+
+
+def test_parser_stops_on_first_sentence():
+    parser = wc.StreamingResponseParser(stop_on_sentence=True)
+    assert not parser.feed("這是一個新聞")
+    assert parser.feed("網站。後面的內容")
+    assert parser.finish() == "這是一個新聞網站。"
+
+
+def test_parser_does_not_stop_on_schema_invalid_object():
+    parser = wc.StreamingResponseParser(expect_json=True, validator=wc.is_classification_valid)
+    assert not parser.feed('{"main_category_code": "010", "subcategory_code": "020-01"}')
+    assert parser.finish() == {"main_category_code": "010", "subcategory_code": "020-01"}
+
+    parser = wc.StreamingResponseParser(expect_json=True, validator=wc.is_classification_valid)
+    assert parser.feed('{"main_category_code": "010", "subcategory_code": "010-06"}')
+
+
+def test_parser_stops_on_valid_object_after_invalid_one():
+    parser = wc.StreamingResponseParser(expect_json=True, validator=wc.is_classification_valid)
+    assert not parser.feed('範例: {"main_category_code": "010", "subcategory_code": "020-01"}\n')
+    assert not parser.feed('{"main_category_code": "010", ')
+    assert parser.feed('"subcategory_code": "010-06"} 多餘的文字')
+    assert parser.finish() == {"main_category_code": "010", "subcategory_code": "010-06"}
+
+
+class StreamingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    chunks = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = b"".join(json.dumps(chunk).encode() + b"\n" for chunk in self.chunks)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stream_server():
+    pieces = ['{"main_category_code": ', '"010", ', '"subcategory_code": ', '"010-06"}']
+    chunks = [{"response": piece, "done": False} for piece in pieces]
+    chunks.append({"response": "", "done": True, "prompt_eval_count": 50, "eval_count": 4})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), type("Handler", (StreamingHandler,), {"chunks": chunks}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/api/generate"
+    server.shutdown()
+    server.server_close()
+
+
+def test_early_stopped_stream_reports_client_timings(stream_server):
+    client = wc.OllamaClient([stream_server], stream=True)
+    parser = wc.StreamingResponseParser(expect_json=True, validator=wc.is_classification_valid)
+    data = client.generate({"model": "m", "prompt": "p"}, parser=parser)
+    assert data["stopped_early"] and data["client_timing"]
+    assert data["eval_count"] == 4
+    assert data["prompt_eval_duration"] > 0
+    assert "prompt_eval_count" not in data
+
+    classifier = wc.LocalOllamaClassifier("m", stream_server, wc.CLASSIFICATION_SCHEMA_JSON, client=client, stage_models={})
+    classifier._record_stats(data, parser)
+    assert classifier.stats["eval_count"] == 4
+    assert classifier.stats["prompt_eval_calls"] == 0
+    assert classifier.model_stats["m"]["busy_ns"] > 0
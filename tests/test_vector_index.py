@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import web_classifier as wc
+
+
+def test_load_truncates_tail_written_after_last_meta(tmp_path):
+    base = str(tmp_path / "index")
+    index = wc.VectorIndex(base, dim=64)
+    index.add("a.com", "010-06", "新聞 媒體 報導")
+    index.add("b.com", "020-01", "線上 購物 商城")
+    index.flush()
+    # 模擬附加資料後、更新 meta 前中斷
+    with open(index.vector_path, "ab") as f:
+        f.write(np.ones(64, dtype=np.float32).tobytes())
+    with open(index.rows_path, "a", encoding="utf-8") as f:
+        f.write("stale.com\t030-01\tstale\n")
+
+    reloaded = wc.VectorIndex(base, dim=64)
+    assert len(reloaded) == 2
+    assert os.path.getsize(reloaded.vector_path) == 2 * 64 * 4
+    reloaded.add("c.com", "030-01", "遊戲 娛樂 電玩")
+    reloaded.flush()
+
+    final = wc.VectorIndex(base, dim=64)
+    assert [row[0] for row in final.rows] == ["a.com", "b.com", "c.com"]
+    assert final.search("遊戲 娛樂 電玩", k=1)[0][1] == "c.com"
+
+
+def test_files_without_meta_are_discarded(tmp_path):
+    base = str(tmp_path / "index")
+    with open(base + ".tsv", "w", encoding="utf-8") as f:
+        f.write("stale.com\t030-01\tstale\n")
+    index = wc.VectorIndex(base, dim=64)
+    assert len(index) == 0 and not os.path.exists(base + ".tsv")
+
+
+def test_knn_indexes_and_queries_summary_only(tmp_path):
+    index = wc.VectorIndex(str(tmp_path / "index"), dim=64)
+    knn = wc.KnnClassifier(index, min_similarity=0.99, min_neighbours=1)
+    knn.remember("a.com", {"main_category_code": "010", "subcategory_code": "010-06", "summary": "新聞 媒體 報導"})
+    result, _ = knn.classify("新聞 媒體 報導")
+    assert result["subcategory_code"] == "010-06"
@@ -1,27 +1,182 @@
 import os
+import sys
+import csv
+import argparse
+import bisect
+import socketserver
 import sqlite3
 import requests
+import requests.adapters
 import time
 import json
 import re
-from bs4 import BeautifulSoup
-from collections import deque
-from urllib.parse import urljoin, urlparse
+import asyncio
+import threading
+import queue
+import socket
+import struct
+import math
+import mmap
+import hashlib
+import hmac
+import zlib
+import signal
+import subprocess
+from contextlib import contextmanager
+from html import unescape
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin, urlparse, parse_qs
+from urllib.robotparser import RobotFileParser
 
 try:
     from selenium import webdriver
     from selenium.webdriver.chrome.service import Service as ChromeService
     from selenium.webdriver.chrome.options import Options as ChromeOptions
+    from selenium.common.exceptions import TimeoutException, WebDriverException
     from webdriver_manager.chrome import ChromeDriverManager
     SELENIUM_AVAILABLE = True
 except ImportError:
     SELENIUM_AVAILABLE = False
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
 USE_LOCAL_AI = True 
 LOCAL_AI_MODEL = 'deepseek-r1:32b' 
 LOCAL_AI_URL = 'http://localhost:11434/api/generate' 
 
-SELENIUM_HEADLESS = False
+OLLAMA_ENDPOINTS = [LOCAL_AI_URL]
+OLLAMA_MAX_IN_FLIGHT = 4
+OLLAMA_REQUEST_TIMEOUT = 180
+OLLAMA_STREAM_RESPONSES = True
+OLLAMA_CIRCUIT_FAILURE_THRESHOLD = 3
+OLLAMA_CIRCUIT_COOLDOWN = 30
+OLLAMA_MAX_THINKING_TOKENS = 0  # 0 表示不限制思考長度
+
+PROMPT_CACHE_MODE = True
+OLLAMA_CONTEXT_WINDOW = 8192
+
+USE_LLM_CACHE = True
+LLM_CACHE_PATH = "llm_cache.db"
+LLM_CACHE_TTL = 30 * 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 500_000
+LLM_CACHE_EVICT_EVERY = 1000
+LLM_CACHE_BYPASS = False
+
+USE_BATCH_KNOWLEDGE = True
+KNOWLEDGE_BATCH_SIZE = 8
+KNOWLEDGE_BATCH_MAX_SIZE = 32
+KNOWLEDGE_BATCH_TOKENS_PER_URL = 120
+KNOWLEDGE_BATCH_MAX_FAILURE_RATE = 0.25
+OLLAMA_KEEP_ALIVE = "30m"
+OLLAMA_REUSE_CONTEXT = False
+
+# 模型串聯：各階段的模型清單，除最後一個外皆為先行嘗試的小模型，最後一個為升級用的大模型；只有一個模型時不串聯。
+# 分類階段 (knowledge / metadata) 在小模型結果無效、自評信心不足或多個小模型彼此不一致時才升級；
+# 摘要階段在小模型未產生摘要時才升級。預設不串聯，啟用時在清單前加入小模型，例如 ["qwen2.5:7b", LOCAL_AI_MODEL]。
+OLLAMA_STAGE_MODELS = {
+    "summary": [LOCAL_AI_MODEL],
+    "knowledge": [LOCAL_AI_MODEL],
+    "metadata": [LOCAL_AI_MODEL],
+}
+CASCADE_MIN_CONFIDENCE = 0.7  # 小模型未提供自評信心時視為信心不足
+CASCADE_ESCALATE_UNKNOWN = True  # 小模型皆表示不認識網站時，仍交給大模型以知識庫再判斷一次
+CASCADE_REASON_TEXT = {"invalid": "無效", "low_confidence": "信心不足", "disagree": "彼此不一致",
+                       "unknown": "不認識網站", "empty": "為空"}
+
+USE_PRECLASSIFIER = True
+PRECLASSIFIER_CONFIDENCE_THRESHOLD = 0.9
+PRECLASSIFIER_RULES_PATH = "preclassifier_rules.json"
+PRECLASSIFIER_MIN_TRAINING_ROWS = 200
+PRECLASSIFIER_MIN_MODEL_ACCURACY = 0.9
+PRECLASSIFIER_AUDIT_RATE = 0.02
+PRECLASSIFIER_HASH_BUCKETS = 2 ** 18
+PRECLASSIFIER_SMOOTHING = 0.1
+PRECLASSIFIER_TEXT_CHARS = 2000
+PRECLASSIFIER_PENDING_LIMIT = 100_000
+
+USE_EMBEDDING_KNN = True
+EMBEDDING_INDEX_PATH = "summary_index"
+EMBEDDING_DIM = 512
+EMBEDDING_KNN_K = 5
+EMBEDDING_MIN_SIMILARITY = 0.5
+EMBEDDING_MIN_NEIGHBOURS = 3
+EMBEDDING_FEW_SHOT = 3
+EMBEDDING_FEW_SHOT_MIN_SIMILARITY = 0.2
+EMBEDDING_MIN_INDEX_SIZE = 100
+EMBEDDING_SNIPPET_CHARS = 160
+EMBEDDING_FLUSH_EVERY = 200
+EMBEDDING_EXCLUDED_CODES = {"999-01", "999-02", "999-99"}
+
+USE_NEAR_DUPLICATE_DETECTION = True
+SIMHASH_DB_PATH = "page_fingerprints.db"
+SIMHASH_SHINGLE_SIZE = 4
+SIMHASH_MAX_DISTANCE = 3  # 64 位元中最多幾個位元不同仍視為近似重複 (4 個分段可保證找到 ≤ 3 的候選)
+
+LOOKUP_SNAPSHOT_PATH = "domain_snapshot.bin"
+LOOKUP_HTTP_HOST = "127.0.0.1"
+LOOKUP_HTTP_PORT = 8765
+SNAPSHOT_WRITE_CHUNK = 65536
+SNAPSHOT_EXCLUDED_CODES = {"999-01", "999-02", "999-99"}  # 待分類、無法訪問與分類失敗的紀錄不是分類結果，不匯出
+
+BULK_WORKERS = 8
+BULK_CHUNK_SIZE = 500
+BULK_OUTPUT_PATH = "bulk_results.jsonl"
+
+SELENIUM_HEADLESS = True
+SELENIUM_POOL_SIZE = 2
+SELENIUM_MAX_PAGES_PER_DRIVER = 50
+SELENIUM_PAGE_TIMEOUT = 20
+SELENIUM_READY_TIMEOUT = 10
+SELENIUM_NETWORK_IDLE_MS = 500
+
+POLITENESS_DEFAULT_DELAY = 1.0
+POLITENESS_PER_IP_DELAY = 0.25
+POLITENESS_MAX_CRAWL_DELAY = 30
+POLITENESS_CACHE_SIZE = 10000
+POLITENESS_PICK_WINDOW = 32
+ROBOTS_CACHE_TTL = 24 * 3600
+ROBOTS_FETCH_TIMEOUT = 5
+
+FETCH_TIMEOUT = 15
+USE_ASYNC_FETCHER = True
+ASYNC_FETCH_CONCURRENCY = 64
+ASYNC_FETCH_PER_HOST = 2
+DNS_CACHE_TTL = 300
+FETCH_MAX_BYTES = 1_000_000
+FETCH_BODY_BYTES_AFTER_HEAD = 256 * 1024  # 讀到 </head> 後再讀取的位元組數，0 表示讀到上限為止
+FETCH_CHUNK_BYTES = 16384
+FETCH_HEAD_PROBE = False  # 先以 HEAD 請求確認內容類型，再決定是否 GET
+FETCH_HTML_CONTENT_TYPES = {"text/html", "application/xhtml+xml", "text/plain"}
+FETCH_VALIDATOR_PATH = "fetch_validators.db"
+
+PAGE_TEXT_MAX_CHARS = 8000
+PAGE_CACHE_SIZE = 256
+PAGE_PARSE_CHUNK_CHARS = 16384
+
+METRICS_ENABLED = True
+METRICS_PREFIX = "url_classifier_"
+METRICS_HTTP_HOST = "127.0.0.1"
+METRICS_HTTP_PORT = 9108  # None 表示不啟動 Prometheus 端點
+METRICS_JSONL_PATH = None  # 例如 "metrics.jsonl"，定期附加一行指標快照
+METRICS_JSONL_INTERVAL = 30
+METRICS_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PROFILE_SIGNAL = "SIGUSR1"  # 收到此訊號時開關效能剖析，None 表示不註冊
+PROFILE_OUTPUT_PATH = "crawler_profile.folded"
+PROFILE_SAMPLE_INTERVAL = 0.01
+PROFILE_TOP_FUNCTIONS = 25
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL_NAME = 'gemini-2.5-pro'
@@ -40,6 +195,50 @@ MAX_DOMAINS_TO_CRAWL = 20
 MAX_CLASSIFICATION_RETRIES = 3
 RETRY_DELAY = 5
 
+USE_ASYNC_PIPELINE = True
+PIPELINE_QUEUE_SIZE = 32
+PIPELINE_FETCH_CONCURRENCY = 8
+PIPELINE_PARSE_CONCURRENCY = 2
+PIPELINE_CLASSIFY_CONCURRENCY = 2
+PIPELINE_PERSIST_CONCURRENCY = 1
+
+DB_WRITE_BATCH_SIZE = 500
+DB_WRITE_FLUSH_INTERVAL = 2.0
+DB_BUSY_TIMEOUT = 30  # 多個 worker 共用資料庫時，等待其他行程寫入鎖的秒數
+
+FRONTIER_CLAIM_BATCH = 50
+FRONTIER_LEASE_SECONDS = 600
+FRONTIER_MAX_ATTEMPTS = 3
+FRONTIER_PAGE_SIZE = 10000
+FRONTIER_SEED_PRIORITY = 10
+
+SHARD_IDLE_TIMEOUT = 60  # 分片模式下本分片暫無待辦項目時，最多等待其他分片送來新連結的秒數
+SHARD_IDLE_POLL = 2
+FRONTIER_SERVICE_HOST = "127.0.0.1"
+FRONTIER_SERVICE_PORT = 8766
+FRONTIER_RPC_TIMEOUT = 30
+# 服務端與 worker 共用的驗證權杖，以 X-Frontier-Token 標頭傳送；未設定時不驗證，只應綁定本機位址
+FRONTIER_SERVICE_TOKEN = os.getenv("FRONTIER_SERVICE_TOKEN")
+FRONTIER_TOKEN_HEADER = "X-Frontier-Token"
+
+# 新鮮度排程：已分類的域名定期以條件式請求重新檢查，內容指紋改變時才重新分類
+RECHECK_INTERVAL = 30 * 24 * 3600
+RECHECK_FAILURE_CODES = ("999-02", "999-99")  # 無法訪問或分類失敗的紀錄，依失敗次數指數退避後重試
+RECHECK_BACKOFF_BASE = 6 * 3600
+RECHECK_BACKOFF_MAX = 90 * 24 * 3600
+RECHECK_BATCH_SIZE = 50
+RECHECK_POLL_INTERVAL = 300  # recheck --loop 時，沒有到期項目後等待的秒數
+
+DOMAIN_NORMALIZATION = 'registrable'
+CLASSIFICATION_INHERIT_POLICY = 'registrable'
+PUBLIC_SUFFIX_LIST_PATH = "public_suffix_list.dat"
+
+SEEN_INDEX_BACKEND = 'bloom'
+SEEN_FILTER_PATH = "domain_seen.bloom"
+SEEN_FILTER_INITIAL_CAPACITY = 1_000_000
+SEEN_FILTER_ERROR_RATE = 0.001
+SEEN_INDEX_RECENT_CACHE = 50_000
+
 CLASSIFICATION_SCHEMA_JSON = """
 {
   "classification_info": {
@@ -210,12 +409,483 @@ def build_code_maps(schema):
 
 MAIN_CATEGORY_MAP, SUBCATEGORY_MAP = build_code_maps(CLASSIFICATION_SCHEMA)
 
+def is_classification_valid(result):
+    """驗證分類結果是否合乎邏輯 (代碼存在且子類別屬於主類別)"""
+    if not result or not isinstance(result, dict):
+        return False
+    main_cat_code = result.get("main_category_code")
+    sub_cat_code = result.get("subcategory_code")
+    
+    if not main_cat_code or not sub_cat_code:
+        return False
+    if main_cat_code not in MAIN_CATEGORY_MAP:
+        return False
+    if sub_cat_code not in SUBCATEGORY_MAP:
+        return False
+    if not sub_cat_code.startswith(main_cat_code):
+        return False
+    return True
+
+def is_knowledge_answer_valid(result):
+    """知識庫分類回覆是否可用：明確表示不認識網站，或為有效的分類"""
+    return isinstance(result, dict) and (result.get("known") is False or is_classification_valid(result))
+
+def is_batch_knowledge_answer_valid(result):
+    """批次知識庫分類回覆是否可用：results 陣列中的每一筆皆為可用的知識庫分類回覆"""
+    entries = result.get("results") if isinstance(result, dict) else result
+    return isinstance(entries, list) and bool(entries) and all(is_knowledge_answer_valid(entry) for entry in entries)
+
+STAGE_VALIDATORS = {"knowledge": is_knowledge_answer_valid, "knowledge_batch": is_batch_knowledge_answer_valid,
+                    "metadata": is_classification_valid}
+
+def render_compact_schema(schema):
+    """將分類法精簡為僅含代碼與名稱的文字，大幅減少提示的 token 數"""
+    lines = []
+    for category in schema["website_classifications"]:
+        category_name = re.sub(r"^[^\w(]+", "", category["category_zh"]).strip()
+        subcategories = "; ".join(f'{sub["sub_code"]} {sub["name_zh"]}' for sub in category["subcategories"])
+        lines.append(f'{category["code"]} {category_name}: {subcategories}')
+    return "\n".join(lines)
+
+COMPACT_SCHEMA_TEXT = render_compact_schema(CLASSIFICATION_SCHEMA)
+
+# 未提供 public_suffix_list.dat 時使用的內建後綴規則 (僅列多層級後綴，單層 TLD 由預設規則 "*" 涵蓋)
+BUILTIN_PUBLIC_SUFFIX_RULES = """
+com.tw net.tw org.tw edu.tw gov.tw idv.tw game.tw ebiz.tw club.tw mil.tw
+co.uk org.uk me.uk ltd.uk plc.uk net.uk ac.uk gov.uk sch.uk nhs.uk police.uk
+co.jp ne.jp or.jp ac.jp go.jp ad.jp ed.jp gr.jp lg.jp
+com.cn net.cn org.cn gov.cn edu.cn ac.cn
+com.hk net.hk org.hk edu.hk gov.hk idv.hk
+com.au net.au org.au edu.au gov.au asn.au id.au
+co.kr or.kr ne.kr go.kr ac.kr re.kr
+com.sg net.sg org.sg edu.sg gov.sg
+com.my net.my org.my edu.my gov.my
+co.in net.in org.in ac.in gov.in
+co.nz net.nz org.nz ac.nz govt.nz
+com.br net.br org.br gov.br edu.br
+com.mx org.mx gob.mx edu.mx
+co.za org.za gov.za ac.za
+com.tr org.tr gov.tr edu.tr
+com.vn net.vn org.vn gov.vn edu.vn
+co.th or.th ac.th go.th in.th
+co.id or.id ac.id go.id web.id
+com.ph net.ph org.ph gov.ph edu.ph
+com.ar gob.ar com.co gov.co com.pe
+com.ru org.ru net.ru co.il org.il ac.il gov.il
+github.io gitlab.io blogspot.com herokuapp.com appspot.com netlify.app vercel.app pages.dev workers.dev
+azurewebsites.net cloudfront.net web.app firebaseapp.com
+"""
+
+class PublicSuffixList:
+    """離線的 Public Suffix List 解析器，用於計算可註冊網域 (eTLD+1)"""
+    def __init__(self, rules):
+        self.exact, self.wildcards, self.exceptions = set(), set(), set()
+        for rule in rules:
+            rule = rule.strip().lower()
+            if not rule or rule.startswith("//"):
+                continue
+            rule = rule.split()[0]
+            if rule.startswith("!"):
+                self.exceptions.add(rule[1:])
+            elif rule.startswith("*."):
+                self.wildcards.add(rule[2:])
+            else:
+                self.exact.add(rule)
+
+    @classmethod
+    def load(cls, path):
+        """讀取 PSL 檔案，不存在時退回內建規則"""
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                psl = cls(f)
+            print(f"已載入 Public Suffix List: {path}")
+            return psl
+        return cls(BUILTIN_PUBLIC_SUFFIX_RULES.split())
+
+    def public_suffix(self, host):
+        labels = host.split(".")
+        for i in range(len(labels)):
+            candidate = ".".join(labels[i:])
+            if candidate in self.exceptions:
+                return ".".join(labels[i + 1:])
+            if candidate in self.exact:
+                return candidate
+            if i + 1 < len(labels) and ".".join(labels[i + 1:]) in self.wildcards:
+                return candidate
+        # 預設規則 "*"：最右側的標籤即為公開後綴
+        return labels[-1]
+
+    def registrable_domain(self, host):
+        suffix = self.public_suffix(host)
+        if host == suffix:
+            return host
+        prefix = host[:-len(suffix) - 1]
+        return f"{prefix.rsplit('.', 1)[-1]}.{suffix}"
+
+_PUBLIC_SUFFIX_LIST = None
+
+def get_public_suffix_list():
+    global _PUBLIC_SUFFIX_LIST
+    if _PUBLIC_SUFFIX_LIST is None:
+        _PUBLIC_SUFFIX_LIST = PublicSuffixList.load(PUBLIC_SUFFIX_LIST_PATH)
+    return _PUBLIC_SUFFIX_LIST
+
+def canonicalize_host(netloc):
+    """將 netloc 正規化為小寫、去除帳密、連接埠與結尾句點的 IDNA 主機名稱"""
+    host = netloc.rsplit("@", 1)[-1].strip().lower()
+    if host.startswith("["):
+        return host.split("]", 1)[0] + "]"
+    host = host.split(":", 1)[0].rstrip(".")
+    try:
+        host = host.encode("idna").decode("ascii")
+    except UnicodeError:
+        pass
+    return host
+
+def registrable_domain(host):
+    """回傳主機名稱的可註冊網域 (eTLD+1)，IP 位址則原樣回傳"""
+    if not host or host.startswith("[") or host.replace(".", "").isdigit():
+        return host
+    return get_public_suffix_list().registrable_domain(host)
+
+def domain_key(url):
+    """依 DOMAIN_NORMALIZATION 設定取得 URL 用於佇列、去重與分類紀錄的域名鍵"""
+    host = canonicalize_host(urlparse(url).netloc)
+    if not host:
+        return None
+    if DOMAIN_NORMALIZATION == "registrable":
+        return registrable_domain(host)
+    return host
+
+def domain_shard_key(domain):
+    """域名的穩定雜湊 (跨行程、跨機器一致)，以 shard_key % 分片數 決定負責的分片"""
+    return zlib.crc32((domain or "").encode("utf-8"))
+
+def shard_path(path, shard):
+    """分片 worker 各自使用的本機檔案路徑 (例如 Bloom filter、向量索引)，未分片時原樣回傳"""
+    return f"{path}.shard{shard[0]}" if shard else path
+
+def recheck_delay(attempts):
+    """下次重新檢查前的等待秒數：最近一次檢查成功時為固定間隔，連續失敗時依次數指數退避"""
+    if not attempts:
+        return RECHECK_INTERVAL
+    return min(RECHECK_BACKOFF_MAX, RECHECK_BACKOFF_BASE * 2 ** (attempts - 1))
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+class MetricsRegistry:
+    """執行緒安全的計數器、量測值 (gauge) 與延遲直方圖，可輸出 Prometheus 文字格式或 JSON 快照"""
+    def __init__(self, prefix=None, buckets=None, enabled=None):
+        self.prefix = METRICS_PREFIX if prefix is None else prefix
+        self.buckets = tuple(buckets or METRICS_LATENCY_BUCKETS)
+        self.enabled = METRICS_ENABLED if enabled is None else enabled
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """記錄一筆觀測值 (秒)；各區間只記錄落在該區間的筆數，輸出時再累加"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """量測 with 區塊的耗時 (含例外結束的情況)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def _copy(self):
+        with self._lock:
+            return (sorted(self._counters.items()), sorted(self._gauges.items()),
+                    sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._histograms.items()))
+
+    def render_prometheus(self):
+        """輸出 Prometheus text exposition 格式"""
+        counters, gauges, histograms = self._copy()
+        lines = []
+        declared = set()
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in series:
+                if name not in declared:
+                    declared.add(name)
+                    lines.append(f"# TYPE {self.prefix}{name} {kind}")
+                lines.append(f"{self.prefix}{name}{_format_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {self.prefix}{name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.prefix}{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{self.prefix}{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.prefix}{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{self.prefix}{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def _quantile(self, counts, count, q):
+        """以區間上界估計分位數，落在最後一個區間之外時回傳 None"""
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= q * count:
+                return bound
+        return None
+
+    def snapshot(self):
+        """回傳可序列化為 JSON 的指標快照，直方圖以次數、總和與估計分位數表示"""
+        counters, gauges, histograms = self._copy()
+        return {
+            "timestamp": time.time(),
+            "counters": {f"{name}{_format_labels(labels)}": value for (name, labels), value in counters},
+            "gauges": {f"{name}{_format_labels(labels)}": value for (name, labels), value in gauges},
+            "histograms": {
+                f"{name}{_format_labels(labels)}": {
+                    "count": count, "sum": round(total, 6),
+                    "p50": self._quantile(counts, count, 0.5), "p95": self._quantile(counts, count, 0.95),
+                    "p99": self._quantile(counts, count, 0.99),
+                }
+                for (name, labels), (counts, total, count) in histograms
+            },
+        }
+
+METRICS = MetricsRegistry()
+
+class SamplingProfiler:
+    """
+    可在執行中開關的取樣式效能剖析器：背景執行緒定期讀取所有執行緒的呼叫堆疊，
+    停止時將折疊堆疊 (collapsed stacks，可直接餵給 flamegraph / speedscope) 寫入檔案並回傳耗時最多的函式摘要。
+    與 cProfile 不同，可涵蓋 asyncio.to_thread 與執行緒池中的工作，且開銷與呼叫次數無關。
+    """
+    def __init__(self, output_path=None, interval=None):
+        self.output_path = output_path or PROFILE_OUTPUT_PATH
+        self.interval = interval or PROFILE_SAMPLE_INTERVAL
+        self._stacks = {}
+        self._samples = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._stacks = {}
+            self._samples = 0
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        print(f"🔬 效能剖析已啟動 (每 {self.interval * 1000:.0f} ms 取樣一次)。")
+        return True
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+            self._samples += 1
+
+    def stop(self):
+        """停止取樣、寫入折疊堆疊檔案，回傳耗時最多函式的文字摘要；未啟動時回傳 None"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return None
+            self._stop_event.set()
+            thread.join()
+        with open(self.output_path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self._stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        report = self.summary()
+        print(f"🔬 效能剖析已停止，{self._samples} 次取樣已寫入 '{self.output_path}'。\n{report}")
+        return report
+
+    def toggle(self):
+        return self.stop() if self.running else self.start()
+
+    def summary(self, limit=None):
+        """依自身 (堆疊頂端) 與累計 (出現在堆疊中) 取樣數列出最耗時的函式"""
+        own, cumulative = {}, {}
+        total = sum(self._stacks.values()) or 1
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for frame in set(frames):
+                cumulative[frame] = cumulative.get(frame, 0) + count
+        lines = [f"{'自身%':>6} {'累計%':>6}  函式"]
+        for frame, count in sorted(own.items(), key=lambda item: -item[1])[:limit or PROFILE_TOP_FUNCTIONS]:
+            lines.append(f"{count / total * 100:6.1f} {cumulative[frame] / total * 100:6.1f}  {frame}")
+        return "\n".join(lines)
+
+PROFILER = SamplingProfiler()
+
+class MetricsHTTPHandler(BaseHTTPRequestHandler):
+    """GET /metrics (Prometheus)、GET /metrics.json (JSON 快照)、POST /profile/start 與 /profile/stop 開關效能剖析"""
+    protocol_version = "HTTP/1.1"
+    registry = None
+    profiler = None
+
+    def _send(self, status, body, content_type):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self._send(200, self.registry.render_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/metrics.json":
+            self._send(200, json.dumps(self.registry.snapshot(), ensure_ascii=False), "application/json; charset=utf-8")
+        else:
+            self._send(404, "not found\n", "text/plain; charset=utf-8")
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path == "/profile/start":
+            started = self.profiler.start()
+            self._send(200 if started else 409, "started\n" if started else "already running\n", "text/plain; charset=utf-8")
+        elif path == "/profile/stop":
+            report = self.profiler.stop()
+            self._send(200 if report is not None else 409, (report or "not running") + "\n", "text/plain; charset=utf-8")
+        else:
+            self._send(404, "not found\n", "text/plain; charset=utf-8")
+
+    def log_message(self, *args):
+        pass
+
+class MetricsExporter:
+    """依設定啟動 Prometheus HTTP 端點、定期寫入 JSONL 指標檔，並以訊號 (預設 SIGUSR1) 開關效能剖析"""
+    def __init__(self, registry=None, profiler=None, host=None, port=None, jsonl_path=None, interval=None):
+        self.registry = registry or METRICS
+        self.profiler = profiler or PROFILER
+        self.host = host or METRICS_HTTP_HOST
+        self.port = METRICS_HTTP_PORT if port is None else port
+        self.jsonl_path = METRICS_JSONL_PATH if jsonl_path is None else jsonl_path
+        self.interval = interval or METRICS_JSONL_INTERVAL
+        self._server = None
+        self._writer = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        if not self.registry.enabled:
+            return self
+        if self.port is not None:
+            handler = type("Handler", (MetricsHTTPHandler,), {"registry": self.registry, "profiler": self.profiler})
+            try:
+                self._server = ThreadingHTTPServer((self.host, self.port), handler)
+            except OSError as e:
+                print(f"警告：無法啟動指標端點 {self.host}:{self.port} ({e})。")
+            else:
+                self._server.daemon_threads = True
+                threading.Thread(target=self._server.serve_forever, daemon=True).start()
+                print(f"📈 指標端點已啟動: http://{self.host}:{self._server.server_port}/metrics")
+        if self.jsonl_path:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+            print(f"📈 每 {self.interval} 秒將指標快照附加至 '{self.jsonl_path}'。")
+        profile_signal = getattr(signal, PROFILE_SIGNAL, None) if PROFILE_SIGNAL else None
+        if profile_signal is not None and threading.current_thread() is threading.main_thread():
+            signal.signal(profile_signal, lambda signum, frame: self.profiler.toggle())
+            print(f"🔬 可傳送 {PROFILE_SIGNAL} (kill -{PROFILE_SIGNAL[3:]} {os.getpid()}) 開關效能剖析。")
+        return self
+
+    def _write_snapshot(self):
+        try:
+            with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.registry.snapshot(), ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"  - 寫入指標檔案時發生錯誤: {e}")
+
+    def _write_loop(self):
+        while not self._stop_event.wait(self.interval):
+            self._write_snapshot()
+
+    def close(self):
+        """停止匯出並寫入最後一筆快照；效能剖析仍在執行時一併停止並寫出結果"""
+        self._stop_event.set()
+        if self._writer:
+            self._writer.join()
+            self._write_snapshot()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        self.profiler.stop()
+
 class DatabaseManager:
-    """負責處理所有與 SQLite 資料庫相關的操作"""
-    def __init__(self, db_name):
-        self.conn = sqlite3.connect(db_name)
+    """
+    負責處理所有與 SQLite 資料庫相關的操作，寫入採批次交易 (write-behind)。
+    shard 為 (分片索引, 分片數) 時只認領 shard_key 屬於該分片的 frontier 項目，多個 worker 可共用同一個資料庫。
+    """
+    CLASSIFICATION_COLUMNS = ("domain", "main_category_code", "subcategory_code", "summary", "source_url", "classified_by")
+
+    def __init__(self, db_name, batch_size=None, flush_interval=None, shard=None):
+        self.conn = sqlite3.connect(db_name, timeout=DB_BUSY_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
         self.cursor = self.conn.cursor()
-        print(f"資料庫 '{db_name}' 連線成功。")
+        self._init_buffers(batch_size, flush_interval, shard)
+        print(f"資料庫 '{db_name}' 連線成功 (WAL 模式)。")
+
+    def _init_buffers(self, batch_size, flush_interval, shard):
+        self.batch_size = batch_size or DB_WRITE_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else DB_WRITE_FLUSH_INTERVAL
+        self.shard = tuple(shard) if shard else None
+        self._pending_classifications = {}
+        self._pending_queue_inserts = {}
+        self._pending_queue_domains = set()
+        self._pending_queue_deletes = set()
+        self._pending_queue_acks = set()
+        self._pending_queue_nacks = set()
+        self._pending_reclassifications = {}
+        self._pending_rechecks = {}
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{id(self):x}"
+        self._last_flush = time.monotonic()
 
     def setup_tables(self):
         """建立所有需要的資料表"""
@@ -236,84 +906,758 @@ class DatabaseManager:
             self.cursor.execute("""
             CREATE TABLE IF NOT EXISTS crawl_queue (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url TEXT NOT NULL UNIQUE
+                url TEXT NOT NULL UNIQUE,
+                domain TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_at REAL,
+                shard_key INTEGER,
+                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
             """)
+            self._migrate_crawl_queue()
+            self._migrate_classified_domains()
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_crawl_queue_claim ON crawl_queue (status, priority DESC, id)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_crawl_queue_domain ON crawl_queue (domain)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_crawl_queue_lease ON crawl_queue (lease_owner)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_classified_next_check ON classified_domains (next_check_at)")
             self.conn.commit()
             print("資料表 'classified_domains' 和 'crawl_queue' 已建立或已存在。")
         except sqlite3.Error as e:
             print(f"建立資料表時發生錯誤: {e}")
 
-    def add_domain_classification(self, domain, main_cat_code, main_cat_name, sub_cat_code, sub_cat_name, summary, source_url):
-        try:
+    def _migrate_crawl_queue(self):
+        """將舊版只有 url 欄位的 crawl_queue 升級為具租約欄位的 frontier"""
+        self.cursor.execute("PRAGMA table_info(crawl_queue)")
+        existing_columns = {row[1] for row in self.cursor.fetchall()}
+        new_columns = [
+            ("domain", "TEXT"),
+            ("status", "TEXT NOT NULL DEFAULT 'pending'"),
+            ("priority", "INTEGER NOT NULL DEFAULT 0"),
+            ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+            ("lease_owner", "TEXT"),
+            ("lease_at", "REAL"),
+            ("shard_key", "INTEGER"),
+            ("added_at", "TIMESTAMP"),
+        ]
+        missing = [(name, definition) for name, definition in new_columns if name not in existing_columns]
+        if not missing:
+            return
+        for name, definition in missing:
+            self.cursor.execute(f"ALTER TABLE crawl_queue ADD COLUMN {name} {definition}")
+        if "domain" not in existing_columns:
+            while True:
+                self.cursor.execute("SELECT id, url FROM crawl_queue WHERE domain IS NULL LIMIT ?", (FRONTIER_PAGE_SIZE,))
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+                self.cursor.executemany("UPDATE crawl_queue SET domain = ? WHERE id = ?",
+                                        [(domain_key(url) or "", row_id) for row_id, url in rows])
+        if "shard_key" not in existing_columns:
+            while True:
+                self.cursor.execute("SELECT id, domain FROM crawl_queue WHERE shard_key IS NULL LIMIT ?", (FRONTIER_PAGE_SIZE,))
+                rows = self.cursor.fetchall()
+                if not rows:
+                    break
+                self.cursor.executemany("UPDATE crawl_queue SET shard_key = ? WHERE id = ?",
+                                        [(domain_shard_key(domain), row_id) for row_id, domain in rows])
+        print(f"資料表 'crawl_queue' 已升級，新增欄位: {', '.join(name for name, _ in missing)}")
+
+    def _migrate_classified_domains(self):
+        """
+        為 classified_domains 新增分類來源 (classified_by，NULL / 'llm' 表示 LLM) 與新鮮度欄位：
+        最後檢查時間、內容指紋、連續失敗次數與下次檢查時間。
+        """
+        self.cursor.execute("PRAGMA table_info(classified_domains)")
+        existing_columns = {row[1] for row in self.cursor.fetchall()}
+        new_columns = [
+            ("classified_by", "TEXT"),
+            ("checked_at", "REAL"),
+            ("content_fingerprint", "TEXT"),
+            ("check_attempts", "INTEGER NOT NULL DEFAULT 0"),
+            ("next_check_at", "REAL"),
+        ]
+        missing = [(name, definition) for name, definition in new_columns if name not in existing_columns]
+        if not missing:
+            return
+        for name, definition in missing:
+            self.cursor.execute(f"ALTER TABLE classified_domains ADD COLUMN {name} {definition}")
+        if "next_check_at" not in existing_columns:
+            # 既有紀錄依分類時間排程：失敗紀錄視為已失敗一次，其餘等到一般的重新檢查間隔
+            failure_codes = ", ".join("?" * len(RECHECK_FAILURE_CODES))
             self.cursor.execute(
-                """INSERT OR IGNORE INTO classified_domains 
-                   (domain, main_category_code, main_category_name, subcategory_code, subcategory_name, summary, source_url) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (domain, main_cat_code, main_cat_name, sub_cat_code, sub_cat_name, summary, source_url)
+                f"""UPDATE classified_domains SET
+                    check_attempts = CASE WHEN subcategory_code IN ({failure_codes}) THEN 1 ELSE 0 END,
+                    next_check_at = COALESCE(CAST(strftime('%s', crawled_at) AS REAL), ?)
+                                    + CASE WHEN subcategory_code IN ({failure_codes}) THEN ? ELSE ? END""",
+                (*RECHECK_FAILURE_CODES, time.time(), *RECHECK_FAILURE_CODES, recheck_delay(1), recheck_delay(0))
             )
-            self.conn.commit()
-            print(f"✅ 成功將分類紀錄新增至資料庫: {domain} -> {sub_cat_name}")
-        except sqlite3.Error as e:
-            print(f"❌ 新增資料至資料庫時發生錯誤: {e}")
+        print(f"資料表 'classified_domains' 已升級，新增欄位: {', '.join(name for name, _ in missing)}")
+
+    def _pending_count(self):
+        return (len(self._pending_classifications) + len(self._pending_queue_inserts) + len(self._pending_queue_deletes)
+                + len(self._pending_queue_acks) + len(self._pending_queue_nacks)
+                + len(self._pending_reclassifications) + len(self._pending_rechecks))
+
+    def _maybe_flush(self):
+        """累積筆數或時間達到門檻時寫入一次交易"""
+        if self._pending_count() >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush_if_due(self):
+        """有暫存寫入且距上次提交已超過 flush_interval 時提交；供沒有新寫入的期間 (閒置、等待 LLM) 定期呼叫"""
+        if self._pending_count() and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """將所有暫存的寫入在單一交易中提交"""
+        self._last_flush = time.monotonic()
+        if not self._pending_count():
+            return
+        classifications = list(self._pending_classifications.values())
+        inserts = list(self._pending_queue_inserts.values())
+        acks = [(url,) for url in self._pending_queue_acks]
+        nacks = [(FRONTIER_MAX_ATTEMPTS, url) for url in self._pending_queue_nacks]
+        deletes = [(url,) for url in self._pending_queue_deletes]
+        reclassifications = list(self._pending_reclassifications.values())
+        rechecks = list(self._pending_rechecks.values())
+        started = time.perf_counter()
+        try:
+            self._write_batch(classifications, inserts, acks, nacks, deletes, reclassifications, rechecks)
+            METRICS.observe("db_flush_seconds", time.perf_counter() - started)
+            METRICS.inc("db_flush_rows_total", len(classifications) + len(inserts) + len(acks) + len(nacks) + len(deletes)
+                        + len(reclassifications) + len(rechecks))
+            self._pending_classifications.clear()
+            self._pending_queue_inserts.clear()
+            self._pending_queue_domains.clear()
+            self._pending_queue_acks.clear()
+            self._pending_queue_nacks.clear()
+            self._pending_queue_deletes.clear()
+            self._pending_reclassifications.clear()
+            self._pending_rechecks.clear()
+        except (sqlite3.Error, requests.exceptions.RequestException) as e:
+            METRICS.inc("db_flush_errors_total")
+            print(f"❌ 批次寫入資料庫時發生錯誤: {e}")
+
+    def _write_batch(self, classifications=(), inserts=(), acks=(), nacks=(), deletes=(), reclassifications=(), rechecks=()):
+        """
+        在單一交易中套用一批寫入；inserts 為 (url, domain, priority, shard_key)。
+        新分類依結果排定首次重新檢查 (失敗紀錄視為已失敗一次)；reclassifications 與 rechecks 更新既有紀錄。
+        """
+        now = time.time()
+        with self.conn:
+            if classifications:
+                rows = []
+                for row in classifications:
+                    attempts = 1 if row[3] in RECHECK_FAILURE_CODES else 0
+                    rows.append(tuple(row) + (attempts, now + recheck_delay(attempts)))
+                self.conn.executemany(
+                    """INSERT OR IGNORE INTO classified_domains 
+                       (domain, main_category_code, main_category_name, subcategory_code, subcategory_name, summary, source_url, classified_by,
+                        content_fingerprint, check_attempts, next_check_at) 
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    rows
+                )
+            if reclassifications:
+                self.conn.executemany(
+                    """UPDATE classified_domains SET main_category_code = ?, main_category_name = ?, subcategory_code = ?,
+                       subcategory_name = ?, summary = ?, source_url = ?, classified_by = ?, crawled_at = CURRENT_TIMESTAMP
+                       WHERE domain = ?""",
+                    reclassifications
+                )
+            if rechecks:
+                self.conn.executemany(
+                    """UPDATE classified_domains SET checked_at = ?, content_fingerprint = COALESCE(?, content_fingerprint),
+                       check_attempts = ?, next_check_at = ? WHERE domain = ?""",
+                    rechecks
+                )
+            if inserts:
+                self.conn.executemany("INSERT OR IGNORE INTO crawl_queue (url, domain, priority, shard_key) VALUES (?, ?, ?, ?)", inserts)
+            if acks:
+                self.conn.executemany("UPDATE crawl_queue SET status = 'done', lease_owner = NULL, lease_at = NULL WHERE url = ?", acks)
+            if nacks:
+                self.conn.executemany(
+                    """UPDATE crawl_queue SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                       lease_owner = NULL, lease_at = NULL WHERE url = ?""",
+                    nacks
+                )
+            if deletes:
+                self.conn.executemany("DELETE FROM crawl_queue WHERE url = ?", deletes)
+
+    def add_domain_classification(self, domain, main_cat_code, main_cat_name, sub_cat_code, sub_cat_name, summary, source_url, classified_by=None,
+                                  content_fingerprint=None):
+        if domain in self._pending_classifications:
+            return
+        self._pending_classifications[domain] = (domain, main_cat_code, main_cat_name, sub_cat_code, sub_cat_name, summary, source_url, classified_by,
+                                                 content_fingerprint)
+        print(f"✅ 分類紀錄已加入寫入佇列: {domain} -> {sub_cat_name}")
+        self._maybe_flush()
+
+    def update_domain_classification(self, domain, main_cat_code, main_cat_name, sub_cat_code, sub_cat_name, summary, source_url, classified_by=None):
+        """以重新分類的結果覆寫既有紀錄 (延遲至下次批次提交)"""
+        self._pending_reclassifications[domain] = (main_cat_code, main_cat_name, sub_cat_code, sub_cat_name, summary, source_url, classified_by, domain)
+        print(f"🔄 域名分類更新已加入寫入佇列: {domain} -> {sub_cat_name}")
+        self._maybe_flush()
+
+    def record_recheck(self, domain, fingerprint=None, attempts=0):
+        """記錄一次重新檢查 (延遲至下次批次提交)；fingerprint 為 None 時保留原指紋，依連續失敗次數排定下次檢查"""
+        now = time.time()
+        self._pending_rechecks[domain] = (now, fingerprint, attempts, now + recheck_delay(attempts), domain)
+        self._maybe_flush()
+
+    def due_for_recheck(self, limit, now=None):
+        """回傳已到重新檢查時間的紀錄 [(domain, source_url, subcategory_code, content_fingerprint, check_attempts)]"""
+        self.flush()
+        return [tuple(row) for row in self._due_rows(limit, now or time.time())]
+
+    def _due_rows(self, limit, now):
+        return self.conn.execute(
+            """SELECT domain, source_url, subcategory_code, content_fingerprint, check_attempts FROM classified_domains
+               WHERE next_check_at <= ? ORDER BY next_check_at LIMIT ?""",
+            (now, limit)
+        ).fetchall()
+
+    def add_domain_classifications(self, rows):
+        """以 executemany 批次新增分類紀錄，rows 的欄位順序同 add_domain_classification (classified_by 與 content_fingerprint 可省略)"""
+        try:
+            self._write_batch(classifications=[tuple(row) + (None,) * (9 - len(row)) for row in rows])
+        except (sqlite3.Error, requests.exceptions.RequestException) as e:
+            print(f"❌ 批次新增資料至資料庫時發生錯誤: {e}")
     
-    def add_to_queue(self, url):
-        """將單一 URL 加入待爬取佇列資料表"""
+    def add_to_queue(self, url, domain=None, priority=0):
+        """將單一 URL 加入待爬取佇列 (延遲至下次批次提交)"""
+        domain = domain or domain_key(url)
+        self._pending_queue_deletes.discard(url)
+        self._pending_queue_inserts[url] = (url, domain, priority, domain_shard_key(domain))
+        self._pending_queue_domains.add(domain)
+        self._maybe_flush()
+
+    def add_many_to_queue(self, urls, priority=0):
+        """以 executemany 批次將 URL 加入待爬取佇列資料表"""
         try:
-            self.cursor.execute("INSERT OR IGNORE INTO crawl_queue (url) VALUES (?)", (url,))
-            self.conn.commit()
-        except sqlite3.Error as e:
-            print(f"將 URL 加入佇列時發生錯誤: {e}")
+            self._write_batch(inserts=[(url, domain_key(url), priority, domain_shard_key(domain_key(url))) for url in urls])
+        except (sqlite3.Error, requests.exceptions.RequestException) as e:
+            print(f"將 URL 批次加入佇列時發生錯誤: {e}")
 
     def remove_from_queue(self, url):
-        """從待爬取佇列資料表中移除單一 URL"""
+        """從待爬取佇列移除單一 URL (延遲至下次批次提交)"""
+        self._pending_queue_inserts.pop(url, None)
+        self._pending_queue_deletes.add(url)
+        self._maybe_flush()
+
+    def remove_many_from_queue(self, urls):
+        """以 executemany 批次從待爬取佇列資料表移除 URL"""
         try:
-            self.cursor.execute("DELETE FROM crawl_queue WHERE url = ?", (url,))
-            self.conn.commit()
-        except sqlite3.Error as e:
-            print(f"從佇列移除 URL 時發生錯誤: {e}")
+            self._write_batch(deletes=[(url,) for url in urls])
+        except (sqlite3.Error, requests.exceptions.RequestException) as e:
+            print(f"從佇列批次移除 URL 時發生錯誤: {e}")
 
-    def load_queue(self):
-        """從資料庫載入整個待爬取佇列"""
+    def claim_batch(self, limit, lease_seconds=None, owner=None, shard=None):
+        """
+        以租約方式認領最多 limit 筆待處理 URL，回傳 [(url, domain), ...]。
+        shard 為 (分片索引, 分片數) 時只認領屬於該分片的項目；owner 供 frontier 服務代替遠端 worker 認領。
+        """
+        self.flush()
+        lease_seconds = lease_seconds if lease_seconds is not None else FRONTIER_LEASE_SECONDS
+        owner = owner or self.worker_id
+        shard = shard or self.shard
+        shard_filter = " AND shard_key % ? = ?" if shard else ""
+        now = time.time()
         try:
-            self.cursor.execute("SELECT url FROM crawl_queue")
-            return [row[0] for row in self.cursor.fetchall()]
+            with self.conn:
+                # 租約過期視同一次失敗：與 nack 相同，已達最大嘗試次數者標記為失敗，避免讓 worker 當機的 URL 無限重試
+                self.conn.execute(
+                    """UPDATE crawl_queue SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                       lease_owner = NULL, lease_at = NULL WHERE status = 'leased' AND lease_at < ?""",
+                    (FRONTIER_MAX_ATTEMPTS, now - lease_seconds)
+                )
+                self.conn.execute(
+                    f"""UPDATE crawl_queue SET status = 'leased', lease_owner = ?, lease_at = ?, attempts = attempts + 1
+                       WHERE id IN (SELECT id FROM crawl_queue WHERE status = 'pending'{shard_filter} ORDER BY priority DESC, id LIMIT ?)""",
+                    (owner, now, *((shard[1], shard[0]) if shard else ()), limit)
+                )
+            self.cursor.execute(
+                "SELECT url, domain FROM crawl_queue WHERE status = 'leased' AND lease_owner = ? AND lease_at = ? ORDER BY priority DESC, id",
+                (owner, now)
+            )
+            return self.cursor.fetchall()
         except sqlite3.Error as e:
-            print(f"載入佇列時發生錯誤: {e}")
+            print(f"從佇列認領 URL 時發生錯誤: {e}")
             return []
 
+    def ack(self, url):
+        """確認 URL 已處理完成 (延遲至下次批次提交)"""
+        self._pending_queue_nacks.discard(url)
+        self._pending_queue_acks.add(url)
+        self._maybe_flush()
+
+    def nack(self, url):
+        """將處理失敗的 URL 退回佇列，超過最大嘗試次數則標記為失敗"""
+        self._pending_queue_acks.discard(url)
+        self._pending_queue_nacks.add(url)
+        self._maybe_flush()
+
+    def release_leases(self, urls, owner=None):
+        """歸還尚未開始處理的租約，不計入嘗試次數"""
+        self.flush()
+        owner = owner or self.worker_id
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    """UPDATE crawl_queue SET status = 'pending', lease_owner = NULL, lease_at = NULL, attempts = MAX(attempts - 1, 0)
+                       WHERE url = ? AND status = 'leased' AND lease_owner = ?""",
+                    [(url, owner) for url in urls]
+                )
+        except sqlite3.Error as e:
+            print(f"歸還佇列租約時發生錯誤: {e}")
+
+    def queue_size(self):
+        """回傳尚未完成 (待處理或租約中) 的佇列筆數"""
+        self.flush()
+        self.cursor.execute("SELECT COUNT(*) FROM crawl_queue WHERE status IN ('pending', 'leased')")
+        return self.cursor.fetchone()[0]
+
+    def leased_count(self):
+        """回傳目前租約中 (有 worker 正在處理) 的佇列筆數"""
+        self.flush()
+        self.cursor.execute("SELECT COUNT(*) FROM crawl_queue WHERE status = 'leased'")
+        return self.cursor.fetchone()[0]
+
+    def domain_seen(self, domain):
+        """精確查詢域名是否曾出現在佇列或分類結果中"""
+        if domain in self._pending_classifications or domain in self._pending_queue_domains:
+            return True
+        return self._seen_in_db(domain)
+
+    def _seen_in_db(self, domain):
+        self.cursor.execute(
+            "SELECT 1 FROM crawl_queue WHERE domain = ? UNION ALL SELECT 1 FROM classified_domains WHERE domain = ? LIMIT 1",
+            (domain, domain)
+        )
+        return self.cursor.fetchone() is not None
+
+    def iter_known_domains(self):
+        """分頁走訪佇列與分類結果中的所有域名，不一次載入記憶體"""
+        self.flush()
+        for table in ("crawl_queue", "classified_domains"):
+            last_id = 0
+            while True:
+                rows = self._known_domains_page(table, last_id)
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                for _, domain in rows:
+                    if domain:
+                        yield domain
+
+    def _known_domains_page(self, table, last_id):
+        if table not in ("crawl_queue", "classified_domains"):
+            raise ValueError(f"未知的資料表: {table}")
+        return self.conn.execute(
+            f"SELECT id, domain FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (last_id, FRONTIER_PAGE_SIZE)
+        ).fetchall()
+
+    def iter_classified_rows(self, after_id=0, llm_only=False):
+        """分頁走訪分類紀錄 (id, domain, subcategory_code, summary)；llm_only 時排除預分類或沿用鄰居標籤的結果"""
+        self.flush()
+        last_id = after_id
+        while True:
+            rows = self._classified_rows_page(last_id, llm_only)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for row_id, domain, sub_code, summary in rows:
+                if domain:
+                    yield row_id, domain, sub_code, summary or ""
+
+    def _classified_rows_page(self, last_id, llm_only):
+        # 來源以 classified_by 判斷；摘要前綴的條件只用於排除舊版寫入的預分類紀錄
+        source_filter = (" AND (classified_by IS NULL OR classified_by = 'llm') AND (summary IS NULL OR summary NOT LIKE '[預分類%')"
+                         if llm_only else "")
+        return self.conn.execute(
+            f"SELECT id, domain, subcategory_code, summary FROM classified_domains WHERE id > ?{source_filter} ORDER BY id LIMIT ?",
+            (last_id, FRONTIER_PAGE_SIZE)
+        ).fetchall()
+
+    def iter_training_rows(self):
+        """走訪由 LLM 產生的分類結果 (domain, subcategory_code, summary)，供預分類模型訓練"""
+        for _, domain, sub_code, summary in self.iter_classified_rows(llm_only=True):
+            yield domain, sub_code, summary
+
+    def classified_count(self):
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM classified_domains").fetchone()[0]
+
+    def get_classifications(self, domains):
+        """
+        以批次 SQL 查詢多個域名的既有分類，回傳 {域名: 分類資料 dict}。
+        依 CLASSIFICATION_INHERIT_POLICY 可沿用可註冊網域層級的分類；尚未寫入的暫存紀錄也會納入。
+        """
+        candidates = {}
+        for domain in domains:
+            candidates.setdefault(domain, []).append(domain)
+            if CLASSIFICATION_INHERIT_POLICY == "registrable":
+                parent = registrable_domain(domain)
+                if parent and parent != domain:
+                    candidates.setdefault(parent, []).append(domain)
+        found = {}
+        for domain in candidates:
+            pending = self._pending_classifications.get(domain)
+            if pending:
+                found[domain] = dict(zip(self.CLASSIFICATION_COLUMNS, (pending[0], pending[1], pending[3], pending[5], pending[6], pending[7])))
+        keys = [domain for domain in candidates if domain not in found]
+        for start in range(0, len(keys), 500):
+            for row in self._classification_rows(keys[start:start + 500]):
+                found[row[0]] = dict(zip(self.CLASSIFICATION_COLUMNS, row))
+        results = {}
+        for key, row in found.items():
+            for domain in candidates[key]:
+                # 網域本身的分類優先於上層可註冊網域
+                if domain not in results or key == domain:
+                    results[domain] = row
+        return results
+
+    def _classification_rows(self, domains):
+        return self.conn.execute(
+            f"SELECT {', '.join(self.CLASSIFICATION_COLUMNS)} FROM classified_domains WHERE domain IN ({', '.join('?' * len(domains))})",
+            domains
+        ).fetchall()
+
     def domain_exists(self, domain):
-        self.cursor.execute("SELECT id FROM classified_domains WHERE domain = ?", (domain,))
+        """查詢域名是否已分類；依 CLASSIFICATION_INHERIT_POLICY 可沿用可註冊網域層級的分類"""
+        candidates = [domain]
+        if CLASSIFICATION_INHERIT_POLICY == "registrable":
+            parent = registrable_domain(domain)
+            if parent and parent != domain:
+                candidates.append(parent)
+        if any(candidate in self._pending_classifications for candidate in candidates):
+            return True
+        return self._any_classified(candidates)
+
+    def _any_classified(self, domains):
+        self.cursor.execute(f"SELECT 1 FROM classified_domains WHERE domain IN ({', '.join('?' * len(domains))}) LIMIT 1", domains)
         return self.cursor.fetchone() is not None
 
     def close(self):
+        self.flush()
         self.conn.close()
         print("資料庫連線已關閉。")
 
+class RemoteDatabaseManager(DatabaseManager):
+    """
+    透過 frontier 服務 (serve-frontier) 存取共用的 frontier 與分類結果，供其他機器上的 worker 使用。
+    寫入同樣先在本機暫存、批次送出；認領與查詢以 JSON RPC 轉送至服務端的 DatabaseManager。
+    """
+    def __init__(self, service_url, batch_size=None, flush_interval=None, shard=None, token=None):
+        self.service_url = service_url.rstrip("/") + "/rpc"
+        self.session = requests.Session()
+        token = token or FRONTIER_SERVICE_TOKEN
+        if token:
+            self.session.headers[FRONTIER_TOKEN_HEADER] = token
+        self._init_buffers(batch_size, flush_interval, shard)
+        print(f"已連線至共用 frontier 服務 '{service_url}'。")
+
+    def _call(self, method, *args):
+        response = self.session.post(self.service_url, json={"method": method, "args": args}, timeout=FRONTIER_RPC_TIMEOUT)
+        response.raise_for_status()
+        return response.json()["result"]
+
+    def setup_tables(self):
+        """資料表由 frontier 服務端建立"""
+
+    def _write_batch(self, classifications=(), inserts=(), acks=(), nacks=(), deletes=(), reclassifications=(), rechecks=()):
+        self._call("write_batch", list(classifications), list(inserts), list(acks), list(nacks), list(deletes),
+                   list(reclassifications), list(rechecks))
+
+    def claim_batch(self, limit, lease_seconds=None, owner=None, shard=None):
+        self.flush()
+        try:
+            rows = self._call("claim_batch", limit, lease_seconds, owner or self.worker_id, shard or self.shard)
+            return [tuple(row) for row in rows]
+        except requests.exceptions.RequestException as e:
+            print(f"從 frontier 服務認領 URL 時發生錯誤: {e}")
+            return []
+
+    def release_leases(self, urls, owner=None):
+        self.flush()
+        try:
+            self._call("release_leases", list(urls), owner or self.worker_id)
+        except requests.exceptions.RequestException as e:
+            print(f"歸還佇列租約時發生錯誤: {e}")
+
+    def queue_size(self):
+        self.flush()
+        return self._call("queue_size")
+
+    def leased_count(self):
+        self.flush()
+        return self._call("leased_count")
+
+    def classified_count(self):
+        self.flush()
+        return self._call("classified_count")
+
+    def _seen_in_db(self, domain):
+        return self._call("seen_in_db", domain)
+
+    def _known_domains_page(self, table, last_id):
+        return self._call("known_domains_page", table, last_id)
+
+    def _classified_rows_page(self, last_id, llm_only):
+        return self._call("classified_rows_page", last_id, llm_only)
+
+    def _classification_rows(self, domains):
+        return self._call("classification_rows", domains)
+
+    def _any_classified(self, domains):
+        return self._call("any_classified", domains)
+
+    def _due_rows(self, limit, now):
+        return self._call("due_rows", limit, now)
+
+    def close(self):
+        self.flush()
+        self.session.close()
+        print("已中斷與 frontier 服務的連線。")
+
+class SeenDomainIndex:
+    """已見域名索引的抽象基底類別，用於連結去重"""
+    def __contains__(self, domain):
+        raise NotImplementedError
+
+    def add(self, domain):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class MemorySeenDomainIndex(SeenDomainIndex):
+    """以 Python set 實作的記憶體索引，適合小規模或測試使用"""
+    def __init__(self):
+        self._domains = set()
+
+    def __contains__(self, domain):
+        return domain in self._domains
+
+    def add(self, domain):
+        self._domains.add(domain)
+
+class _BloomSlice:
+    """單一固定容量的 Bloom filter 切片，位元陣列以 mmap 對應至檔案"""
+    HEADER = struct.Struct("<4sQQIQ")
+    MAGIC = b"SBF1"
+
+    def __init__(self, path, capacity=None, error_rate=None):
+        self.path = path
+        if os.path.exists(path):
+            self._file = open(path, "r+b")
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+            magic, self.capacity, self.num_bits, self.num_hashes, self.count = self.HEADER.unpack_from(self._mm, 0)
+            if magic != self.MAGIC:
+                raise ValueError(f"無效的 Bloom filter 檔案: {path}")
+        else:
+            self.capacity = capacity
+            self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+            self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+            self.count = 0
+            self._file = open(path, "w+b")
+            self._file.truncate(self.HEADER.size + (self.num_bits + 7) // 8)
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+            self._write_header()
+
+    def _write_header(self):
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.capacity, self.num_bits, self.num_hashes, self.count)
+
+    def _positions(self, h1, h2):
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def contains(self, h1, h2):
+        offset = self.HEADER.size
+        for pos in self._positions(h1, h2):
+            if not self._mm[offset + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, h1, h2):
+        offset = self.HEADER.size
+        for pos in self._positions(h1, h2):
+            index = offset + (pos >> 3)
+            self._mm[index] = self._mm[index] | (1 << (pos & 7))
+        self.count += 1
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def flush(self):
+        self._write_header()
+        self._mm.flush()
+
+    def close(self):
+        self.flush()
+        self._mm.close()
+        self._file.close()
+
+class BloomSeenDomainIndex(SeenDomainIndex):
+    """
+    以持久化、mmap 對應的可擴充 Bloom filter 實作的已見域名索引。
+    Bloom filter 判定「可能存在」時，再以 SQLite 精確查詢排除誤判。
+    """
+    def __init__(self, path, db_manager, initial_capacity=None, error_rate=None):
+        self.path = path
+        self.db_manager = db_manager
+        self.initial_capacity = initial_capacity or SEEN_FILTER_INITIAL_CAPACITY
+        self.error_rate = error_rate or SEEN_FILTER_ERROR_RATE
+        self._slices = []
+        while os.path.exists(self._slice_path(len(self._slices))):
+            self._slices.append(_BloomSlice(self._slice_path(len(self._slices))))
+        self._recent = OrderedDict()
+
+        if self._slices:
+            print(f"已載入已見域名 Bloom filter ({len(self._slices)} 個切片，共 {sum(s.count for s in self._slices)} 筆)。")
+        else:
+            self._add_slice()
+            self._bootstrap_from_db()
+
+    def _slice_path(self, index):
+        return f"{self.path}.{index}"
+
+    def _add_slice(self):
+        index = len(self._slices)
+        # 每個新切片容量加倍、誤判率減半，使整體誤判率收斂於 error_rate
+        capacity = self.initial_capacity * (2 ** index)
+        error_rate = self.error_rate * (0.5 ** (index + 1))
+        self._slices.append(_BloomSlice(self._slice_path(index), capacity, error_rate))
+
+    def _bootstrap_from_db(self):
+        """首次建立時，從既有資料庫匯入已知域名 (僅執行一次)"""
+        added = 0
+        for domain in self.db_manager.iter_known_domains():
+            self._add_hashes(domain)
+            added += 1
+        if added:
+            self.flush()
+            print(f"已從資料庫匯入 {added} 個已知域名至 Bloom filter。")
+
+    @staticmethod
+    def _hashes(domain):
+        digest = hashlib.blake2b(domain.encode("utf-8"), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def _add_hashes(self, domain):
+        if self._slices[-1].is_full:
+            self._add_slice()
+        self._slices[-1].add(*self._hashes(domain))
+
+    def _remember(self, domain):
+        self._recent[domain] = None
+        self._recent.move_to_end(domain)
+        if len(self._recent) > SEEN_INDEX_RECENT_CACHE:
+            self._recent.popitem(last=False)
+
+    def __contains__(self, domain):
+        if domain in self._recent:
+            self._recent.move_to_end(domain)
+            return True
+        h1, h2 = self._hashes(domain)
+        if not any(s.contains(h1, h2) for s in self._slices):
+            return False
+        if self.db_manager.domain_seen(domain):
+            self._remember(domain)
+            return True
+        return False
+
+    def add(self, domain):
+        self._add_hashes(domain)
+        self._remember(domain)
+
+    def flush(self):
+        for s in self._slices:
+            s.flush()
+
+    def close(self):
+        for s in self._slices:
+            s.close()
+
+def create_seen_domain_index(db_manager, path=None):
+    """依 SEEN_INDEX_BACKEND 設定建立已見域名索引"""
+    if SEEN_INDEX_BACKEND == "bloom":
+        return BloomSeenDomainIndex(path or SEEN_FILTER_PATH, db_manager)
+    return MemorySeenDomainIndex()
+
+def get_classification_system_prompt(schema_str):
+    """
+    產生固定不變的系統提示，分類法置於固定位置，讓 Ollama 可重用已計算的前綴 (KV cache)。
+    """
+    return f"""You are a website classification assistant. All classification tasks use the schema below. Every code you output MUST come from this schema, and `subcategory_code` MUST start with its `main_category_code`.
+
+**Classification Schema (main_category_code name: subcategory_code name; ...):**
+{schema_str}
+"""
+
+def _schema_section(schema_str):
+    if schema_str is None:
+        return "**Classification Schema:** use the schema given in the system prompt."
+    return f"""**Classification Schema:**
+{schema_str}"""
+
 def get_knowledge_classification_prompt(schema_str, url):
     """
-    產生用於「知識庫直接分類」的提示，包含自我校驗。
+    產生用於「知識庫直接分類」的提示，包含自我校驗。schema_str 為 None 時沿用系統提示中的分類法。
     """
     return f"""You are a highly intelligent JSON-generating robot. Your mission is to classify the website `{url}` with extreme accuracy based on your knowledge.
 
 **Follow these steps precisely:**
 1.  **Recall and Summarize:** Access your internal knowledge about `{url}` and formulate a one-sentence summary in Traditional Chinese. If you don't know the site, you must respond with a JSON object where "known" is false.
-2.  **Categorize:** Based on your summary, select the most appropriate `main_category_code` and `subcategory_code` from the schema below.
+2.  **Categorize:** Based on your summary, select the most appropriate `main_category_code` and `subcategory_code` from the schema.
 3.  **Verify:** Ensure your summary logically matches your chosen category.
 4.  **Generate Final JSON:** Construct the final JSON object.
 
 ---
-**Classification Schema:**
-{schema_str}
+{_schema_section(schema_str)}
 ---
 
 **OUTPUT RULES:**
-- If you know the site, your response **MUST ONLY** be a JSON object with four keys: `"known": true`, `main_category_code`, `subcategory_code`, and `summary`.
+- If you know the site, your response **MUST ONLY** be a JSON object with five keys: `"known": true`, `main_category_code`, `subcategory_code`, `summary`, and `confidence` (a number from 0 to 1 for how sure you are of the category).
 - If you do not know the site, your response **MUST ONLY** be a JSON object with one key: `"known": false`.
 
 Now, perform your full analysis and verification for `{url}` and provide ONLY the JSON object.
 """
 
+def get_batch_knowledge_classification_prompt(schema_str, urls):
+    """
+    產生用於「批次知識庫分類」的提示，一次分類多個網站。schema_str 為 None 時沿用系統提示中的分類法。
+    """
+    url_list = "\n".join(f"- {url}" for url in urls)
+    return f"""You are a highly intelligent JSON-generating robot. Your mission is to classify each of the following {len(urls)} websites with extreme accuracy based on your knowledge.
+
+**Websites:**
+{url_list}
+
+**For each website:**
+1.  Recall what you know about it. If you don't know the site, mark it with `"known": false`.
+2.  If you know it, write a one-sentence summary in Traditional Chinese and choose the most appropriate `main_category_code` and `subcategory_code` from the schema.
+3.  Verify that the summary logically matches the chosen category.
+
+---
+{_schema_section(schema_str)}
+---
+
+**OUTPUT RULES:**
+- Your response **MUST ONLY** be a JSON object with one key `"results"` whose value is an array with exactly one entry per website, in the same order.
+- Every entry **MUST** contain `"url"` copied exactly from the list above.
+- For a known site the entry has six keys: `url`, `"known": true`, `main_category_code`, `subcategory_code`, `summary`, and `confidence` (a number from 0 to 1 for how sure you are of the category).
+- For an unknown site the entry has two keys: `url` and `"known": false`.
+
+Now classify all {len(urls)} websites and provide ONLY the JSON object.
+"""
+
 def get_content_summary_prompt(text_content):
     """產生用於第一階段「內容摘要」的提示"""
     return f"""Analyze the following website text content and provide a single, concise, one-sentence summary in Traditional Chinese that describes the website's primary purpose.
@@ -328,15 +1672,25 @@ def get_content_summary_prompt(text_content):
 Your response MUST be only the one-sentence summary and nothing else.
 """
 
-def get_classification_from_metadata_prompt(schema_str, url, title, description, summary):
+def _examples_section(examples):
+    """將相似網站的既有分類整理為 few-shot 參考範例"""
+    if not examples:
+        return ""
+    lines = "\n".join(f'- `{example["domain"]}`: "{example["summary"]}" -> `{example["subcategory_code"]}`' for example in examples)
+    return f"""
+**Similar Previously Classified Websites (reference only, they may belong to a different category):**
+{lines}
+"""
+
+def get_classification_from_metadata_prompt(schema_str, url, title, description, summary, examples=None):
     """
-    (優化後) 產生用於最終分類的提示，使用多維度證據。
+    (優化後) 產生用於最終分類的提示，使用多維度證據。schema_str 為 None 時沿用系統提示中的分類法。
+    examples 為相似網站的既有分類，作為 few-shot 參考。
     """
     return f"""You are an expert JSON-generating robot. Your task is to accurately classify a website using the provided metadata.
 
-**Classification Schema:**
 ---
-{schema_str}
+{_schema_section(schema_str)}
 ---
 
 **Evidence to Analyze:**
@@ -344,7 +1698,7 @@ def get_classification_from_metadata_prompt(schema_str, url, title, description,
 - **Page Title:** "{title}"
 - **Meta Description:** "{description}"
 - **AI-Generated Summary:** "{summary}"
-
+{_examples_section(examples)}
 **INSTRUCTIONS:**
 1.  Synthesize all four pieces of evidence to understand the website's true purpose. The Title and Meta Description are often the most reliable clues.
 2.  Based on your comprehensive analysis, choose the single most accurate `main_category_code` and `subcategory_code` from the schema.
@@ -354,7 +1708,7 @@ def get_classification_from_metadata_prompt(schema_str, url, title, description,
 
 **OUTPUT RULES:**
 - Your response **MUST ONLY** be a single, valid JSON object.
-- The JSON **MUST** contain two keys: `main_category_code` and `subcategory_code`.
+- The JSON **MUST** contain three keys: `main_category_code`, `subcategory_code`, and `confidence` (a number from 0 to 1 for how sure you are of the category).
 
 Now, classify the website and provide ONLY the JSON object.
 """
@@ -364,141 +1718,2175 @@ class AIClassifier:
     def classify_from_knowledge(self, url):
         raise NotImplementedError
 
+    def classify_many_from_knowledge(self, urls):
+        """批次知識庫分類，回傳 {url: result}；預設逐一呼叫 classify_from_knowledge"""
+        return {url: self.classify_from_knowledge(url) for url in urls}
+
     def get_summary_from_content(self, text_content, url):
         raise NotImplementedError
         
-    def classify_from_metadata(self, url, title, description, summary):
+    def classify_from_metadata(self, url, title, description, summary, examples=None):
         raise NotImplementedError
 
-class LocalOllamaClassifier(AIClassifier):
-    """使用本地運行的 Ollama 服務進行分類"""
-    def __init__(self, model, api_url, schema_json):
-        self.model = model
-        self.api_url = api_url
-        self.schema_json_str = schema_json
-        print(f"本地 Ollama 分類器已初始化，使用模型: {self.model}")
+class AdaptiveBatchSizer:
+    """依上下文視窗與失敗率調整批次大小 (成功時線性增加，失敗率過高時減半)"""
+    def __init__(self, initial_size, max_size, context_window, tokens_per_item, reserved_tokens):
+        self.max_size = max(1, min(max_size, (context_window - reserved_tokens) // tokens_per_item))
+        self.size = max(1, min(initial_size, self.max_size))
+        self._lock = threading.Lock()
 
-    def _call_ollama(self, prompt, url_for_log, expect_json=False):
-        payload = {"model": self.model, "prompt": prompt, "stream": False}
-        if expect_json:
-            payload["format"] = "json"
-        
-        try:
-            print(f"  - 向本地 Ollama API 請求 ({'JSON' if expect_json else 'Text'}) for {url_for_log}...")
-            response = requests.post(self.api_url, json=payload, timeout=180)
-            response.raise_for_status()
-            response_data = response.json()
-            raw_response_str = response_data.get('response', '')
-            if not raw_response_str: return None
-            
-            cleaned_str = re.sub(r'<think>.*?</think>', '', raw_response_str, flags=re.DOTALL).strip()
-            
-            if expect_json:
-                json_str = cleaned_str.lstrip('```json').rstrip('```').strip()
-                return json.loads(json_str)
-            else:
-                return cleaned_str
-        except requests.exceptions.Timeout:
-            print(f"  - 呼叫本地 Ollama API 時發生超時錯誤 for {url_for_log}")
-            return None
-        except requests.exceptions.ConnectionError:
-            print(f"\n❌ 錯誤：無法連線至本地 Ollama 服務 ({self.api_url})。")
-            exit()
-        except json.JSONDecodeError as e:
-            print(f"  - 解析來自 Ollama 的 JSON 回覆時發生錯誤: {e}")
-            return None
-        except Exception as e:
-            print(f"  - 呼叫本地 Ollama API 或處理回傳時發生未知錯誤: {e}")
-            return None
+    def record(self, batch_size, failures):
+        with self._lock:
+            failure_rate = failures / batch_size if batch_size else 0
+            if failure_rate > KNOWLEDGE_BATCH_MAX_FAILURE_RATE:
+                self.size = max(1, self.size // 2)
+            elif failures == 0 and batch_size >= self.size:
+                self.size = min(self.max_size, self.size + 1)
 
-    def classify_from_knowledge(self, url):
-        prompt = get_knowledge_classification_prompt(self.schema_json_str, url)
-        return self._call_ollama(prompt, f"{url} [知識庫分類]", expect_json=True)
+class OllamaUnavailableError(Exception):
+    """所有 Ollama 端點皆無法使用 (斷路器開啟或連線失敗)"""
+
+def find_json_object_end(text):
+    """回傳 text 中第一個完整 JSON 物件結尾 '}' 之後的位置，尚未完整則回傳 -1"""
+    start = text.find("{")
+    if start < 0:
+        return -1
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+class StreamingResponseParser:
+    """
+    逐塊解析 Ollama 串流回覆：即時丟棄 <think> 思考內容，並判斷是否已取得完整結果。
+    expect_json 時以完整 JSON 物件為結束條件 (提供 validator 時須通過驗證)；stop_on_sentence 時以第一個完整句子為結束條件。
+    """
+    THINK_OPEN, THINK_CLOSE = "<think>", "</think>"
+    SENTENCE_ENDINGS = "。！？!?"
+
+    def __init__(self, expect_json=False, stop_on_sentence=False, max_thinking_tokens=None, validator=None):
+        self.expect_json = expect_json
+        self.stop_on_sentence = stop_on_sentence
+        self.validator = validator
+        self.max_thinking_tokens = OLLAMA_MAX_THINKING_TOKENS if max_thinking_tokens is None else max_thinking_tokens
+        self.reset()
+
+    def reset(self):
+        self.visible = []
+        self.thinking_tokens = 0
+        self.result = None
+        self.candidate = None
+        self.done = False
+        self._in_think = False
+        self._tail = ""
+        self._json_offset = 0
+
+    @staticmethod
+    def _partial_tag_length(text, tag):
+        """text 結尾可能是被切斷的 tag 前綴時，回傳該前綴長度"""
+        for length in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:length]):
+                return length
+        return 0
+
+    @property
+    def text(self):
+        return "".join(self.visible)
+
+    @property
+    def thinking_budget_exceeded(self):
+        return bool(self.max_thinking_tokens) and self.thinking_tokens > self.max_thinking_tokens
+
+    def feed(self, piece, thinking=""):
+        """餵入一段串流內容 (response 與新版 Ollama 的 thinking 欄位)，回傳是否已可停止"""
+        if thinking:
+            self.thinking_tokens += 1
+        if self.done or not piece:
+            return self.done
+        text = self._tail + piece
+        self._tail = ""
+        while text:
+            if self._in_think:
+                self.thinking_tokens += 1
+                end = text.find(self.THINK_CLOSE)
+                if end < 0:
+                    keep = self._partial_tag_length(text, self.THINK_CLOSE)
+                    self._tail = text[len(text) - keep:] if keep else ""
+                    break
+                self._in_think = False
+                text = text[end + len(self.THINK_CLOSE):]
+            else:
+                start = text.find(self.THINK_OPEN)
+                if start < 0:
+                    keep = self._partial_tag_length(text, self.THINK_OPEN)
+                    self.visible.append(text[:len(text) - keep])
+                    self._tail = text[len(text) - keep:] if keep else ""
+                    break
+                self.visible.append(text[:start])
+                self._in_think = True
+                text = text[start + len(self.THINK_OPEN):]
+        # 只有在可能出現結束符號時才重新檢查，避免每個 token 都重新掃描
+        if not self._in_think and any(ch in piece for ch in "}.。！？!? \n"):
+            self._check_complete()
+        return self.done
+
+    def _check_complete(self):
+        visible = self.text
+        if self.expect_json:
+            # 依序檢查每個完整的物件 (已檢查過的部分不重複掃描)，模型先輸出無效物件時，之後的有效物件仍可提前結束
+            while True:
+                start = visible.find("{", self._json_offset)
+                end = find_json_object_end(visible[start:]) if start >= 0 else -1
+                if end < 0:
+                    return
+                self._json_offset = start + end
+                try:
+                    parsed = json.loads(visible[start:start + end])
+                except json.JSONDecodeError:
+                    continue
+                if self.validator is None or self.validator(parsed):
+                    self.result = parsed
+                    self.done = True
+                    return
+                # 未通過驗證的物件不提前結束，讓模型完成生成；串流結束時仍可作為結果回傳
+                if self.candidate is None:
+                    self.candidate = parsed
+        elif self.stop_on_sentence:
+            stripped = visible.strip()
+            for i, ch in enumerate(stripped):
+                if i >= 4 and (ch in self.SENTENCE_ENDINGS or (ch == "." and i + 1 < len(stripped) and stripped[i + 1].isspace())):
+                    self.result = stripped[:i + 1]
+                    self.done = True
+                    break
+
+    def finish(self):
+        """串流結束時回傳最終結果 (JSON 物件或去除思考內容的文字)"""
+        self.visible.append(self._tail if not self._in_think else "")
+        self._tail = ""
+        if self.result is None and self.expect_json:
+            self._check_complete()
+        if self.result is not None:
+            return self.result
+        cleaned = self.text.strip()
+        if self.expect_json:
+            json_str = cleaned.lstrip('```json').rstrip('```').strip()
+            try:
+                return json.loads(json_str) if json_str else self.candidate
+            except json.JSONDecodeError:
+                if self.candidate is None:
+                    raise
+                return self.candidate
+        return cleaned
+
+class _OllamaEndpoint:
+    """單一 Ollama 端點的狀態：處理中請求數與斷路器"""
+    def __init__(self, url, model=None):
+        self.url = url
+        self.model = model
+        self.base_url = url.split("/api/", 1)[0]
+        self.in_flight = 0
+        self.failures = 0
+        self.open_until = 0.0
+
+    def __repr__(self):
+        return f"{self.url} ({self.model})" if self.model else self.url
+
+class OllamaClient:
+    """具連線池、並行上限、多端點負載平衡、健康檢查與斷路器的 Ollama HTTP 用戶端"""
+    def __init__(self, endpoints, max_in_flight=None, timeout=None, stream=None):
+        self.endpoints = [
+            _OllamaEndpoint(e["url"], e.get("model")) if isinstance(e, dict) else _OllamaEndpoint(e)
+            for e in endpoints
+        ]
+        self.max_in_flight = max_in_flight or OLLAMA_MAX_IN_FLIGHT
+        self.timeout = timeout or OLLAMA_REQUEST_TIMEOUT
+        self.stream = OLLAMA_STREAM_RESPONSES if stream is None else stream
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self.endpoints), pool_maxsize=self.max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+
+    def _health_check(self, endpoint):
+        try:
+            response = self.session.get(f"{endpoint.base_url}/api/tags", timeout=5)
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def _acquire_endpoint(self, exclude):
+        """挑選處理中請求最少、且斷路器未開啟的端點"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            closed = [e for e in candidates if e.open_until <= now]
+        if not closed:
+            return None
+        for endpoint in sorted(closed, key=lambda e: e.in_flight):
+            if endpoint.failures >= OLLAMA_CIRCUIT_FAILURE_THRESHOLD:
+                # 半開狀態：冷卻期已過，先做健康檢查再放行
+                if not self._health_check(endpoint):
+                    self._record_failure(endpoint)
+                    continue
+            with self._lock:
+                endpoint.in_flight += 1
+            return endpoint
+        return None
+
+    def _record_failure(self, endpoint):
+        with self._lock:
+            endpoint.failures += 1
+            if endpoint.failures >= OLLAMA_CIRCUIT_FAILURE_THRESHOLD:
+                endpoint.open_until = time.monotonic() + OLLAMA_CIRCUIT_COOLDOWN
+                print(f"  - ⚡ Ollama 端點 {endpoint} 連續失敗 {endpoint.failures} 次，斷路器開啟 {OLLAMA_CIRCUIT_COOLDOWN} 秒。")
+
+    def _record_success(self, endpoint):
+        with self._lock:
+            endpoint.failures = 0
+            endpoint.open_until = 0.0
+
+    def generate(self, payload, parser=None):
+        """
+        呼叫 /api/generate 並回傳最終的回覆資料 (含 response 與統計欄位)。
+        傳入 StreamingResponseParser 時，串流中一取得完整結果 (或思考超出預算) 即關閉連線，提前結束生成。
+        """
+        with self._slots:
+            tried = []
+            while True:
+                endpoint = self._acquire_endpoint(tried)
+                if endpoint is None:
+                    raise OllamaUnavailableError(f"沒有可用的 Ollama 端點 (已嘗試: {tried or self.endpoints})")
+                tried.append(endpoint)
+                request_payload = dict(payload)
+                if endpoint.model and payload.get("model") == LOCAL_AI_MODEL:
+                    # 端點指定的模型只取代主模型，串聯中的小模型照常使用
+                    request_payload["model"] = endpoint.model
+                if parser:
+                    parser.reset()
+                try:
+                    if self.stream:
+                        result = self._generate_stream(endpoint, request_payload, parser)
+                    else:
+                        response = self.session.post(endpoint.url, json=request_payload, timeout=self.timeout)
+                        response.raise_for_status()
+                        result = response.json()
+                        if parser:
+                            parser.feed(result.get("response", ""), result.get("thinking", ""))
+                    self._record_success(endpoint)
+                    return result
+                except requests.exceptions.HTTPError as e:
+                    if e.response is not None and e.response.status_code < 500:
+                        raise
+                    self._record_failure(endpoint)
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                    print(f"  - 無法連線至 Ollama 端點 {endpoint}: {e}")
+                    self._record_failure(endpoint)
+                finally:
+                    with self._lock:
+                        endpoint.in_flight -= 1
+
+    @staticmethod
+    def _client_timings(started, first_chunk_at, chunks, **flags):
+        """
+        提前關閉串流時收不到 Ollama 最後含統計的 done 區塊，改以用戶端計時估算：
+        第一個區塊之前視為提示評估 (含排隊與載入)，之後每個區塊約為一個生成 token；提示 token 數無法得知。
+        """
+        now = time.perf_counter_ns()
+        first_chunk_at = first_chunk_at or now
+        return dict(response="", eval_count=chunks, prompt_eval_duration=first_chunk_at - started,
+                    eval_duration=now - first_chunk_at, client_timing=True, **flags)
+
+    def _generate_stream(self, endpoint, payload, parser):
+        payload["stream"] = True
+        pieces = []
+        started = time.perf_counter_ns()
+        first_chunk_at = None
+        chunks = 0
+        with self.session.post(endpoint.url, json=payload, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise requests.exceptions.HTTPError(chunk["error"], response=response)
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter_ns()
+                chunks += 1
+                piece = chunk.get("response", "")
+                if parser:
+                    parser.feed(piece, chunk.get("thinking", ""))
+                else:
+                    pieces.append(piece)
+                if chunk.get("done"):
+                    chunk["response"] = "".join(pieces)
+                    return chunk
+                # 關閉連線即可讓 Ollama 停止生成
+                if parser and parser.done:
+                    return self._client_timings(started, first_chunk_at, chunks, stopped_early=True)
+                if parser and parser.thinking_budget_exceeded:
+                    return self._client_timings(started, first_chunk_at, chunks, thinking_budget_exceeded=True)
+        return {"response": "".join(pieces)}
+
+class LLMResponseCache:
+    """以 SQLite 實作、以模型名稱與正規化提示雜湊為鍵的 LLM 回覆快取，支援 TTL 與 LRU 容量上限"""
+    def __init__(self, path, ttl=None, max_entries=None, bypass=None):
+        self.ttl = LLM_CACHE_TTL if ttl is None else ttl
+        self.max_entries = max_entries or LLM_CACHE_MAX_ENTRIES
+        self.bypass = LLM_CACHE_BYPASS if bypass is None else bypass
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_evict = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+        mode = "略過讀取" if self.bypass else "啟用"
+        print(f"LLM 回覆快取 '{path}' 已{mode} (TTL {self.ttl or '無限'} 秒，上限 {self.max_entries} 筆)。")
+
+    @staticmethod
+    def make_key(model, prompt, system=None, fmt=None):
+        normalized = re.sub(r"\s+", " ", prompt.strip())
+        material = "\0".join([model, system or "", fmt or "", normalized])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """取得快取的回覆，未命中、過期或略過模式時回傳 None"""
+        if self.bypass:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and (not self.ttl or now - row[1] <= self.ttl):
+                self.hits += 1
+                METRICS.inc("llm_cache_requests_total", result="hit")
+                with self.conn:
+                    self.conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                return json.loads(row[0])
+            self.misses += 1
+            METRICS.inc("llm_cache_requests_total", result="miss")
+            return None
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self._lock:
+            try:
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                        (key, model, json.dumps(response, ensure_ascii=False), now, now)
+                    )
+                self._puts_since_evict += 1
+                if self._puts_since_evict >= LLM_CACHE_EVICT_EVERY:
+                    self._evict(now)
+            except sqlite3.Error as e:
+                print(f"  - 寫入 LLM 回覆快取時發生錯誤: {e}")
+
+    def _evict(self, now):
+        """刪除過期項目，並依最近存取時間淘汰超出容量上限的項目"""
+        self._puts_since_evict = 0
+        with self.conn:
+            if self.ttl:
+                self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            overflow = self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)", (overflow,)
+                )
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        print(f"📊 LLM 回覆快取: 命中 {self.hits} 次，未命中 {self.misses} 次 (命中率 {rate:.1f}%)")
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+class LocalOllamaClassifier(AIClassifier):
+    """使用本地運行的 Ollama 服務進行分類"""
+    def __init__(self, model, api_url, schema_json, prompt_cache_mode=None, client=None, cache=None, stage_models=None):
+        self.model = model
+        self.api_url = api_url
+        self.schema_json_str = schema_json
+        self.client = client or OllamaClient([api_url])
+        self.cache = cache
+        self.prompt_cache_mode = PROMPT_CACHE_MODE if prompt_cache_mode is None else prompt_cache_mode
+        if self.prompt_cache_mode:
+            # 快取前綴模式：分類法只放在固定的系統提示中，各請求的提示不再重複嵌入
+            self.system_prompt = get_classification_system_prompt(COMPACT_SCHEMA_TEXT)
+            self.prompt_schema_str = None
+        else:
+            self.system_prompt = None
+            self.prompt_schema_str = schema_json
+        self._context = None
+        self._context_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"calls": 0, "prompt_eval_calls": 0, "prompt_eval_count": 0, "prompt_eval_ns": 0, "eval_count": 0, "eval_ns": 0,
+                      "thinking_tokens": 0, "early_stops": 0, "thinking_budget_aborts": 0}
+        self.stage_models = {stage: list(models) for stage, models in
+                             (OLLAMA_STAGE_MODELS if stage_models is None else stage_models).items() if models}
+        self._missing_models = set()
+        self.model_stats = {}
+        self.cascade_stats = {}
+        schema_tokens = len(self.system_prompt or schema_json) // 2
+        self.batch_sizer = AdaptiveBatchSizer(KNOWLEDGE_BATCH_SIZE, KNOWLEDGE_BATCH_MAX_SIZE, OLLAMA_CONTEXT_WINDOW,
+                                              KNOWLEDGE_BATCH_TOKENS_PER_URL, schema_tokens + 600)
+        mode = "快取前綴模式" if self.prompt_cache_mode else "完整提示模式"
+        print(f"本地 Ollama 分類器已初始化，使用模型: {self.model} ({mode})")
+        for stage, models in self.stage_models.items():
+            if len(models) > 1:
+                print(f"  - {stage} 階段模型串聯: {' → '.join(models)}")
+
+    def _stage_models(self, stage):
+        """回傳該階段可用的模型串聯清單 (略過 Ollama 上不存在的模型)"""
+        models = [model for model in self.stage_models.get(stage, [self.model]) if model not in self._missing_models]
+        return models or [self.model]
+
+    def _base_payload(self, prompt, model=None):
+        model = model or self.model
+        payload = {"model": model, "prompt": prompt, "stream": False}
+        if not self.prompt_cache_mode:
+            return payload
+        payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+        # 工作階段 context 以主模型建立，其他模型無法沿用
+        context = self._session_context() if OLLAMA_REUSE_CONTEXT and model == self.model else None
+        if context:
+            payload["context"] = context
+        else:
+            payload["system"] = self.system_prompt
+        return payload
+
+    def _session_context(self):
+        """以系統提示預熱一次模型工作階段，之後的請求沿用其 context"""
+        with self._context_lock:
+            if self._context is None:
+                payload = {"model": self.model, "system": self.system_prompt, "prompt": "Reply with OK.",
+                           "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE, "options": {"num_predict": 4}}
+                try:
+                    self._context = self.client.generate(payload).get("context")
+                    print(f"  - 已建立 Ollama 工作階段 context ({len(self._context or [])} tokens)。")
+                except (requests.exceptions.RequestException, ValueError, OllamaUnavailableError) as e:
+                    print(f"  - 建立 Ollama 工作階段 context 失敗，改用系統提示: {e}")
+                    return None
+            return self._context
+
+    def _record_stats(self, response_data, parser=None, task=None, model=None):
+        model = model or self.model
+        # 提前結束的呼叫只有用戶端估算的耗時與生成 token 數，以 timing 標籤區分
+        timing = "client" if response_data.get("client_timing") else "server"
+        prompt_eval_count = response_data.get("prompt_eval_count", 0) or 0
+        eval_count = response_data.get("eval_count", 0) or 0
+        METRICS.inc("ollama_prompt_eval_tokens_total", prompt_eval_count, task=task, model=model)
+        METRICS.inc("ollama_eval_tokens_total", eval_count, task=task, model=model, timing=timing)
+        if response_data.get("prompt_eval_duration"):
+            METRICS.observe("ollama_prompt_eval_seconds", response_data["prompt_eval_duration"] / 1e9, task=task, model=model,
+                            timing=timing)
+        if response_data.get("eval_duration"):
+            METRICS.observe("ollama_eval_seconds", response_data["eval_duration"] / 1e9, task=task, model=model, timing=timing)
+        if response_data.get("load_duration"):
+            METRICS.observe("ollama_load_seconds", response_data["load_duration"] / 1e9, task=task, model=model)
+        if parser:
+            METRICS.inc("ollama_thinking_tokens_total", parser.thinking_tokens, task=task, model=model)
+        with self._stats_lock:
+            # 依模型累計呼叫次數、token 與 GPU/CPU 耗時，作為串聯各層級的成本
+            per_model = self.model_stats.setdefault(model, {"calls": 0, "prompt_eval_count": 0, "eval_count": 0, "busy_ns": 0})
+            per_model["calls"] += 1
+            per_model["prompt_eval_count"] += prompt_eval_count
+            per_model["eval_count"] += eval_count
+            per_model["busy_ns"] += sum(response_data.get(field, 0) or 0
+                                        for field in ("load_duration", "prompt_eval_duration", "eval_duration"))
+            self.stats["calls"] += 1
+            if "prompt_eval_count" in response_data:
+                self.stats["prompt_eval_calls"] += 1
+            if parser:
+                self.stats["thinking_tokens"] += parser.thinking_tokens
+            if response_data.get("stopped_early"):
+                self.stats["early_stops"] += 1
+            if response_data.get("thinking_budget_exceeded"):
+                self.stats["thinking_budget_aborts"] += 1
+            self.stats["prompt_eval_count"] += prompt_eval_count
+            self.stats["prompt_eval_ns"] += response_data.get("prompt_eval_duration", 0) or 0
+            self.stats["eval_count"] += eval_count
+            self.stats["eval_ns"] += response_data.get("eval_duration", 0) or 0
+
+    def report_stats(self):
+        """
+        輸出每次呼叫的平均提示評估 (prompt eval) 與生成耗時；提前結束的呼叫以用戶端計時估算耗時，
+        提示 token 數只以收到 Ollama 統計的呼叫平均。
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        calls = stats["calls"]
+        if not calls:
+            return stats
+        prompt_tokens = (f"{stats['prompt_eval_count'] / stats['prompt_eval_calls']:.0f} tokens"
+                         if stats["prompt_eval_calls"] else "- tokens")
+        print(f"📊 Ollama 統計 ({calls} 次呼叫，其中 {calls - stats['prompt_eval_calls']} 次以用戶端計時估算): "
+              f"平均 prompt eval {prompt_tokens} / {stats['prompt_eval_ns'] / calls / 1e6:.0f} ms，"
+              f"平均生成 {stats['eval_count'] / calls:.0f} tokens / {stats['eval_ns'] / calls / 1e6:.0f} ms，"
+              f"平均思考 {stats['thinking_tokens'] / calls:.0f} tokens，提前結束 {stats['early_stops']} 次，"
+              f"思考超出預算 {stats['thinking_budget_aborts']} 次")
+        with self._stats_lock:
+            stats["models"] = {model: dict(values) for model, values in self.model_stats.items()}
+            stats["cascade"] = {stage: dict(values, reasons=dict(values["reasons"]))
+                                for stage, values in self.cascade_stats.items()}
+        total_busy = sum(values["busy_ns"] for values in stats["models"].values()) or 1
+        for model, values in sorted(stats["models"].items(), key=lambda item: -item[1]["busy_ns"]):
+            print(f"  - 模型 {model}: {values['calls']} 次呼叫，prompt {values['prompt_eval_count']} tokens，"
+                  f"生成 {values['eval_count']} tokens，耗時 {values['busy_ns'] / 1e9:.1f} 秒 "
+                  f"(佔 {values['busy_ns'] / total_busy:.0%})")
+        for stage, values in stats["cascade"].items():
+            reasons = "、".join(f"{CASCADE_REASON_TEXT.get(reason, reason)} {count}"
+                               for reason, count in sorted(values["reasons"].items()))
+            print(f"  - 串聯 {stage}: {values['requests']} 次，小模型直接採用 {values['requests'] - values['escalations']} 次，"
+                  f"升級 {values['escalations']} 次 ({values['escalations'] / values['requests']:.0%}"
+                  f"{'；' + reasons if reasons else ''})")
+        return stats
+
+    def _record_cascade(self, stage, reason):
+        with self._stats_lock:
+            stats = self.cascade_stats.setdefault(stage, {"requests": 0, "escalations": 0, "reasons": {}})
+            stats["requests"] += 1
+            if reason:
+                stats["escalations"] += 1
+                stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+        METRICS.inc("cascade_requests_total", stage=stage, outcome=reason or "accepted")
+
+    @staticmethod
+    def _confidence(answer):
+        """解析模型自評信心，接受 0~1 或百分比；未提供或無法解析時回傳 None"""
+        try:
+            value = float(answer.get("confidence"))
+        except (TypeError, ValueError):
+            return None
+        return value / 100 if value > 1 else value
+
+    def _escalation_reason(self, answers, cascade=True):
+        """判斷小模型的回答是否需要升級至大模型，可直接採用時回傳 None；未串聯時只檢查回答是否有效"""
+        codes = set()
+        for answer in answers:
+            if isinstance(answer, dict) and answer.get("known") is False:
+                codes.add(None)
+                continue
+            if not is_classification_valid(answer):
+                return "invalid"
+            confidence = self._confidence(answer)
+            if cascade and (confidence is None or confidence < CASCADE_MIN_CONFIDENCE):
+                return "low_confidence"
+            codes.add(answer["subcategory_code"])
+        if len(codes) > 1:
+            return "disagree"
+        if cascade and codes == {None} and CASCADE_ESCALATE_UNKNOWN:
+            return "unknown"
+        return None
+
+    def _classify_cascade(self, stage, prompt, url_for_log):
+        """
+        依 OLLAMA_STAGE_MODELS 分類：先詢問小模型，結果無效、信心不足或彼此不一致時才升級至最後的大模型。
+        串聯的最終結果另以串聯標記快取，重跑時不必再經過小模型判斷。
+        """
+        models = self._stage_models(stage)
+        validator = STAGE_VALIDATORS[stage]
+        if len(models) == 1:
+            return self._call_ollama(prompt, url_for_log, expect_json=True, task=stage, model=models[0], validator=validator)
+
+        tag = "cascade:" + ",".join(models)
+        final_key = self._cache_key(prompt, "json", tag)
+        cached = self.cache.get(final_key) if final_key else None
+        if cached is not None:
+            print(f"  - 💾 使用快取的串聯分類結果 for {url_for_log}")
+            return cached
+
+        answers = []
+        reason = None
+        for model in models[:-1]:
+            answer = self._call_ollama(prompt, f"{url_for_log} ({model})", expect_json=True, task=stage, model=model,
+                                       validator=validator)
+            if answer is None and model in self._missing_models:
+                continue
+            answers.append(answer)
+            reason = self._escalation_reason(answers)
+            if reason:
+                break
+        if not answers:
+            return self._call_ollama(prompt, url_for_log, expect_json=True, task=stage, model=models[-1], validator=validator)
+        self._record_cascade(stage, reason)
+        if reason is None:
+            result = answers[0]
+        else:
+            print(f"  - ⬆️ 小模型結果{CASCADE_REASON_TEXT[reason]}，升級至 {models[-1]} for {url_for_log}")
+            result = self._call_ollama(prompt, url_for_log, expect_json=True, task=stage, model=models[-1], validator=validator)
+        # 無效的結果不快取，重試時才會再次詢問模型
+        if final_key and validator(result):
+            self.cache.put(final_key, tag, result)
+        return result
+
+    def _cache_key(self, prompt, fmt, model=None):
+        if not self.cache:
+            return None
+        return self.cache.make_key(model or self.model, prompt, self.system_prompt, fmt)
+
+    def _call_ollama(self, prompt, url_for_log, expect_json=False, stop_on_sentence=False, task=None, model=None, validator=None):
+        """
+        呼叫 Ollama 並回傳解析後的結果；提供 validator 時只快取通過驗證的結果，
+        避免無效回覆在重試與之後的重跑中被重複使用。
+        """
+        model = model or self.model
+        payload = self._base_payload(prompt, model)
+        if expect_json:
+            payload["format"] = "json"
+        parser = StreamingResponseParser(expect_json=expect_json, stop_on_sentence=stop_on_sentence,
+                                         validator=validator if expect_json else None)
+
+        cache_key = self._cache_key(prompt, payload.get("format"), model)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print(f"  - 💾 使用快取的 LLM 回覆 for {url_for_log}")
+                return cached
+        
+        try:
+            print(f"  - 向本地 Ollama API 請求 ({'JSON' if expect_json else 'Text'}) for {url_for_log}...")
+            try:
+                with METRICS.timer("llm_request_seconds", task=task, model=model):
+                    response_data = self.client.generate(payload, parser=parser)
+            except requests.exceptions.HTTPError:
+                if "context" not in payload:
+                    raise
+                # 模型重新載入後舊的 context 可能失效，重設後改用系統提示
+                with self._context_lock:
+                    self._context = None
+                payload.pop("context")
+                payload["system"] = self.system_prompt
+                with METRICS.timer("llm_request_seconds", task=task, model=model):
+                    response_data = self.client.generate(payload, parser=parser)
+
+            if response_data.get("thinking_budget_exceeded"):
+                # 思考超出預算：關閉思考模式重新請求一次
+                print(f"  - 思考內容超過 {parser.max_thinking_tokens} tokens，關閉思考模式重試 for {url_for_log}")
+                self._record_stats(response_data, parser, task, model)
+                payload["think"] = False
+                with METRICS.timer("llm_request_seconds", task=task, model=model):
+                    response_data = self.client.generate(payload, parser=parser)
+            self._record_stats(response_data, parser, task, model)
+            result = parser.finish() or None
+            if result is not None and cache_key and (validator is None or validator(result)):
+                self.cache.put(cache_key, model, result)
+            return result
+        except OllamaUnavailableError:
+            METRICS.inc("llm_errors_total", task=task, error="unavailable")
+            print(f"\n❌ 錯誤：無法連線至任何 Ollama 服務端點。")
+            raise
+        except requests.exceptions.Timeout:
+            METRICS.inc("llm_errors_total", task=task, error="timeout")
+            print(f"  - 呼叫本地 Ollama API 時發生超時錯誤 for {url_for_log}")
+            return None
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404 and model != self.model:
+                # 串聯中的小模型尚未下載：之後略過，直接交給其他模型
+                self._missing_models.add(model)
+                print(f"  - ⚠️ Ollama 上找不到模型 {model}，之後的串聯將略過此模型 (可執行 ollama pull {model})")
+                return None
+            METRICS.inc("llm_errors_total", task=task, error="http")
+            print(f"  - 呼叫本地 Ollama API 時發生 HTTP 錯誤 for {url_for_log}: {e}")
+            return None
+        except json.JSONDecodeError as e:
+            METRICS.inc("llm_errors_total", task=task, error="invalid_json")
+            print(f"  - 解析來自 Ollama 的 JSON 回覆時發生錯誤: {e}")
+            return None
+        except Exception as e:
+            METRICS.inc("llm_errors_total", task=task, error="other")
+            print(f"  - 呼叫本地 Ollama API 或處理回傳時發生未知錯誤: {e}")
+            return None
+
+    def classify_from_knowledge(self, url):
+        prompt = get_knowledge_classification_prompt(self.prompt_schema_str, url)
+        return self._classify_cascade("knowledge", prompt, f"{url} [知識庫分類]")
+
+    def classify_many_from_knowledge(self, urls):
+        """
+        將多個 URL 打包為單一請求分類：批次只交給串聯中的小模型，無效、信心不足或小模型不一致的項目
+        再逐一交給最後的大模型 (未串聯時即為逐一重試)；批次中回答「不認識」的項目改走單一網站分類流程。
+        """
+        models = self._stage_models("knowledge")
+        cascade = len(models) > 1
+        tag = "cascade:" + ",".join(models) if cascade else models[0]
+        results = {}
+        pending = []
+        knowledge_keys = {}
+        for url in urls:
+            key = self._cache_key(get_knowledge_classification_prompt(self.prompt_schema_str, url), "json", tag)
+            cached = self.cache.get(key) if key else None
+            if cached is not None:
+                results[url] = cached
+            else:
+                knowledge_keys[url] = key
+                pending.append(url)
+        if len(pending) < len(urls):
+            print(f"  - 💾 {len(urls) - len(pending)} 個網站使用快取的知識庫分類結果。")
+
+        while pending:
+            batch, pending = pending[:self.batch_sizer.size], pending[self.batch_sizer.size:]
+            if len(batch) == 1:
+                results[batch[0]] = self.classify_from_knowledge(batch[0])
+                continue
+
+            prompt = get_batch_knowledge_classification_prompt(self.prompt_schema_str, batch)
+            answers_by_model = []
+            for model in models[:-1] or models:
+                response = self._call_ollama(prompt, f"{len(batch)} 個網站 [批次知識庫分類] ({model})", expect_json=True,
+                                             task="knowledge_batch", model=model, validator=is_batch_knowledge_answer_valid)
+                if response is None and model in self._missing_models:
+                    continue
+                entries = response.get("results") if isinstance(response, dict) else response
+                by_url = {}
+                for entry in entries if isinstance(entries, list) else []:
+                    if isinstance(entry, dict) and entry.get("url") in batch:
+                        by_url[entry.pop("url")] = entry
+                answers_by_model.append(by_url)
+
+            failed, escalated, unknown = [], [], []
+            for url in batch:
+                answers = [by_url.get(url) for by_url in answers_by_model] or [None]
+                reason = self._escalation_reason(answers, cascade)
+                if cascade:
+                    self._record_cascade("knowledge", reason)
+                if reason == "invalid":
+                    failed.append(url)
+                    continue
+                if reason:
+                    escalated.append(url)
+                    continue
+                if answers[0].get("known") is False:
+                    # 批次提示中的「不認識」不代表單獨詢問時也不認識，不快取，改走單一網站分類流程
+                    unknown.append(url)
+                    continue
+                results[url] = answers[0]
+                # 以單一網站提示的快取鍵儲存，之後逐一分類或重跑時可直接命中
+                if knowledge_keys.get(url):
+                    self.cache.put(knowledge_keys[url], tag, results[url])
+            self.batch_sizer.record(len(batch), len(failed))
+            print(f"  - 批次知識庫分類完成: {len(batch) - len(failed) - len(escalated) - len(unknown)}/{len(batch)} 筆採用"
+                  f"{f'，{len(escalated)} 筆升級至 {models[-1]}' if escalated else ''}"
+                  f"{f'，{len(unknown)} 筆不認識改為逐一分類' if unknown else ''}，下一批大小 {self.batch_sizer.size}。")
+
+            # 無效或需升級的項目逐一交給最後的大模型
+            for url in failed + escalated:
+                prompt = get_knowledge_classification_prompt(self.prompt_schema_str, url)
+                results[url] = self._call_ollama(prompt, f"{url} [知識庫分類]", expect_json=True, task="knowledge",
+                                                 model=models[-1], validator=is_knowledge_answer_valid)
+                if cascade and is_knowledge_answer_valid(results[url]) and knowledge_keys.get(url):
+                    self.cache.put(knowledge_keys[url], tag, results[url])
+            for url in unknown:
+                results[url] = self.classify_from_knowledge(url)
+        return results
 
     def get_summary_from_content(self, text_content, url):
         prompt = get_content_summary_prompt(text_content[:8000])
-        return self._call_ollama(prompt, f"{url} [內容摘要]")
+        models = self._stage_models("summary")
+        summary = self._call_ollama(prompt, f"{url} [內容摘要]", stop_on_sentence=True, task="summary", model=models[0])
+        if len(models) > 1:
+            # 摘要只有兩層：小模型未產生摘要時直接交給最後的大模型
+            self._record_cascade("summary", None if summary else "empty")
+            if not summary:
+                print(f"  - ⬆️ {models[0]} 未產生摘要，升級至 {models[-1]} for {url}")
+                summary = self._call_ollama(prompt, f"{url} [內容摘要]", stop_on_sentence=True, task="summary",
+                                            model=models[-1])
+        return summary
+
+    def classify_from_metadata(self, url, title, description, summary, examples=None):
+        prompt = get_classification_from_metadata_prompt(self.prompt_schema_str, url, title, description, summary, examples)
+        return self._classify_cascade("metadata", prompt, f"{url} [元數據分類]")
+
+class PageExtractor(HTMLParser):
+    """
+    以串流 tokenizer 單次走訪 HTML，同時取得標題、meta 描述、可見文字 (有長度上限) 與對外連結的根 URL。
+    """
+    SKIPPED_TAGS = {"script", "style", "header", "footer", "nav", "aside"}
+
+    def __init__(self, base_url, max_text_chars=None):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.max_text_chars = max_text_chars or PAGE_TEXT_MAX_CHARS
+        self.title = None
+        self.description = ""
+        self.root_urls = {}
+        self._text_parts = []
+        self._text_length = 0
+        self._skip_depth = 0
+        self._in_title = False
+        self._title_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == "title" and self.title is None:
+            self._in_title = True
+        elif tag == "meta" and not self.description:
+            attributes = dict(attrs)
+            if (attributes.get("name") or "").lower() == "description" and attributes.get("content"):
+                self.description = attributes["content"].strip()
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self._add_link(href)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in self.SKIPPED_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == "title" and self._in_title:
+            self._in_title = False
+            self.title = "".join(self._title_parts).strip()
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title_parts.append(data)
+        if self._skip_depth or self._text_length >= self.max_text_chars:
+            return
+        text = data.strip()
+        if text:
+            self._text_parts.append(text)
+            self._text_length += len(text) + 1
+
+    @property
+    def text_full(self):
+        return self._text_length >= self.max_text_chars
+
+    @property
+    def text_complete(self):
+        """文字已達上限、已取得標題且不在略過的區塊中：其餘內容只需掃描連結"""
+        return self.text_full and self.title is not None and not self._skip_depth
+
+    def unparsed(self):
+        """回傳已餵入但 tokenizer 尚未處理的原始內容 (例如被切斷的標籤)"""
+        return self.rawdata
+
+    def scan_links(self, html):
+        """不經 tokenizer，以正規表示式從 html 中擷取連結"""
+        for match in ANCHOR_HREF_PATTERN.finditer(html):
+            self._add_link(unescape(next(g for g in match.groups() if g is not None)))
+
+    def _add_link(self, href):
+        try:
+            parsed = urlparse(urljoin(self.base_url, href.strip()))
+        except ValueError:
+            return
+        if parsed.scheme in ("http", "https") and parsed.netloc:
+            self.root_urls.setdefault(f"{parsed.scheme}://{parsed.netloc}", None)
+
+    def result(self):
+        return {
+            "title": self.title or "",
+            "description": self.description,
+            "text_content": " ".join(self._text_parts)[:self.max_text_chars],
+            "links": list(self.root_urls),
+        }
+
+PRECLASSIFIER_DOMAIN_RULES = {
+    "wikipedia.org": "070-03", "google.com": "100-01", "google.com.tw": "100-01", "bing.com": "100-01", "yahoo.com": "100-01",
+    "facebook.com": "030-01", "instagram.com": "030-01", "twitter.com": "030-01", "x.com": "030-01", "linkedin.com": "030-01",
+    "reddit.com": "030-03", "quora.com": "030-03", "dcard.tw": "030-03", "ptt.cc": "030-03",
+    "youtube.com": "040-01", "twitch.tv": "040-01", "netflix.com": "040-04", "spotify.com": "040-02", "gamer.com.tw": "040-03",
+    "amazon.com": "050-01", "pchome.com.tw": "050-01", "momoshop.com.tw": "050-01", "taobao.com": "050-01",
+    "alibaba.com": "050-01", "books.com.tw": "050-01", "ebay.com": "050-02", "ruten.com.tw": "050-02",
+    "ettoday.net": "080-01", "chinatimes.com": "080-01", "ltn.com.tw": "080-01", "udn.com": "080-01", "cw.com.tw": "080-01",
+    "bbc.com": "080-01", "bbc.co.uk": "080-01", "cnn.com": "080-01", "nytimes.com": "080-01", "wsj.com": "080-01",
+    "reuters.com": "080-01", "aljazeera.com": "080-01", "npr.org": "080-01", "bloomberg.com": "080-01", "forbes.com": "080-01",
+    "theguardian.com": "080-01", "huffpost.com": "080-01", "vox.com": "080-01", "washingtonpost.com": "080-01",
+    "vice.com": "080-01", "foxnews.com": "080-01",
+    "github.com": "100-07", "gitlab.com": "100-07", "stackoverflow.com": "100-07", "gmail.com": "100-03", "outlook.com": "100-03",
+    "dropbox.com": "100-04", "coursera.org": "070-01", "khanacademy.org": "070-01",
+    "doubleclick.net": "020-05", "googlesyndication.com": "020-05", "google-analytics.com": "020-05",
+    "sedoparking.com": "999-03", "parkingcrew.net": "999-03", "bodis.com": "999-03",
+}
+PRECLASSIFIER_SUFFIX_RULES = {
+    "gov": ["080-04", 0.97], "gov.tw": ["080-04", 0.97], "gov.uk": ["080-04", 0.97], "gov.cn": ["080-04", 0.97],
+    "go.jp": ["080-04", 0.97], "mil": ["080-04", 0.95],
+    "edu": ["070-02", 0.95], "edu.tw": ["070-02", 0.95], "edu.cn": ["070-02", 0.95], "ac.uk": ["070-02", 0.95], "ac.jp": ["070-02", 0.95],
+}
+PRECLASSIFIER_TOKEN_RULES = {
+    "porn": ["010-01", 0.95], "xxx": ["010-01", 0.93], "casino": ["010-06", 0.93], "poker": ["010-06", 0.9],
+    "lottery": ["010-06", 0.9], "torrent": ["020-04", 0.9], "vpn": ["020-03", 0.85], "proxy": ["020-03", 0.85],
+    "weather": ["080-02", 0.9], "bank": ["060-01", 0.85], "crypto": ["060-03", 0.85], "recipe": ["090-02", 0.85],
+    "hotel": ["090-03", 0.8], "travel": ["090-03", 0.75], "jobs": ["060-05", 0.8], "news": ["080-01", 0.8],
+    "shop": ["050-01", 0.7], "games": ["040-03", 0.7], "wiki": ["070-03", 0.75],
+}
+PARKED_PAGE_PATTERN = re.compile(
+    r"(this domain (name )?(is|may be) for sale|buy this domain|domain is parked|parked free|此網域(出售|待售)|域名(出售|轉讓))",
+    re.IGNORECASE
+)
+
+def domain_features(host):
+    """將主機名稱轉為特徵：TLD、各標籤與標籤的字元 3-gram"""
+    labels = [label for label in re.split(r"[.\-_]", host.lower()) if label and label != "www"]
+    if not labels:
+        return []
+    features = ["T:" + labels[-1]]
+    for label in labels[:-1]:
+        features.append("L:" + label)
+        padded = f"^{label}$"
+        features.extend("G:" + padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+def text_features(text):
+    """將文字轉為特徵：英文單字與中文字元 bigram"""
+    text = (text or "")[:PRECLASSIFIER_TEXT_CHARS].lower()
+    features = ["W:" + word for word in re.findall(r"[a-z]{2,}", text)]
+    for run in re.findall(r"[一-鿿]+", text):
+        features.extend("C:" + run[i:i + 2] for i in range(len(run) - 1))
+    return features
 
-    def classify_from_metadata(self, url, title, description, summary):
-        prompt = get_classification_from_metadata_prompt(self.schema_json_str, url, title, description, summary)
-        return self._call_ollama(prompt, f"{url} [元數據分類]", expect_json=True)
+class HashedNaiveBayes:
+    """以雜湊 n-gram 特徵訓練的多項式單純貝氏分類器 (在對數空間中為線性模型)"""
+    def __init__(self, buckets=None, alpha=None):
+        self.buckets = buckets or PRECLASSIFIER_HASH_BUCKETS
+        self.alpha = PRECLASSIFIER_SMOOTHING if alpha is None else alpha
+        self.class_counts = {}
+        self.feature_counts = {}
+        self.feature_totals = {}
+
+    def _hash(self, features):
+        return [zlib.crc32(feature.encode("utf-8")) % self.buckets for feature in features]
+
+    def fit(self, samples):
+        for features, label in samples:
+            self.class_counts[label] = self.class_counts.get(label, 0) + 1
+            counts = self.feature_counts.setdefault(label, {})
+            for bucket in self._hash(features):
+                counts[bucket] = counts.get(bucket, 0) + 1
+            self.feature_totals[label] = self.feature_totals.get(label, 0) + len(features)
+        return self
+
+    def predict(self, features):
+        """回傳 (標籤, 後驗機率)；沒有特徵或尚未訓練時回傳 (None, 0.0)"""
+        hashed = self._hash(features)
+        if not hashed or not self.class_counts:
+            return None, 0.0
+        sample_count = sum(self.class_counts.values())
+        scores = {}
+        for label, class_count in self.class_counts.items():
+            counts = self.feature_counts[label]
+            denominator = math.log(self.feature_totals[label] + self.alpha * self.buckets)
+            score = math.log(class_count / sample_count)
+            for bucket in hashed:
+                score += math.log(counts.get(bucket, 0) + self.alpha) - denominator
+            scores[label] = score
+        best_label = max(scores, key=scores.get)
+        best_score = scores[best_label]
+        normalizer = sum(math.exp(score - best_score) for score in scores.values())
+        return best_label, 1.0 / normalizer
+
+class PreClassifier:
+    """
+    在呼叫 LLM 之前的低成本分類層：精確 / 後綴域名規則、TLD 提示、URL 關鍵字，
+    以及由既有 classified_domains 訓練的雜湊 n-gram 線性模型。信心不足時才交給 LLM。
+    """
+    def __init__(self, rules_path=None, threshold=None):
+        self.threshold = PRECLASSIFIER_CONFIDENCE_THRESHOLD if threshold is None else threshold
+        self.domain_rules = dict(PRECLASSIFIER_DOMAIN_RULES)
+        self.suffix_rules = dict(PRECLASSIFIER_SUFFIX_RULES)
+        self.token_rules = dict(PRECLASSIFIER_TOKEN_RULES)
+        self.model = None
+        self.holdout = None
+        self.stats = {"lookups": 0, "hits": 0, "audits": 0, "compared": 0, "agreed": 0, "hits_by_source": {}}
+        self._pending = {}
+        self._lock = threading.Lock()
+        rules_path = rules_path or PRECLASSIFIER_RULES_PATH
+        if rules_path and os.path.exists(rules_path):
+            self._load_rules(rules_path)
+
+    def _load_rules(self, path):
+        """讀取自訂規則檔 ({"domains": {...}, "suffixes": {...}, "tokens": {...}})，與內建規則合併"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                rules = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"讀取預分類規則檔 '{path}' 失敗: {e}")
+            return
+        self.domain_rules.update(rules.get("domains", {}))
+        self.suffix_rules.update(rules.get("suffixes", {}))
+        self.token_rules.update(rules.get("tokens", {}))
+        print(f"已載入預分類規則檔 '{path}'。")
+
+    @staticmethod
+    def _rule_value(value, default_confidence):
+        if isinstance(value, (list, tuple)):
+            return value[0], float(value[1])
+        return value, default_confidence
+
+    def train(self, rows):
+        """以 (domain, subcategory_code, summary) 資料訓練模型，保留一部分資料評估信心門檻下的覆蓋率與準確率"""
+        samples, holdout = [], []
+        for domain, sub_code, summary in rows:
+            if sub_code not in SUBCATEGORY_MAP or sub_code in ("999-01", "999-02", "999-99"):
+                continue
+            sample = (domain_features(domain) + text_features(summary), sub_code)
+            # 以域名雜湊決定是否保留作評估，確保每次訓練的切分一致
+            if zlib.crc32(domain.encode("utf-8")) % 10 == 0:
+                holdout.append(sample)
+            else:
+                samples.append(sample)
+        if len(samples) < PRECLASSIFIER_MIN_TRAINING_ROWS:
+            print(f"預分類模型訓練資料不足 ({len(samples)} 筆，至少需要 {PRECLASSIFIER_MIN_TRAINING_ROWS} 筆)，僅使用規則層。")
+            return None
+        model = HashedNaiveBayes().fit(samples)
+        covered = correct = 0
+        for features, label in holdout:
+            predicted, confidence = model.predict(features)
+            if confidence >= self.threshold:
+                covered += 1
+                correct += predicted == label
+        accuracy = correct / covered if covered else 0.0
+        self.holdout = {"size": len(holdout), "covered": covered, "accuracy": accuracy}
+        print(f"預分類模型已訓練 ({len(samples)} 筆，{len(model.class_counts)} 類)；保留集 {len(holdout)} 筆中"
+              f"信心 ≥ {self.threshold} 的覆蓋 {covered} 筆，準確率 {accuracy:.1%}")
+        if covered and accuracy < PRECLASSIFIER_MIN_MODEL_ACCURACY:
+            print(f"  - 保留集準確率低於 {PRECLASSIFIER_MIN_MODEL_ACCURACY:.0%}，停用模型層，僅使用規則層。")
+            return None
+        self.model = model
+        return model
+
+    def _rule_guess(self, host):
+        labels = host.split(".")
+        for i in range(len(labels)):
+            suffix = ".".join(labels[i:])
+            if suffix in self.domain_rules:
+                return self._rule_value(self.domain_rules[suffix], 0.99) + ("domain",)
+            if suffix in self.suffix_rules:
+                return self._rule_value(self.suffix_rules[suffix], 0.95) + ("suffix",)
+        best = None
+        for token in re.split(r"[.\-_]", host):
+            for keyword, value in self.token_rules.items():
+                if token == keyword or (len(keyword) >= 5 and keyword in token):
+                    sub_code, confidence = self._rule_value(value, 0.8)
+                    if not best or confidence > best[1]:
+                        best = (sub_code, confidence, "token")
+        return best
+
+    def _guess(self, host, text):
+        """規則層達門檻時優先採用 (人工維護、較可靠)，否則取規則與模型中信心最高者"""
+        guesses = [self._rule_guess(host)]
+        if text and PARKED_PAGE_PATTERN.search(text[:PRECLASSIFIER_TEXT_CHARS]):
+            guesses.append(("999-03", 0.95, "parked"))
+        confident_rules = [guess for guess in guesses if guess and guess[1] >= self.threshold and guess[0] in SUBCATEGORY_MAP]
+        if confident_rules:
+            return max(confident_rules, key=lambda guess: guess[1])
+        if self.model:
+            sub_code, confidence = self.model.predict(domain_features(host) + text_features(text))
+            if sub_code:
+                guesses.append((sub_code, confidence, "model"))
+        guesses = [guess for guess in guesses if guess and guess[0] in SUBCATEGORY_MAP]
+        return max(guesses, key=lambda guess: guess[1]) if guesses else None
+
+    def classify(self, url, text=None):
+        """回傳信心達門檻的分類結果，否則回傳 None (並記下猜測，待 LLM 結果出爐後比對準確率)"""
+        host = canonicalize_host(urlparse(url).netloc)
+        if not host:
+            return None
+        domain = domain_key(url)
+        guess = self._guess(host, text)
+        with self._lock:
+            self.stats["lookups"] += 1
+            if not guess:
+                return None
+            sub_code, confidence, source = guess
+            if confidence < self.threshold:
+                self._pending[domain] = guess
+                return None
+            # 抽樣部分命中仍交給 LLM，用於估計此層的準確率 (精確域名規則除外)
+            if source != "domain" and zlib.crc32(domain.encode("utf-8")) % 10000 < PRECLASSIFIER_AUDIT_RATE * 10000:
+                self.stats["audits"] += 1
+                self._pending[domain] = guess
+                return None
+            self.stats["hits"] += 1
+            self.stats["hits_by_source"][source] = self.stats["hits_by_source"].get(source, 0) + 1
+        return {
+            "known": True,
+            "main_category_code": sub_code[:3],
+            "subcategory_code": sub_code,
+            "summary": None,  # 預分類沒有讀過網站內容，不產生摘要；來源記錄在 classified_by
+            "confidence": round(confidence, 3),
+            "source": source,
+        }
+
+    def record_label(self, domain, result):
+        """以 LLM 的最終分類比對先前的低信心猜測或抽樣命中"""
+        if not result or result.get("source") or not is_classification_valid(result):
+            return
+        with self._lock:
+            guess = self._pending.pop(domain, None)
+            if guess:
+                self.stats["compared"] += 1
+                self.stats["agreed"] += guess[0] == result.get("subcategory_code")
+            if len(self._pending) > PRECLASSIFIER_PENDING_LIMIT:
+                self._pending.clear()
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        if not stats["lookups"]:
+            return stats
+        by_source = "、".join(f"{source} {count}" for source, count in stats["hits_by_source"].items()) or "無"
+        agreement = f"{stats['agreed'] / stats['compared']:.1%}" if stats["compared"] else "無資料"
+        print(f"📊 預分類統計: 查詢 {stats['lookups']} 次，命中 {stats['hits']} 次 ({stats['hits'] / stats['lookups']:.1%}; {by_source})，"
+              f"與 LLM 標籤比對 {stats['compared']} 筆 (含抽樣 {stats['audits']} 筆)，一致率 {agreement}")
+        return stats
+
+def embed_text(text, dim, idf=None):
+    """以帶正負號的特徵雜湊將文字轉為 TF(-IDF) 向量並做 L2 正規化 (詞頻取對數)"""
+    counts = {}
+    for feature in text_features(text):
+        counts[feature] = counts.get(feature, 0) + 1
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, count in counts.items():
+        hashed = zlib.crc32(feature.encode("utf-8"))
+        vector[hashed % dim] += (1.0 + math.log(count)) * (1.0 if hashed & 0x80000000 else -1.0)
+    if idf is not None:
+        vector *= idf
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+class VectorIndex:
+    """
+    以記憶體映射 (memmap) 的 float32 矩陣保存摘要的向量，
+    另以 TSV 記錄每列的域名、子類別代碼與摘要片段，以 JSON 記錄維度、IDF 與同步進度。
+    只索引摘要 (資料庫中保存的欄位)，重建與線上新增的向量才會位於同一空間。
+    """
+    TEXT_RECIPE = "summary"
+    def __init__(self, base_path, dim=None):
+        self.vector_path = base_path + ".vec"
+        self.rows_path = base_path + ".tsv"
+        self.meta_path = base_path + ".json"
+        self.dim = dim or EMBEDDING_DIM
+        self.idf = None
+        self.idf_doc_count = 0
+        self.last_row_id = 0
+        self.rows = []
+        self.domains = set()
+        self._vectors = None
+        self._pending_vectors = []
+        self._pending_rows = []
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            self._remove_files()
+            return
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            rows = []
+            if os.path.exists(self.rows_path):
+                with open(self.rows_path, encoding="utf-8") as f:
+                    rows = [tuple(line.rstrip("\n").split("\t", 2)) for line in f]
+            vector_size = os.path.getsize(self.vector_path) if os.path.exists(self.vector_path) else 0
+        except (OSError, ValueError) as e:
+            print(f"讀取向量索引失敗，將重建: {e}")
+            self._remove_files()
+            return
+        if meta.get("dim") != self.dim or meta.get("recipe") != self.TEXT_RECIPE:
+            print("向量索引維度或索引內容與設定不符，將重建。")
+            self._remove_files()
+            return
+        count = min(meta.get("count", 0), len(rows), vector_size // (4 * self.dim))
+        # 上次寫入後、更新 meta 前中斷時，檔案尾端會殘留未記錄的資料；截斷後續附加才不會錯位
+        if vector_size > count * 4 * self.dim:
+            os.truncate(self.vector_path, count * 4 * self.dim)
+        if len(rows) > count:
+            with open(self.rows_path + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines("\t".join(row) + "\n" for row in rows[:count])
+            os.replace(self.rows_path + ".tmp", self.rows_path)
+        self.idf = np.asarray(meta["idf"], dtype=np.float32) if meta.get("idf") else None
+        self.idf_doc_count = meta.get("idf_doc_count", 0)
+        self.last_row_id = meta.get("last_row_id", 0)
+        self.rows = rows[:count]
+        self.domains = {row[0] for row in self.rows}
+        self._open_vectors(count)
+        print(f"已載入向量索引 ({count} 筆，維度 {self.dim})。")
+
+    def _remove_files(self):
+        """刪除沒有有效 meta 對應的向量與列資料，避免之後附加到殘留的資料後方"""
+        for path in (self.vector_path, self.rows_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _open_vectors(self, count):
+        self._vectors = np.memmap(self.vector_path, dtype=np.float32, mode="r", shape=(count, self.dim)) if count else None
+
+    def __len__(self):
+        return len(self.rows) + len(self._pending_rows)
+
+    def rebuild(self, rows_factory):
+        """由 rows_factory() 產生的 (row_id, domain, sub_code, text) 重新計算 IDF 並重建整個索引"""
+        document_frequency = np.zeros(self.dim, dtype=np.float64)
+        doc_count = 0
+        for _, _, _, text in rows_factory():
+            document_frequency[np.nonzero(embed_text(text, self.dim))[0]] += 1
+            doc_count += 1
+        with self._lock:
+            self.idf = np.log((1 + doc_count) / (1 + document_frequency)).astype(np.float32) + 1.0
+            self.idf_doc_count = doc_count
+            self.rows, self.domains, self._vectors = [], set(), None
+            self._pending_vectors, self._pending_rows = [], []
+            self._remove_files()
+        for row_id, domain, sub_code, text in rows_factory():
+            self.add(domain, sub_code, text, row_id=row_id)
+        self.flush()
+        print(f"向量索引已重建 ({len(self)} 筆)。")
+
+    def sync(self, db_manager):
+        """將資料庫中尚未索引的分類紀錄加入索引；資料量較上次計算 IDF 時成長一倍以上則整個重建"""
+        rows_factory = lambda: ((row_id, domain, sub_code, summary) for row_id, domain, sub_code, summary
+                                in db_manager.iter_classified_rows(llm_only=True) if sub_code not in EMBEDDING_EXCLUDED_CODES)
+        total = db_manager.classified_count()
+        if self.idf is None or total > 2 * max(self.idf_doc_count, EMBEDDING_MIN_INDEX_SIZE // 2):
+            if total:
+                self.rebuild(rows_factory)
+            return
+        added = 0
+        for row_id, domain, sub_code, summary in db_manager.iter_classified_rows(after_id=self.last_row_id, llm_only=True):
+            if sub_code not in EMBEDDING_EXCLUDED_CODES and self.add(domain, sub_code, summary, row_id=row_id):
+                added += 1
+        self.flush()
+        if added:
+            print(f"向量索引已同步新增 {added} 筆。")
+
+    def add(self, domain, sub_code, text, row_id=None):
+        """加入一筆紀錄 (同一域名只會索引一次)；尚未計算 IDF 時不加權"""
+        if not domain or not text:
+            return False
+        vector = embed_text(text, self.dim, self.idf)
+        snippet = re.sub(r"\s+", " ", text)[:EMBEDDING_SNIPPET_CHARS]
+        with self._lock:
+            if row_id:
+                self.last_row_id = max(self.last_row_id, row_id)
+            if domain in self.domains:
+                return False
+            self.domains.add(domain)
+            self._pending_vectors.append(vector)
+            self._pending_rows.append((domain, sub_code, snippet))
+            if len(self._pending_rows) >= EMBEDDING_FLUSH_EVERY:
+                self._flush_locked()
+        return True
+
+    def search(self, text, k=None):
+        """回傳與 text 最相似的 k 筆紀錄 [(相似度, 域名, 子類別代碼, 摘要片段), ...]"""
+        k = k or EMBEDDING_KNN_K
+        query = embed_text(text, self.dim, self.idf)
+        with self._lock:
+            rows = self.rows + self._pending_rows
+            blocks = [self._vectors] if self._vectors is not None else []
+            if self._pending_vectors:
+                blocks.append(np.vstack(self._pending_vectors))
+        if not rows or not query.any():
+            return []
+        similarities = np.concatenate([block @ query for block in blocks])
+        k = min(k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [(float(similarities[i]),) + tuple(rows[i]) for i in top]
+
+    def _flush_locked(self):
+        if self._pending_rows:
+            with open(self.vector_path, "ab") as f:
+                f.write(np.vstack(self._pending_vectors).astype(np.float32).tobytes())
+            with open(self.rows_path, "a", encoding="utf-8") as f:
+                f.writelines("\t".join(row) + "\n" for row in self._pending_rows)
+            self.rows.extend(self._pending_rows)
+            self._pending_vectors, self._pending_rows = [], []
+            self._open_vectors(len(self.rows))
+        meta = {"dim": self.dim, "recipe": self.TEXT_RECIPE, "count": len(self.rows), "last_row_id": self.last_row_id, "idf_doc_count": self.idf_doc_count,
+                "idf": self.idf.tolist() if self.idf is not None else None}
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self.flush()
+
+class KnnClassifier:
+    """以向量索引中的 k 個最近鄰分類；鄰居相似度高且標籤一致時直接沿用，否則提供為 few-shot 範例"""
+    def __init__(self, index, min_similarity=None, min_neighbours=None):
+        self.index = index
+        self.min_similarity = EMBEDDING_MIN_SIMILARITY if min_similarity is None else min_similarity
+        self.min_neighbours = min_neighbours or EMBEDDING_MIN_NEIGHBOURS
+        self.stats = {"lookups": 0, "reused": 0, "few_shot": 0}
+        self._lock = threading.Lock()
+
+    def classify(self, summary):
+        """以摘要查詢 (與索引內容相同的文字來源)，回傳 (分類結果或 None, few-shot 範例列表)"""
+        neighbours = self.index.search(summary)
+        with self._lock:
+            self.stats["lookups"] += 1
+        close = [neighbour for neighbour in neighbours if neighbour[0] >= self.min_similarity]
+        labels = {neighbour[2] for neighbour in close}
+        if len(close) >= self.min_neighbours and len(labels) == 1:
+            sub_code = labels.pop()
+            if sub_code in SUBCATEGORY_MAP:
+                with self._lock:
+                    self.stats["reused"] += 1
+                return {"main_category_code": sub_code[:3], "subcategory_code": sub_code, "source": "knn",
+                        "confidence": round(min(neighbour[0] for neighbour in close), 3)}, []
+        examples = [{"domain": domain, "summary": snippet, "subcategory_code": sub_code}
+                    for similarity, domain, sub_code, snippet in neighbours[:EMBEDDING_FEW_SHOT]
+                    if sub_code in SUBCATEGORY_MAP and similarity >= EMBEDDING_FEW_SHOT_MIN_SIMILARITY]
+        if examples:
+            with self._lock:
+                self.stats["few_shot"] += 1
+        return None, examples
+
+    def remember(self, domain, result):
+        """將 LLM 產生的分類以摘要加入索引 (預分類或最近鄰沿用的結果不加入，避免自我強化)"""
+        if result.get("source") or result.get("subcategory_code") in EMBEDDING_EXCLUDED_CODES:
+            return
+        self.index.add(domain, result.get("subcategory_code"), result.get("summary"))
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        if stats["lookups"]:
+            print(f"📊 最近鄰分類: 查詢 {stats['lookups']} 次，沿用鄰居標籤 {stats['reused']} 次"
+                  f" ({stats['reused'] / stats['lookups']:.1%})，提供 few-shot 範例 {stats['few_shot']} 次 (索引 {len(self.index)} 筆)")
+        return stats
+
+def simhash_fingerprint(text, shingle_size=None):
+    """以詞 (英數字) / 字 (中文) 的 shingle 計算 64 位元 SimHash 指紋，內容太少時回傳 None"""
+    shingle_size = shingle_size or SIMHASH_SHINGLE_SIZE
+    tokens = re.findall(r"[a-z0-9]+|[一-鿿]", (text or "").lower())
+    if len(tokens) < shingle_size:
+        return None
+    counts = {}
+    for i in range(len(tokens) - shingle_size + 1):
+        shingle = " ".join(tokens[i:i + shingle_size])
+        counts[shingle] = counts.get(shingle, 0) + 1
+    weights = [0] * 64
+    for shingle, count in counts.items():
+        hashed = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += count if hashed >> bit & 1 else -count
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+def format_fingerprint(fingerprint):
+    """將 SimHash 指紋轉為儲存於 classified_domains.content_fingerprint 的 16 位十六進位字串"""
+    return f"{fingerprint:016x}" if fingerprint is not None else None
+
+class NearDuplicateIndex:
+    """
+    以 SimHash 指紋辨識近似重複頁面 (停泊頁、防火牆挑戰頁、鏡像站等)，
+    以 4 個 16 位元分段 (LSH band) 建立 SQLite 索引，漢明距離在門檻內即視為同一群集 (執行緒安全)。
+    """
+    BANDS = 4
+    BAND_BITS = 16
+
+    def __init__(self, path, max_distance=None):
+        self.max_distance = SIMHASH_MAX_DISTANCE if max_distance is None else max_distance
+        self.stats = {"lookups": 0, "hits": 0, "clusters_added": 0}
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS simhash_clusters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fingerprint INTEGER NOT NULL,
+                domain TEXT,
+                main_category_code TEXT NOT NULL,
+                subcategory_code TEXT NOT NULL,
+                summary TEXT,
+                members INTEGER NOT NULL DEFAULT 1,
+                created_at REAL NOT NULL
+            )
+            """)
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS simhash_bands (
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                cluster_id INTEGER NOT NULL
+            )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_simhash_bands ON simhash_bands (band, value)")
+
+    @staticmethod
+    def _to_signed(fingerprint):
+        return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+    def _bands(self, fingerprint):
+        mask = (1 << self.BAND_BITS) - 1
+        return [(band, fingerprint >> (band * self.BAND_BITS) & mask) for band in range(self.BANDS)]
+
+    def find(self, fingerprint):
+        """
+        回傳漢明距離最近且在門檻內的群集 (dict)，找不到時回傳 None。逐一查詢每個分段後合併候選，
+        不設候選上限，確保距離在門檻內的群集必定被找到；不修改資料庫，沿用分類時由呼叫端呼叫 mark_inherited。
+        """
+        if fingerprint is None:
+            return None
+        with self._lock:
+            self.stats["lookups"] += 1
+            candidates = {}
+            for band, value in self._bands(fingerprint):
+                for row in self.conn.execute(
+                    """SELECT c.id, c.fingerprint, c.domain, c.main_category_code, c.subcategory_code, c.summary
+                       FROM simhash_bands b JOIN simhash_clusters c ON c.id = b.cluster_id WHERE b.band = ? AND b.value = ?""",
+                    (band, value)
+                ):
+                    candidates[row[0]] = row
+        best = None
+        for cluster_id, stored, domain, main_code, sub_code, summary in candidates.values():
+            distance = bin(fingerprint ^ (stored & ((1 << 64) - 1))).count("1")
+            if distance <= self.max_distance and (best is None or distance < best["distance"]):
+                best = {"id": cluster_id, "domain": domain, "main_category_code": main_code,
+                        "subcategory_code": sub_code, "summary": summary, "distance": distance}
+        return best
+
+    def mark_inherited(self, cluster):
+        """記錄一次沿用群集分類 (群集成員數加一)"""
+        with self._lock:
+            self.stats["hits"] += 1
+            try:
+                with self.conn:
+                    self.conn.execute("UPDATE simhash_clusters SET members = members + 1 WHERE id = ?", (cluster["id"],))
+            except sqlite3.Error as e:
+                print(f"  - 更新 SimHash 群集成員數時發生錯誤: {e}")
+
+    def add(self, fingerprint, domain, result):
+        """以一筆有效的分類結果建立新的群集"""
+        if fingerprint is None or not is_classification_valid(result):
+            return
+        with self._lock:
+            try:
+                with self.conn:
+                    cursor = self.conn.execute(
+                        """INSERT INTO simhash_clusters (fingerprint, domain, main_category_code, subcategory_code, summary, created_at)
+                           VALUES (?, ?, ?, ?, ?, ?)""",
+                        (self._to_signed(fingerprint), domain, result["main_category_code"], result["subcategory_code"],
+                         result.get("summary"), time.time())
+                    )
+                    self.conn.executemany("INSERT INTO simhash_bands (band, value, cluster_id) VALUES (?, ?, ?)",
+                                          [(band, value, cursor.lastrowid) for band, value in self._bands(fingerprint)])
+                self.stats["clusters_added"] += 1
+            except sqlite3.Error as e:
+                print(f"  - 寫入 SimHash 指紋時發生錯誤: {e}")
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        if stats["lookups"]:
+            print(f"📊 近似重複偵測: 查詢 {stats['lookups']} 次，沿用群集分類 {stats['hits']} 次"
+                  f" ({stats['hits'] / stats['lookups']:.1%})，新增群集 {stats['clusters_added']} 個")
+        return stats
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+def decode_html(content, declared_encoding=None):
+    """
+    將 HTML 位元組解碼為字串，編碼判斷順序同瀏覽器：BOM、HTTP Content-Type 宣告的 charset (declared_encoding)、
+    meta charset，皆無法判斷時以 UTF-8 容錯解碼。
+    """
+    if isinstance(content, str):
+        return content
+    if content.startswith(b"\xef\xbb\xbf"):
+        return content[3:].decode("utf-8", errors="replace")
+    match = re.search(rb'charset=["\']?([A-Za-z0-9_\-]+)', content[:4096])
+    for encoding in (declared_encoding, match.group(1).decode("ascii") if match else None):
+        if encoding:
+            try:
+                return content.decode(encoding, errors="replace")
+            except LookupError:
+                continue
+    return content.decode("utf-8", errors="replace")
+
+ANCHOR_HREF_PATTERN = re.compile(r"""<a\b[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+
+def extract_page(content, base_url):
+    """
+    單次解析頁面，回傳 title、description、text_content 與 links (對外連結的根 URL)。
+    以分塊方式餵入 tokenizer；文字達上限後，其餘部分只以正規表示式掃描連結。
+    """
+    html = decode_html(content)
+    extractor = PageExtractor(base_url)
+    position = 0
+    while position < len(html):
+        extractor.feed(html[position:position + PAGE_PARSE_CHUNK_CHARS])
+        position += PAGE_PARSE_CHUNK_CHARS
+        if extractor.text_complete:
+            extractor.scan_links(extractor.unparsed() + html[position:])
+            return extractor.result()
+    extractor.close()
+    return extractor.result()
+
+class PageCache:
+    """以 URL 為鍵的頁面解析結果 LRU 快取 (執行緒安全)"""
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or PAGE_CACHE_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url, page, final_url):
+        with self._lock:
+            self._entries[url] = (page, final_url)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class PolitenessScheduler:
+    """
+    依主機與 IP 記錄下一次允許抓取的時間，並遵守 robots.txt 的 Crawl-delay (快取解析結果)。
+    fetch_robots(robots_url) 回傳 robots.txt 內容 (不存在或失敗時為 None)，由抓取器提供以共用連線池與標頭。
+    """
+    def __init__(self, user_agent, default_delay=None, per_ip_delay=None, fetch_robots=None):
+        self.user_agent = user_agent
+        self.fetch_robots = fetch_robots
+        self.default_delay = POLITENESS_DEFAULT_DELAY if default_delay is None else default_delay
+        self.per_ip_delay = POLITENESS_PER_IP_DELAY if per_ip_delay is None else per_ip_delay
+        self._next_host = {}
+        self._next_ip = {}
+        self._robots = OrderedDict()
+        self._ips = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        return (urlparse(url).hostname or "").lower()
+
+    def _default_fetch_robots(self, robots_url):
+        """未指定 fetch_robots 時 (例如單獨使用排程器) 的備用抓取方式"""
+        try:
+            response = requests.get(robots_url, headers={'User-Agent': self.user_agent}, timeout=ROBOTS_FETCH_TIMEOUT)
+        except requests.exceptions.RequestException:
+            return None
+        return response.text if response.status_code < 400 else None
+
+    @staticmethod
+    def _robots_url(url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme or 'http'}://{parsed.netloc}/robots.txt"
+
+    def _parse_crawl_delay(self, text):
+        if text is None:
+            return None
+        try:
+            parser = RobotFileParser()
+            parser.parse(text.splitlines())
+            parser.modified()
+            delay = parser.crawl_delay(self.user_agent)
+            rate = parser.request_rate(self.user_agent)
+            if delay is None and rate and rate.requests:
+                delay = rate.seconds / rate.requests
+            return float(delay) if delay is not None else None
+        except ValueError:
+            return None
+
+    def _cached_delay(self, host):
+        with self._lock:
+            cached = self._robots.get(host)
+            if cached and cached[1] > time.time():
+                self._robots.move_to_end(host)
+                return cached[0]
+        return None
+
+    def _store_delay(self, host, crawl_delay):
+        delay = self.default_delay if crawl_delay is None else min(max(crawl_delay, self.default_delay), POLITENESS_MAX_CRAWL_DELAY)
+        with self._lock:
+            self._robots[host] = (delay, time.time() + ROBOTS_CACHE_TTL)
+            self._robots.move_to_end(host)
+            while len(self._robots) > POLITENESS_CACHE_SIZE:
+                self._robots.popitem(last=False)
+        return delay
+
+    def host_delay(self, url):
+        """回傳該主機兩次抓取間的最小間隔：robots.txt 的 Crawl-delay (有上限) 或預設值"""
+        host = self._host(url)
+        delay = self._cached_delay(host)
+        if delay is None:
+            text = (self.fetch_robots or self._default_fetch_robots)(self._robots_url(url))
+            delay = self._store_delay(host, self._parse_crawl_delay(text))
+        return delay
+
+    async def host_delay_async(self, url, fetch_robots):
+        """host_delay 的非同步版本：以 await fetch_robots(robots_url) 取得 robots.txt"""
+        host = self._host(url)
+        delay = self._cached_delay(host)
+        if delay is None:
+            delay = self._store_delay(host, self._parse_crawl_delay(await fetch_robots(self._robots_url(url))))
+        return delay
+
+    def _store_ip(self, host, ip):
+        with self._lock:
+            self._ips[host] = ip
+            while len(self._ips) > POLITENESS_CACHE_SIZE:
+                self._ips.popitem(last=False)
+        return ip
+
+    def _resolve(self, host):
+        with self._lock:
+            if host in self._ips:
+                return self._ips[host]
+        try:
+            ip = socket.getaddrinfo(host, None)[0][4][0]
+        except (socket.gaierror, UnicodeError, IndexError):
+            ip = None
+        return self._store_ip(host, ip)
+
+    async def _resolve_async(self, host):
+        with self._lock:
+            if host in self._ips:
+                return self._ips[host]
+        try:
+            ip = (await asyncio.get_running_loop().getaddrinfo(host, None))[0][4][0]
+        except (socket.gaierror, UnicodeError, IndexError):
+            ip = None
+        return self._store_ip(host, ip)
+
+    def ready_at(self, url):
+        """回傳該 URL 最早可抓取的時間 (只看已知資訊，不會發出網路請求)"""
+        host = self._host(url)
+        with self._lock:
+            ip = self._ips.get(host)
+            return max(self._next_host.get(host, 0), self._next_ip.get(ip, 0) if ip else 0)
+
+    def pick_ready(self, urls):
+        """在前 POLITENESS_PICK_WINDOW 個 URL 中挑出最早可抓取者的索引"""
+        best_index, best_time = 0, None
+        for index, url in enumerate(urls):
+            if index >= POLITENESS_PICK_WINDOW:
+                break
+            ready = self.ready_at(url)
+            if best_time is None or ready < best_time:
+                best_index, best_time = index, ready
+                if ready <= time.monotonic():
+                    break
+        return best_index
+
+    def reserve(self, url):
+        """預約該主機 (與其 IP) 的下一個抓取時段，回傳需要等待的秒數"""
+        host = self._host(url)
+        return self._reserve_slot(host, self.host_delay(url), self._resolve(host) if host else None)
+
+    async def reserve_async(self, url, fetch_robots):
+        """reserve 的非同步版本，不佔用執行緒；呼叫端以 await asyncio.sleep(回傳值) 等待"""
+        host = self._host(url)
+        delay = await self.host_delay_async(url, fetch_robots)
+        return self._reserve_slot(host, delay, await self._resolve_async(host) if host else None)
+
+    def _reserve_slot(self, host, delay, ip):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_host.get(host, 0), self._next_ip.get(ip, 0) if ip else 0)
+            self._next_host[host] = start + delay
+            if ip:
+                self._next_ip[ip] = start + self.per_ip_delay
+            if len(self._next_host) > POLITENESS_CACHE_SIZE:
+                self._prune(now)
+        return start - now
+
+    def _prune(self, now):
+        for slots in (self._next_host, self._next_ip):
+            for key in [key for key, ready in slots.items() if ready <= now]:
+                del slots[key]
+
+    def wait(self, url):
+        """阻塞直到可以禮貌地抓取該 URL；只會延遲同一主機或 IP 的請求"""
+        wait_seconds = self.reserve(url)
+        if wait_seconds > 0:
+            print(f"  - ⏳ 禮貌延遲: {self._host(url)} 需等待 {wait_seconds:.1f} 秒")
+            time.sleep(wait_seconds)
+
+class BrowserPool:
+    """維持 N 個可重複使用的 Chrome WebDriver，處理指定頁數後或當機時自動汰換"""
+    def __init__(self, size=None, headless=None, max_pages_per_driver=None):
+        self.size = size or SELENIUM_POOL_SIZE
+        self.headless = SELENIUM_HEADLESS if headless is None else headless
+        self.max_pages_per_driver = max_pages_per_driver or SELENIUM_MAX_PAGES_PER_DRIVER
+        self._idle = queue.Queue()
+        self._page_counts = {}
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        # 只在啟動時解析一次 chromedriver 路徑，失敗時交由 Selenium Manager 自動尋找
+        try:
+            self.driver_path = ChromeDriverManager().install()
+        except Exception as e:
+            print(f"  - 警告: webdriver-manager 無法取得 chromedriver ({e})，改由 Selenium Manager 解析。")
+            self.driver_path = None
+
+    def _create_driver(self):
+        options = ChromeOptions()
+        if self.headless:
+            options.add_argument("--headless=new")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--start-maximized")
+        options.page_load_strategy = "eager"
+        service = ChromeService(self.driver_path) if self.driver_path else ChromeService()
+        driver = webdriver.Chrome(service=service, options=options)
+        driver.set_page_load_timeout(SELENIUM_PAGE_TIMEOUT)
+        self._page_counts[id(driver)] = 0
+        return driver
+
+    def acquire(self):
+        """取得一個閒置的 driver；池未滿時建立新的，否則等待歸還"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._create_driver()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=SELENIUM_PAGE_TIMEOUT + SELENIUM_READY_TIMEOUT)
+
+    def release(self, driver, crashed=False):
+        """歸還 driver；當機或已處理過多頁面時直接關閉以便重建"""
+        self._page_counts[id(driver)] = self._page_counts.get(id(driver), 0) + 1
+        if crashed or self._closed or self._page_counts[id(driver)] >= self.max_pages_per_driver:
+            self._discard(driver)
+            return
+        try:
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+        except Exception:
+            self._discard(driver)
+            return
+        self._idle.put(driver)
+
+    def _discard(self, driver):
+        self._page_counts.pop(id(driver), None)
+        with self._lock:
+            self._created -= 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def wait_until_ready(self, driver):
+        """等待 document.readyState 為 complete 且網路請求數量維持不變一段時間，並有硬性逾時"""
+        deadline = time.monotonic() + SELENIUM_READY_TIMEOUT
+        idle_needed = SELENIUM_NETWORK_IDLE_MS / 1000
+        last_count, stable_since = -1, time.monotonic()
+        while time.monotonic() < deadline:
+            state, resource_count = driver.execute_script(
+                "return [document.readyState, performance.getEntriesByType('resource').length];"
+            )
+            now = time.monotonic()
+            if resource_count != last_count:
+                last_count, stable_since = resource_count, now
+            elif state == "complete" and now - stable_since >= idle_needed:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def fetch(self, url):
+        driver = self.acquire()
+        crashed = False
+        try:
+            try:
+                driver.get(url)
+            except TimeoutException:
+                # 頁面載入逾時仍保留已載入的內容
+                driver.execute_script("window.stop();")
+            if not self.wait_until_ready(driver):
+                print(f"  - Selenium 等待頁面就緒逾時 ({SELENIUM_READY_TIMEOUT} 秒)，使用目前內容。")
+            return driver.page_source, driver.current_url
+        except WebDriverException:
+            crashed = True
+            raise
+        finally:
+            self.release(driver, crashed=crashed)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+class FetchValidatorStore:
+    """以 SQLite 保存各 URL 的 ETag / Last-Modified，供重新爬取時發出條件式請求 (執行緒安全)"""
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS fetch_validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            )
+            """)
+
+    def get(self, url):
+        with self._lock:
+            row = self.conn.execute("SELECT etag, last_modified FROM fetch_validators WHERE url = ?", (url,)).fetchone()
+        return row or (None, None)
+
+    def put(self, url, etag, last_modified, final_url=None):
+        """
+        保存驗證資訊；重新導向時同時以最終 URL 保存，之後不論以原始 URL (爬蟲) 或
+        分類紀錄中的 source_url (新鮮度檢查) 發出請求都能帶上條件式標頭。
+        """
+        if not etag and not last_modified:
+            return
+        now = time.time()
+        urls = {url, final_url} - {None}
+        with self._lock:
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO fetch_validators (url, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?)",
+                        [(key, etag, last_modified, now) for key in urls]
+                    )
+            except sqlite3.Error as e:
+                print(f"  - 寫入條件式請求驗證資訊時發生錯誤: {e}")
+
+def is_html_content_type(content_type):
+    """判斷 Content-Type 是否為可解析的 HTML (未提供時視為 HTML)"""
+    if not content_type:
+        return True
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type in FETCH_HTML_CONTENT_TYPES
+
+def content_type_charset(content_type):
+    """取出 Content-Type 標頭宣告的 charset，未宣告時回傳 None"""
+    match = re.search(r'charset\s*=\s*["\']?([A-Za-z0-9_\-]+)', content_type or "", re.IGNORECASE)
+    return match.group(1) if match else None
+
+class BoundedBodyReader:
+    """累積回應內容區塊，超過位元組上限，或讀到 </head> 之後已取得足夠內文時要求停止"""
+    def __init__(self, max_bytes=None, body_bytes_after_head=None):
+        self.max_bytes = max_bytes or FETCH_MAX_BYTES
+        self.body_bytes_after_head = FETCH_BODY_BYTES_AFTER_HEAD if body_bytes_after_head is None else body_bytes_after_head
+        self.chunks = []
+        self.received = 0
+        self.head_end = None
+
+    def feed(self, chunk):
+        """加入一個區塊，回傳 True 表示已讀取足夠內容"""
+        if not chunk:
+            return False
+        if self.head_end is None:
+            # 往前多看幾個位元組，避免 </head> 剛好被切在兩個區塊之間
+            overlap = self.chunks[-1][-6:] if self.chunks else b""
+            position = (overlap + chunk).lower().find(b"</head>")
+            if position >= 0:
+                self.head_end = self.received - len(overlap) + position
+        self.chunks.append(chunk)
+        self.received += len(chunk)
+        if self.received >= self.max_bytes:
+            return True
+        return bool(self.head_end is not None and self.body_bytes_after_head
+                    and self.received - self.head_end >= self.body_bytes_after_head)
+
+    def content(self):
+        return b"".join(self.chunks)[:self.max_bytes]
+
+def read_bounded_body(response, max_bytes=None, body_bytes_after_head=None):
+    """串流讀取 requests 回應內容，讀取足夠內容後提早停止"""
+    reader = BoundedBodyReader(max_bytes, body_bytes_after_head)
+    for chunk in response.iter_content(chunk_size=FETCH_CHUNK_BYTES):
+        if reader.feed(chunk):
+            break
+    response.close()
+    return reader.content()
+
+NOT_MODIFIED = object()
 
 class WebScraper:
     """負責抓取網頁內容，具備 Selenium 備援機制"""
-    def __init__(self):
+    def __init__(self, browser_pool=None, scheduler=None, validator_store=None):
         self.headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+        self.browser_pool = browser_pool
+        self.validator_store = validator_store
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=PIPELINE_FETCH_CONCURRENCY, pool_maxsize=PIPELINE_FETCH_CONCURRENCY)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool_lock = threading.Lock()
+        # robots.txt 與頁面共用同一個連線池與標頭
+        self.scheduler = scheduler or PolitenessScheduler(self.headers['User-Agent'])
+        if self.scheduler.fetch_robots is None:
+            self.scheduler.fetch_robots = self._fetch_robots
+
+    def _fetch_robots(self, robots_url):
+        """以共用的 requests 連線池抓取 robots.txt，不存在或失敗時回傳 None"""
+        try:
+            response = self.session.get(robots_url, headers=self.headers, timeout=ROBOTS_FETCH_TIMEOUT)
+        except requests.exceptions.RequestException:
+            return None
+        return response.text if response.status_code < 400 else None
     
-    def fetch(self, url):
-        """主抓取函式，優先使用 requests"""
+    def fetch(self, url, conditional=False):
+        """
+        主抓取函式，優先使用 requests 串流讀取 (有位元組上限)，失敗時改用 Selenium；回傳依回應編碼解碼後的 HTML。
+        conditional=True 時附上先前的 ETag / Last-Modified，內容未變更則回傳 (NOT_MODIFIED, url)。
+        非 HTML 內容直接略過，回傳 (None, final_url)。
+        """
+        with METRICS.timer("politeness_wait_seconds"):
+            self.scheduler.wait(url)
         print(f"  - 正在使用 Requests 嘗試抓取 {url} ...")
+        headers = self._request_headers(url, conditional)
         try:
-            response = requests.get(url, headers=self.headers, timeout=15, allow_redirects=True)
-            response.raise_for_status()
-            print("  - Requests 抓取成功。")
-            return response.content, response.url
+            with METRICS.timer("fetch_seconds", backend="requests"):
+                if FETCH_HEAD_PROBE:
+                    probe = self.session.head(url, headers=self.headers, timeout=FETCH_TIMEOUT, allow_redirects=True)
+                    if probe.ok and not is_html_content_type(probe.headers.get('Content-Type')):
+                        METRICS.inc("fetch_total", backend="requests", outcome="not_html")
+                        print(f"  - 略過非 HTML 內容 ({probe.headers.get('Content-Type')})。")
+                        return None, probe.url
+                response = self.session.get(url, headers=headers, timeout=FETCH_TIMEOUT, allow_redirects=True, stream=True)
+                if response.status_code == 304:
+                    response.close()
+                    METRICS.inc("fetch_total", backend="requests", outcome="not_modified")
+                    print("  - 內容未變更 (304 Not Modified)。")
+                    return NOT_MODIFIED, response.url
+                response.raise_for_status()
+                if not is_html_content_type(response.headers.get('Content-Type')):
+                    response.close()
+                    METRICS.inc("fetch_total", backend="requests", outcome="not_html")
+                    print(f"  - 略過非 HTML 內容 ({response.headers.get('Content-Type')})。")
+                    return None, response.url
+                content = read_bounded_body(response)
+            if self.validator_store:
+                self.validator_store.put(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), response.url)
+            METRICS.inc("fetch_total", backend="requests", outcome="ok")
+            METRICS.inc("fetch_bytes_total", len(content), backend="requests")
+            print(f"  - Requests 抓取成功 ({len(content)} 位元組)。")
+            return decode_html(content, content_type_charset(response.headers.get('Content-Type'))), response.url
         except requests.exceptions.RequestException as e:
+            METRICS.inc("fetch_total", backend="requests", outcome="error")
             print(f"  - Requests 發生錯誤: {e}。將嘗試使用 Selenium。")
             return self._fetch_with_selenium(url)
 
+    def _request_headers(self, url, conditional):
+        """組合請求標頭；條件式請求時附上先前保存的 ETag / Last-Modified"""
+        headers = dict(self.headers)
+        if conditional and self.validator_store:
+            etag, last_modified = self.validator_store.get(url)
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
     def _fetch_with_selenium(self, url):
-        """使用 Selenium 作為備援抓取方式"""
+        """使用 Selenium 瀏覽器池作為備援抓取方式"""
         if not SELENIUM_AVAILABLE:
             print("  - 警告: 未安裝 Selenium，無法使用備援抓取。")
             return None, None
         
         mode = "顯示模式" if not SELENIUM_HEADLESS else "無頭模式"
         print(f"  - 正在使用 Selenium ({mode}) 嘗試抓取 {url} ...")
-        
-        options = ChromeOptions()
-        if SELENIUM_HEADLESS:
-            options.add_argument("--headless")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--start-maximized")
-        driver = None
-        try:
-            service = ChromeService(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=options)
-            driver.get(url)
-            print("  - 等待頁面載入 5 秒...")
-            time.sleep(5)
-            page_source = driver.page_source
-            final_url = driver.current_url
+        with METRICS.timer("politeness_wait_seconds"):
+            self.scheduler.wait(url)
+        try:
+            with self._pool_lock:
+                if self.browser_pool is None:
+                    self.browser_pool = BrowserPool()
+            with METRICS.timer("fetch_seconds", backend="selenium"):
+                page_source, final_url = self.browser_pool.fetch(url)
+            METRICS.inc("fetch_total", backend="selenium", outcome="ok")
+            METRICS.inc("fetch_bytes_total", len(page_source), backend="selenium")
             print("  - Selenium 抓取成功。")
             return page_source, final_url
         except Exception as e:
+            METRICS.inc("fetch_total", backend="selenium", outcome="error")
             print(f"  - Selenium 抓取時發生錯誤: {e}")
             return None, None
-        finally:
-            if driver:
-                if not SELENIUM_HEADLESS:
-                    print("  - 調試等待，3秒後關閉瀏覽器...")
-                    time.sleep(3)
-                driver.quit()
+
+    def close(self):
+        if self.browser_pool:
+            self.browser_pool.close()
+
+class AsyncWebScraper(WebScraper):
+    """
+    以 aiohttp 在背景事件迴圈執行抓取：共用連線池 (keep-alive)、具 TTL 的 DNS 快取，
+    以及全域與每主機的並行上限。對外維持 fetch(url) -> (content, final_url) 介面，
+    另提供 fetch_async 供 asyncio 管線直接 await。
+    """
+    def __init__(self, browser_pool=None, scheduler=None, validator_store=None):
+        super().__init__(browser_pool=browser_pool, scheduler=scheduler, validator_store=validator_store)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-fetcher", daemon=True)
+        self._thread.start()
+        self._http = asyncio.run_coroutine_threadsafe(self._open_session(), self._loop).result()
+        print(f"非同步抓取器已啟動 (全域並行 {ASYNC_FETCH_CONCURRENCY} / 每主機 {ASYNC_FETCH_PER_HOST}，DNS 快取 {DNS_CACHE_TTL} 秒)。")
+
+    async def _open_session(self):
+        connector = aiohttp.TCPConnector(limit=ASYNC_FETCH_CONCURRENCY, limit_per_host=ASYNC_FETCH_PER_HOST,
+                                         use_dns_cache=True, ttl_dns_cache=DNS_CACHE_TTL)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT))
+
+    def fetch(self, url, conditional=False):
+        return asyncio.run_coroutine_threadsafe(self._fetch(url, conditional), self._loop).result()
+
+    async def fetch_async(self, url, conditional=False):
+        """可在任何事件迴圈中 await 的抓取介面 (實際 I/O 在抓取器的背景迴圈執行)"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._fetch(url, conditional), self._loop))
+
+    async def _fetch_robots_async(self, robots_url):
+        """以 aiohttp 連線池 (含 DNS 快取) 抓取 robots.txt，不存在或失敗時回傳 None"""
+        try:
+            async with self._http.get(robots_url, headers=self.headers,
+                                      timeout=aiohttp.ClientTimeout(total=ROBOTS_FETCH_TIMEOUT)) as response:
+                if response.status >= 400:
+                    return None
+                return await response.text(errors="replace")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+    async def _fetch(self, url, conditional):
+        loop = asyncio.get_running_loop()
+        with METRICS.timer("politeness_wait_seconds"):
+            # 禮貌延遲以 asyncio.sleep 等待，不佔用執行緒池，實際並行數只受 ASYNC_FETCH_CONCURRENCY 限制
+            wait_seconds = await self.scheduler.reserve_async(url, self._fetch_robots_async)
+            if wait_seconds > 0:
+                print(f"  - ⏳ 禮貌延遲: {urlparse(url).hostname} 需等待 {wait_seconds:.1f} 秒")
+                await asyncio.sleep(wait_seconds)
+        print(f"  - 正在使用 aiohttp 嘗試抓取 {url} ...")
+        headers = await loop.run_in_executor(None, self._request_headers, url, conditional)
+        try:
+            with METRICS.timer("fetch_seconds", backend="aiohttp"):
+                if FETCH_HEAD_PROBE:
+                    async with self._http.head(url, headers=self.headers, allow_redirects=True) as probe:
+                        if probe.ok and not is_html_content_type(probe.headers.get('Content-Type')):
+                            METRICS.inc("fetch_total", backend="aiohttp", outcome="not_html")
+                            print(f"  - 略過非 HTML 內容 ({probe.headers.get('Content-Type')})。")
+                            return None, str(probe.url)
+                async with self._http.get(url, headers=headers, allow_redirects=True) as response:
+                    final_url = str(response.url)
+                    if response.status == 304:
+                        METRICS.inc("fetch_total", backend="aiohttp", outcome="not_modified")
+                        print("  - 內容未變更 (304 Not Modified)。")
+                        return NOT_MODIFIED, final_url
+                    response.raise_for_status()
+                    if not is_html_content_type(response.headers.get('Content-Type')):
+                        METRICS.inc("fetch_total", backend="aiohttp", outcome="not_html")
+                        print(f"  - 略過非 HTML 內容 ({response.headers.get('Content-Type')})。")
+                        return None, final_url
+                    reader = BoundedBodyReader()
+                    async for chunk in response.content.iter_chunked(FETCH_CHUNK_BYTES):
+                        if reader.feed(chunk):
+                            break
+                    content = reader.content()
+                    charset = content_type_charset(response.headers.get('Content-Type'))
+                    etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+            if self.validator_store:
+                await loop.run_in_executor(None, self.validator_store.put, url, etag, last_modified, final_url)
+            METRICS.inc("fetch_total", backend="aiohttp", outcome="ok")
+            METRICS.inc("fetch_bytes_total", len(content), backend="aiohttp")
+            print(f"  - aiohttp 抓取成功 ({len(content)} 位元組)。")
+            return decode_html(content, charset), final_url
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            METRICS.inc("fetch_total", backend="aiohttp", outcome="error")
+            print(f"  - aiohttp 發生錯誤: {e or type(e).__name__}。將嘗試使用 Selenium。")
+            return await loop.run_in_executor(None, self._fetch_with_selenium, url)
+
+    def close(self):
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._http.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+        super().close()
+
+def create_scraper():
+    """依設定建立抓取器：可用時使用 aiohttp 非同步抓取器，否則使用 requests"""
+    browser_pool = BrowserPool() if SELENIUM_AVAILABLE else None
+    validator_store = FetchValidatorStore(FETCH_VALIDATOR_PATH)
+    if USE_ASYNC_FETCHER and AIOHTTP_AVAILABLE:
+        return AsyncWebScraper(browser_pool=browser_pool, validator_store=validator_store)
+    if USE_ASYNC_FETCHER:
+        print("警告：未安裝 aiohttp，改用 requests 抓取。建議執行：pip install aiohttp")
+    return WebScraper(browser_pool=browser_pool, validator_store=validator_store)
 
 class WebCrawler:
     """主爬蟲程式，採用兩階段分類策略與備援抓取"""
-    def __init__(self, start_urls, db_manager, classifier, scraper):
+    def __init__(self, start_urls, db_manager, classifier, scraper, seen_index=None, preclassifier=None, knn_classifier=None,
+                 duplicate_index=None):
         self.db_manager = db_manager
         self.classifier = classifier
         self.scraper = scraper
+        self.preclassifier = preclassifier
+        self.knn_classifier = knn_classifier
+        self.duplicate_index = duplicate_index
         self.crawled_count = 0
         
-        queue_from_db = self.db_manager.load_queue()
-        if queue_from_db:
-            self.urls_to_crawl = deque(queue_from_db)
-            print(f"成功從資料庫載入 {len(queue_from_db)} 個待辦項目。")
-        else:
+        # 本地只保留一小批已認領 (租約中) 的 URL，其餘留在資料庫 frontier 中
+        self.urls_to_crawl = deque()
+        self._knowledge_results = {}
+        self._last_claim = time.monotonic()
+        self.page_cache = PageCache()
+        self.processed_domains = seen_index if seen_index is not None else MemorySeenDomainIndex()
+
+        pending = self.db_manager.queue_size()
+        if pending:
+            print(f"資料庫 frontier 中尚有 {pending} 個待辦項目，將分批認領處理。")
+        elif start_urls:
             initial_root_urls = sorted(list(set(filter(None, [self._get_root_url(url) for url in start_urls]))))
-            self.urls_to_crawl = deque(initial_root_urls)
             print("資料庫中無待辦項目，從 START_URLS 初始化佇列。")
             for url in initial_root_urls:
-                self.db_manager.add_to_queue(url)
-        
-        self.processed_domains = {self._get_domain(url) for url in self.urls_to_crawl}
+                self.processed_domains.add(self._get_domain(url))
+                self.db_manager.add_to_queue(url, self._get_domain(url), priority=FRONTIER_SEED_PRIORITY)
 
     def _get_domain(self, url):
-        try: return urlparse(url).netloc
+        try: return domain_key(url)
         except: return None
 
     def _get_root_url(self, url):
@@ -509,20 +3897,7 @@ class WebCrawler:
 
     def _is_classification_valid(self, result):
         """(新增) 驗證分類結果是否合乎邏輯"""
-        if not result or not isinstance(result, dict):
-            return False
-        main_cat_code = result.get("main_category_code")
-        sub_cat_code = result.get("subcategory_code")
-        
-        if not main_cat_code or not sub_cat_code:
-            return False
-        if main_cat_code not in MAIN_CATEGORY_MAP:
-            return False
-        if sub_cat_code not in SUBCATEGORY_MAP:
-            return False
-        if not sub_cat_code.startswith(main_cat_code):
-            return False
-        return True
+        return is_classification_valid(result)
 
     def _save_classification(self, domain, url, classification_result):
         """將已驗證的分類結果儲存至資料庫"""
@@ -532,127 +3907,1053 @@ class WebCrawler:
         main_cat_name = MAIN_CATEGORY_MAP.get(main_cat_code)
         sub_cat_name = SUBCATEGORY_MAP.get(sub_cat_code)
         
-        self.db_manager.add_domain_classification(domain, main_cat_code, main_cat_name, sub_cat_code, sub_cat_name, summary, url)
+        source = classification_result.get("source") or "llm"
+        self.db_manager.add_domain_classification(domain, main_cat_code, main_cat_name, sub_cat_code, sub_cat_name, summary, url, source,
+                                                  classification_result.get("content_fingerprint"))
+        METRICS.inc("classifications_total", source=source, outcome="failed" if main_cat_code == "999" else "classified")
+        if self.preclassifier:
+            self.preclassifier.record_label(domain, classification_result)
         self.crawled_count += 1
         return True
 
-    def _find_and_queue_new_links(self, soup, base_url):
-        """從頁面中尋找新的、未處理過的根 URL 並加入佇列"""
+    def _parse_page(self, html_content, base_url):
+        """解析頁面，一次取得標題、描述、可見文字與頁面中的連結，並依 URL 快取結果"""
+        with METRICS.timer("parse_seconds"):
+            page = extract_page(html_content, base_url)
+        self.page_cache.put(base_url, page, base_url)
+        return page
+
+    def _fetch_page(self, url):
+        """抓取並解析頁面 (每個 URL 只抓取、解析一次)，回傳 (page, final_url)，失敗時 page 為 None"""
+        cached = self.page_cache.get(url)
+        if cached:
+            return cached
+        content, scraped_url = self.scraper.fetch(url)
+        if not content:
+            return None, url
+        page = self._parse_page(content, scraped_url)
+        self.page_cache.put(url, page, scraped_url)
+        return page, scraped_url
+
+    def _find_and_queue_new_links(self, links):
+        """從頁面連結中尋找新的、未處理過的根 URL 並加入佇列"""
         new_links_found = 0
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            if not href: continue
-            
-            absolute_url = urljoin(base_url, href)
+        for absolute_url in links:
             new_domain = self._get_domain(absolute_url)
-            
+
             if new_domain and new_domain not in self.processed_domains:
                 root_url = self._get_root_url(absolute_url)
                 if root_url:
                     self.processed_domains.add(new_domain)
-                    self.urls_to_crawl.append(root_url)
-                    self.db_manager.add_to_queue(root_url) 
+                    self.db_manager.add_to_queue(root_url, new_domain)
                     new_links_found += 1
         if new_links_found > 0:
             print(f"  - 🔗 發現並新增了 {new_links_found} 個新域名到佇列。")
 
-    def run(self, max_domains):
-        """執行爬蟲主迴圈"""
-        while self.urls_to_crawl and self.crawled_count < max_domains:
-            url = self.urls_to_crawl.popleft()
-            self.db_manager.remove_from_queue(url)
-            
+    def _classify_with_knowledge(self, url):
+        """第一階段：以 AI 知識庫直接分類，失敗時回傳 None"""
+        print("1. 嘗試知識庫分類...")
+        if url in self._knowledge_results:
+            knowledge_result = self._knowledge_results.pop(url)
+            if knowledge_result.get("source"):
+                print(f"  - ⚡ 預分類命中 ({knowledge_result['source']}，信心 {knowledge_result['confidence']})，略過 LLM。")
+            else:
+                print("  - 使用批次知識庫分類的結果。")
+        else:
+            knowledge_result = self._preclassify(url) or self.classifier.classify_from_knowledge(url)
+
+        tier = "preclassifier" if knowledge_result and knowledge_result.get("source") else "knowledge"
+        if knowledge_result and knowledge_result.get("known", False):
+            if self._is_classification_valid(knowledge_result):
+                if tier == "knowledge":
+                    METRICS.inc("classification_tier_total", tier=tier, result="hit")
+                print("  - 🧠 AI 認識此網站且分類有效，直接採用。")
+                return knowledge_result
+            METRICS.inc("classification_tier_total", tier=tier, result="invalid")
+            print(f"  - ⚠️ 警告: AI 知識庫回傳了無效或不匹配的代碼。將轉向內容分析。")
+        else:
+            METRICS.inc("classification_tier_total", tier=tier, result="miss")
+            print("  - 🧠 AI 不認識此網站，將進行內容分析。")
+        return None
+
+    def _classify_from_content(self, domain, final_url, page):
+        """第二階段：以頁面內容產生摘要，再以元數據進行分類"""
+        print("2. 嘗試內容分析分類...")
+        text_content = page["text_content"]
+        if not text_content or len(text_content) < 100:
+            print(f"  - ⚠️ 警告: 域名 {domain} 的有效文字內容太少。")
+            return {"main_category_code": "999", "subcategory_code": "999-99", "summary": "網站有效內容過少，無法分析。"}
+
+        # 內容指紋隨分類結果一併儲存，之後的新鮮度檢查以此判斷頁面是否改變
+        fingerprint = simhash_fingerprint(text_content)
+        fingerprint_hex = format_fingerprint(fingerprint)
+        preclassified = self._preclassify(final_url, " ".join(filter(None, [page["title"], page["description"], text_content])))
+        if preclassified:
+            return dict(preclassified, content_fingerprint=fingerprint_hex)
+
+        cluster = self.duplicate_index.find(fingerprint) if self.duplicate_index and fingerprint is not None else None
+        if self.duplicate_index and fingerprint is not None:
+            METRICS.inc("classification_tier_total", tier="simhash", result="hit" if cluster else "miss")
+        if cluster:
+            print(f"  - 🧬 內容與 {cluster['domain']} 近似重複 (漢明距離 {cluster['distance']})，沿用其摘要與分類。")
+            self.duplicate_index.mark_inherited(cluster)
+            return {"main_category_code": cluster["main_category_code"], "subcategory_code": cluster["subcategory_code"],
+                    "summary": cluster["summary"], "source": "simhash", "content_fingerprint": fingerprint_hex}
+
+        result = self._summarize_and_classify(domain, final_url, page)
+        # 分類流程失敗 (999-99) 的結果不建立群集，避免之後的頁面沿用失敗結果
+        if self.duplicate_index and fingerprint is not None and result.get("subcategory_code") != "999-99":
+            self.duplicate_index.add(fingerprint, domain, result)
+        return dict(result, content_fingerprint=fingerprint_hex)
+
+    def _summarize_and_classify(self, domain, final_url, page):
+        """以 LLM 產生摘要，再以最近鄰或元數據進行分類"""
+        text_content = page["text_content"]
+        summary = self.classifier.get_summary_from_content(text_content, final_url)
+        if not summary:
+            print(f"  - ❌ 錯誤: 域名 {domain} 的摘要階段失敗。")
+            return {"main_category_code": "999", "subcategory_code": "999-99", "summary": "AI 無法生成網站摘要。"}
+
+        print(f"  - 摘要生成: {summary}")
+        examples = []
+        if self.knn_classifier:
+            knn_result, examples = self.knn_classifier.classify(summary)
+            METRICS.inc("classification_tier_total", tier="knn", result="hit" if knn_result else "miss")
+            if knn_result:
+                print(f"  - 🧭 相似網站標籤一致 (相似度 ≥ {knn_result['confidence']})，沿用 {knn_result['subcategory_code']}，略過元數據分類。")
+                knn_result['summary'] = summary
+                return knn_result
+            if examples:
+                print(f"  - 🧭 提供 {len(examples)} 個相似網站作為 few-shot 範例。")
+        for attempt in range(MAX_CLASSIFICATION_RETRIES):
+            print(f"  - 進行第 {attempt + 1}/{MAX_CLASSIFICATION_RETRIES} 次分類嘗試...")
+            class_result = self.classifier.classify_from_metadata(final_url, page["title"], page["description"], summary, examples)
+            if self._is_classification_valid(class_result):
+                print("  - ✅ 分類結果有效！")
+                class_result['summary'] = summary
+                if self.knn_classifier:
+                    self.knn_classifier.remember(domain, class_result)
+                return class_result
+            print(f"  - ⚠️ 警告: AI 回傳了無效或不匹配的代碼。將在 {RETRY_DELAY} 秒後重試...")
+            METRICS.inc("classification_retries_total")
+            METRICS.inc("retry_sleep_seconds_total", RETRY_DELAY)
+            time.sleep(RETRY_DELAY)
+
+        print(f"  - ❌ 錯誤: 經過多次嘗試，域名 {domain} 仍無法獲得有效分類。")
+        return {"main_category_code": "999", "subcategory_code": "999-99", "summary": "AI 多次無法提供有效分類。"}
+
+    def _refill_buffer(self):
+        """從 frontier 認領下一批 URL 放入本地緩衝"""
+        claimed = [url for url, _ in self.db_manager.claim_batch(FRONTIER_CLAIM_BATCH)]
+        if claimed:
+            self._last_claim = time.monotonic()
+        self.urls_to_crawl.extend(claimed)
+        METRICS.inc("frontier_claimed_total", len(claimed))
+        METRICS.set_gauge("frontier_buffer_size", len(self.urls_to_crawl))
+        return claimed
+
+    def _shard_may_receive_links(self):
+        """分片模式下本分片暫無待辦項目時，若其他 worker 仍在處理 (可能送來新連結) 且尚未逾時，則應繼續等待"""
+        if self.db_manager.shard is None or time.monotonic() - self._last_claim > SHARD_IDLE_TIMEOUT:
+            return False
+        return self.db_manager.leased_count() > 0
+
+    def _preclassify(self, url, text=None):
+        """以預分類層分類，信心不足或未啟用時回傳 None"""
+        if not self.preclassifier:
+            return None
+        result = self.preclassifier.classify(url, text)
+        METRICS.inc("classification_tier_total", tier="preclassifier", result="hit" if result else "miss")
+        if result:
+            print(f"  - ⚡ 預分類命中 ({result['source']}，信心 {result['confidence']})，略過 LLM。")
+        return result
+
+    def _knowledge_candidates(self, urls, check_existing=True):
+        """篩選需要批次知識庫分類的 URL (排除已分類的域名，預分類層可直接回答者不送 LLM)；呼叫端已批次比對時可略過逐一查詢"""
+        if not USE_BATCH_KNOWLEDGE:
+            return []
+        candidates = []
+        for url in urls:
+            domain = self._get_domain(url)
+            if not domain or (check_existing and self.db_manager.domain_exists(domain)):
+                continue
+            preclassified = self.preclassifier.classify(url) if self.preclassifier else None
+            if self.preclassifier:
+                METRICS.inc("classification_tier_total", tier="preclassifier", result="hit" if preclassified else "miss")
+            if preclassified:
+                self._knowledge_results[url] = preclassified
+            else:
+                candidates.append(url)
+        return candidates
+
+    def _prefetch_knowledge(self, urls):
+        """以批次 API 預先取得知識庫分類結果，供後續逐一處理時直接使用"""
+        if urls:
+            print(f"\n📦 批次知識庫分類 {len(urls)} 個網站...")
+            self._knowledge_results.update(self.classifier.classify_many_from_knowledge(urls))
+
+    def _start_knowledge_prefetch(self, urls):
+        """管線模式：依批次大小切分後在背景預先取得知識庫分類，分類階段只需等待該 URL 所屬的批次"""
+        sizer = getattr(self.classifier, "batch_sizer", None)
+        size = sizer.size if sizer else KNOWLEDGE_BATCH_SIZE
+        for start in range(0, len(urls), size):
+            chunk = urls[start:start + size]
+            task = asyncio.create_task(asyncio.to_thread(self._prefetch_knowledge, chunk))
+            for url in chunk:
+                self._knowledge_tasks[url] = task
+
+    async def _await_knowledge_prefetch(self, url):
+        """等待此 URL 的背景批次分類完成；批次失敗時改由逐一分類處理"""
+        task = self._knowledge_tasks.pop(url, None)
+        if task is None:
+            return
+        try:
+            await task
+        except OllamaUnavailableError:
+            raise
+        except Exception as e:
+            print(f"  - ⚠️ 批次知識庫分類失敗，改為逐一分類: {e}")
+
+    def _next_url(self, refill=True):
+        """取出下一個待處理的 URL，本地緩衝用完時從 frontier 認領下一批，跳過已處理或無效的域名"""
+        while True:
+            if not self.urls_to_crawl:
+                if not refill:
+                    return None, None
+                if not self._refill_buffer():
+                    if not self._shard_may_receive_links():
+                        return None, None
+                    time.sleep(SHARD_IDLE_POLL)
+                    continue
+                self._prefetch_knowledge(self._knowledge_candidates(self.urls_to_crawl))
+
+            # 優先挑選主機已可抓取的 URL，避免在同一主機的禮貌延遲上空等
+            index = self.scraper.scheduler.pick_ready(self.urls_to_crawl)
+            url = self.urls_to_crawl[index]
+            del self.urls_to_crawl[index]
             domain = self._get_domain(url)
             if not domain or self.db_manager.domain_exists(domain):
                 print(f"⏭️  跳過已處理或無效的域名: {domain or url}")
+                self.db_manager.ack(url)
                 continue
-            
-            print(f"\n--- 處理中 ({self.crawled_count + 1}/{max_domains}): {url} ---")
-            
-            final_classification = None
-            html_content = None
-            final_url = url
+            return url, domain
+
+    def _release_unprocessed(self):
+        """結束時歸還本地緩衝中尚未處理的租約"""
+        if self.urls_to_crawl:
+            self.db_manager.release_leases(list(self.urls_to_crawl))
+            self.urls_to_crawl.clear()
+        self._knowledge_results.clear()
+
+    def _classify_url(self, url, domain):
+        """以兩階段策略分類單一 URL，回傳 (final_url, 分類結果, page)；page 僅在抓取過頁面時提供"""
+        page = None
+        final_url = url
+
+        final_classification = self._classify_with_knowledge(url)
 
-            print("1. 嘗試知識庫分類...")
-            knowledge_result = self.classifier.classify_from_knowledge(url)
+        if not final_classification:
+            page, final_url = self._fetch_page(url)
             
-            if knowledge_result and knowledge_result.get("known", False):
-                if self._is_classification_valid(knowledge_result):
-                    print("  - 🧠 AI 認識此網站且分類有效，直接採用。")
-                    final_classification = knowledge_result
-                else:
-                    print(f"  - ⚠️ 警告: AI 知識庫回傳了無效或不匹配的代碼。將轉向內容分析。")
+            if page:
+                final_classification = self._classify_from_content(domain, final_url, page)
             else:
-                print("  - 🧠 AI 不認識此網站，將進行內容分析。")
+                print(f"  - ❌ 錯誤: 使用所有方法抓取 {url} 皆失敗。")
+                final_classification = {"main_category_code": "999", "subcategory_code": "999-02", "summary": "爬蟲無法訪問此網站。"}
+        return final_url, final_classification, page
+
+    def _process_url(self, url, domain):
+        """以兩階段策略分類單一 URL，儲存結果並將新連結加入佇列"""
+        final_url, final_classification, page = self._classify_url(url, domain)
+        current_domain = self._get_domain(final_url)
+        self._save_classification(current_domain, final_url, final_classification)
+        
+        if page is None and final_classification.get("main_category_code") != "999":
+            print("  - 🔍 知識庫分類成功，現在抓取頁面以尋找新連結...")
+            page, final_url = self._fetch_page(url)
+        
+        if page:
+            self._find_and_queue_new_links(page["links"])
+        self.db_manager.ack(url)
 
-            if not final_classification:
-                print("2. 嘗試內容分析分類...")
-                content, scraped_url = self.scraper.fetch(url)
+    def run(self, max_domains):
+        """執行爬蟲主迴圈"""
+        try:
+            while self.crawled_count < max_domains:
+                url, domain = self._next_url()
+                if not url:
+                    break
                 
-                if content:
-                    html_content = content
-                    final_url = scraped_url
-
-                    soup = BeautifulSoup(html_content, 'html.parser')
-                    
-                    title = soup.title.string.strip() if soup.title else ""
-                    description_tag = soup.find('meta', attrs={'name': 'description'})
-                    description = description_tag['content'].strip() if description_tag and 'content' in description_tag.attrs else ""
-                    
-                    for tag in soup(["script", "style", "header", "footer", "nav", "aside"]):
-                        tag.decompose()
-                    text_content = soup.get_text(separator=' ', strip=True)
-
-                    if not text_content or len(text_content) < 100:
-                        print(f"  - ⚠️ 警告: 域名 {domain} 的有效文字內容太少。")
-                        final_classification = {"main_category_code": "999", "subcategory_code": "999-99", "summary": "網站有效內容過少，無法分析。"}
-                    else:
-                        summary = self.classifier.get_summary_from_content(text_content, final_url)
-                        if not summary:
-                            print(f"  - ❌ 錯誤: 域名 {domain} 的摘要階段失敗。")
-                            final_classification = {"main_category_code": "999", "subcategory_code": "999-99", "summary": "AI 無法生成網站摘要。"}
-                        else:
-                            print(f"  - 摘要生成: {summary}")
-                            for attempt in range(MAX_CLASSIFICATION_RETRIES):
-                                print(f"  - 進行第 {attempt + 1}/{MAX_CLASSIFICATION_RETRIES} 次分類嘗試...")
-                                class_result = self.classifier.classify_from_metadata(final_url, title, description, summary)
-                                if self._is_classification_valid(class_result):
-                                    print("  - ✅ 分類結果有效！")
-                                    final_classification = class_result
-                                    final_classification['summary'] = summary
-                                    break
-                                else:
-                                    print(f"  - ⚠️ 警告: AI 回傳了無效或不匹配的代碼。將在 {RETRY_DELAY} 秒後重試...")
-                                    time.sleep(RETRY_DELAY)
-                            
-                            if not final_classification:
-                                print(f"  - ❌ 錯誤: 經過多次嘗試，域名 {domain} 仍無法獲得有效分類。")
-                                final_classification = {"main_category_code": "999", "subcategory_code": "999-99", "summary": "AI 多次無法提供有效分類。"}
-                else:
-                    print(f"  - ❌ 錯誤: 使用所有方法抓取 {url} 皆失敗。")
-                    final_classification = {"main_category_code": "999", "subcategory_code": "999-02", "summary": "爬蟲無法訪問此網站。"}
-            
-            current_domain = self._get_domain(final_url)
-            self._save_classification(current_domain, final_url, final_classification)
-            
-            if html_content is None and final_classification.get("main_category_code") != "999":
-                print("  - 🔍 知識庫分類成功，現在抓取頁面以尋找新連結...")
-                content, scraped_url = self.scraper.fetch(url)
-                if content:
-                    html_content = content
-                    final_url = scraped_url
-            
-            if html_content:
-                soup = BeautifulSoup(html_content, 'html.parser')
-                self._find_and_queue_new_links(soup, final_url)
-            
-            time.sleep(1)
+                print(f"\n--- 處理中 ({self.crawled_count + 1}/{max_domains}): {url} ---")
+                try:
+                    with METRICS.timer("domain_seconds"):
+                        self._process_url(url, domain)
+                except OllamaUnavailableError:
+                    self.db_manager.release_leases([url])
+                    raise
+                except Exception as e:
+                    print(f"  - ❌ 處理 {url} 時發生錯誤: {e}")
+                    self.db_manager.nack(url)
+                # 逐一模式下一個域名的寫入即一個交易，處理下一個域名 (可能是很長的 LLM 呼叫) 前先提交
+                self.db_manager.flush()
+        except OllamaUnavailableError:
+            print("⛔ Ollama 服務無法使用，停止爬取；未完成的項目已歸還佇列。")
 
+        self._release_unprocessed()
+        self.db_manager.flush()
+        self.processed_domains.flush()
         print(f"\n爬取完成！總共處理了 {self.crawled_count} 個域名。")
 
+    async def run_pipeline(self, max_domains):
+        """以 asyncio 管線執行爬蟲：抓取、解析、分類、寫入各為獨立階段，以有界佇列串接"""
+        fetch_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        parse_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        classify_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        persist_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self._in_flight_domains = set()
+        self._knowledge_tasks = {}
+        self._pipeline_stopped = False
+        self._pipeline_idle = asyncio.Event()
+        self._pipeline_idle.set()
+
+        workers = []
+        stages = [
+            ("抓取", fetch_queue, parse_queue, self._pipeline_fetch, PIPELINE_FETCH_CONCURRENCY),
+            ("解析", parse_queue, classify_queue, self._pipeline_parse, PIPELINE_PARSE_CONCURRENCY),
+            ("分類", classify_queue, persist_queue, self._pipeline_classify, PIPELINE_CLASSIFY_CONCURRENCY),
+            ("寫入", persist_queue, None, self._pipeline_persist, PIPELINE_PERSIST_CONCURRENCY),
+        ]
+        for stage_name, in_queue, out_queue, handler, concurrency in stages:
+            for _ in range(concurrency):
+                workers.append(asyncio.create_task(self._pipeline_worker(stage_name, in_queue, out_queue, handler)))
+        workers.append(asyncio.create_task(self._pipeline_flush_timer()))
+
+        print(f"啟動 asyncio 管線模式 (抓取 {PIPELINE_FETCH_CONCURRENCY} / 解析 {PIPELINE_PARSE_CONCURRENCY} / "
+              f"分類 {PIPELINE_CLASSIFY_CONCURRENCY} / 寫入 {PIPELINE_PERSIST_CONCURRENCY})")
+        try:
+            while not self._pipeline_stopped and self.crawled_count + len(self._in_flight_domains) < max_domains:
+                if not self.urls_to_crawl:
+                    # 批次分類在背景進行，抓取可立即開始
+                    self._start_knowledge_prefetch(self._knowledge_candidates(self._refill_buffer()))
+                url, domain = self._next_url(refill=False)
+                if not url:
+                    if not self._in_flight_domains:
+                        if self._shard_may_receive_links():
+                            await asyncio.sleep(SHARD_IDLE_POLL)
+                            continue
+                        break
+                    # 佇列暫時為空，等待處理中的項目完成並可能發現新連結
+                    self._pipeline_idle.clear()
+                    await self._pipeline_idle.wait()
+                    continue
+                if domain in self._in_flight_domains:
+                    self.db_manager.ack(url)
+                    continue
+
+                self._in_flight_domains.add(domain)
+                METRICS.set_gauge("pipeline_in_flight", len(self._in_flight_domains))
+                self._pipeline_idle.clear()
+                await fetch_queue.put({"url": url, "domain": domain, "final_url": url, "content": None, "page": None,
+                                       "started": time.perf_counter()})
+
+            while self._in_flight_domains:
+                self._pipeline_idle.clear()
+                await self._pipeline_idle.wait()
+            if self._pipeline_stopped:
+                print("⛔ Ollama 服務無法使用，停止爬取；未完成的項目已歸還佇列。")
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await asyncio.gather(*set(self._knowledge_tasks.values()), return_exceptions=True)
+            self._knowledge_tasks.clear()
+
+        self._release_unprocessed()
+        self.db_manager.flush()
+        self.processed_domains.flush()
+        print(f"\n爬取完成！總共處理了 {self.crawled_count} 個域名。")
+
+    async def _pipeline_flush_timer(self):
+        """定期提交暫存的寫入，管線閒置或各階段都在等待 LLM 時，分類結果與 ack 也不會長時間停留在記憶體"""
+        while True:
+            await asyncio.sleep(self.db_manager.flush_interval)
+            try:
+                self.db_manager.flush_if_due()
+            except Exception as e:
+                print(f"⚠️ 定期寫入資料庫時發生錯誤: {e}")
+
+    def _pipeline_done(self, item, outcome):
+        """標記項目離開管線，並向 frontier 確認 (ack)、退回 (nack) 或歸還租約 (release)"""
+        if outcome == "ack":
+            self.db_manager.ack(item["url"])
+        elif outcome == "nack":
+            self.db_manager.nack(item["url"])
+        else:
+            self.db_manager.release_leases([item["url"]])
+        self._in_flight_domains.discard(item["domain"])
+        METRICS.observe("domain_seconds", time.perf_counter() - item["started"])
+        METRICS.set_gauge("pipeline_in_flight", len(self._in_flight_domains))
+        self._pipeline_idle.set()
+
+    async def _pipeline_worker(self, stage_name, in_queue, out_queue, handler):
+        """通用的管線階段工作者"""
+        stage = handler.__name__.replace("_pipeline_", "")
+        while True:
+            item = await in_queue.get()
+            METRICS.set_gauge("pipeline_queue_depth", in_queue.qsize(), stage=stage)
+            outcome = "ack"
+            started = time.perf_counter()
+            try:
+                result = await handler(item)
+            except OllamaUnavailableError:
+                result, outcome = None, "release"
+                self._pipeline_stopped = True
+            except Exception as e:
+                print(f"  - ❌ 管線階段「{stage_name}」處理 {item['url']} 時發生錯誤: {e}")
+                result, outcome = None, "nack"
+            finally:
+                in_queue.task_done()
+                METRICS.observe("pipeline_stage_seconds", time.perf_counter() - started, stage=stage)
+
+            if out_queue is not None and result is not None:
+                await out_queue.put(result)
+            else:
+                self._pipeline_done(item, outcome)
+
+    async def _pipeline_fetch(self, item):
+        cached = self.page_cache.get(item["url"])
+        if cached:
+            item["page"], item["final_url"] = cached
+            return item
+        if hasattr(self.scraper, "fetch_async"):
+            content, scraped_url = await self.scraper.fetch_async(item["url"])
+        else:
+            content, scraped_url = await asyncio.to_thread(self.scraper.fetch, item["url"])
+        if content:
+            item["content"] = content
+            item["final_url"] = scraped_url
+        return item
+
+    async def _pipeline_parse(self, item):
+        if item["content"]:
+            item["page"] = await asyncio.to_thread(self._parse_page, item["content"], item["final_url"])
+            self.page_cache.put(item["url"], item["page"], item["final_url"])
+            item["content"] = None
+        return item
+
+    async def _pipeline_classify(self, item):
+        print(f"\n--- 分類中: {item['url']} ---")
+        await self._await_knowledge_prefetch(item["url"])
+        final_classification = await asyncio.to_thread(self._classify_with_knowledge, item["url"])
+        if not final_classification:
+            if item["page"]:
+                final_classification = await asyncio.to_thread(self._classify_from_content, item["domain"], item["final_url"], item["page"])
+            else:
+                print(f"  - ❌ 錯誤: 使用所有方法抓取 {item['url']} 皆失敗。")
+                final_classification = {"main_category_code": "999", "subcategory_code": "999-02", "summary": "爬蟲無法訪問此網站。"}
+        item["classification"] = final_classification
+        return item
+
+    async def _pipeline_persist(self, item):
+        current_domain = self._get_domain(item["final_url"])
+        if current_domain != item["domain"] and self.db_manager.domain_exists(current_domain):
+            print(f"⏭️  跳過已處理的域名: {current_domain}")
+        else:
+            self._save_classification(current_domain, item["final_url"], item["classification"])
+        if item["page"]:
+            self._find_and_queue_new_links(item["page"]["links"])
+        return None
+
+
+class BulkClassificationJob:
+    """
+    從檔案或標準輸入串流讀取域名 (每行一個域名或 URL，# 開頭為註解)，不做連結探索：
+    每批先以 SQL 批次比對已分類的域名，其餘以多執行緒分類，結果寫入 SQLite 與 JSONL / CSV，並定期寫入檢查點。
+    """
+    OUTPUT_FIELDS = ["domain", "url", "main_category_code", "main_category_name", "subcategory_code", "subcategory_name",
+                     "summary", "classified_by", "cached"]
+
+    def __init__(self, crawler, output_path, output_format=None, workers=None, chunk_size=None,
+                 checkpoint_path=None, include_existing=True):
+        self.crawler = crawler
+        self.db_manager = crawler.db_manager
+        self.output_path = output_path
+        self.output_format = output_format or ("csv" if output_path.endswith(".csv") else "jsonl")
+        self.workers = workers or BULK_WORKERS
+        self.chunk_size = chunk_size or BULK_CHUNK_SIZE
+        self.checkpoint_path = checkpoint_path or output_path + ".checkpoint"
+        self.include_existing = include_existing
+        self.lines_done = 0
+        self.classified = 0
+        self.cached = 0
+        self._written = set()
+
+    @staticmethod
+    def parse_line(line):
+        """取出一行中的第一個欄位並轉為 (分類鍵, 抓取用 URL)，無效時回傳 (None, None)"""
+        token = line.split("#", 1)[0].strip().split()
+        if not token:
+            return None, None
+        value = token[0].strip(",;\"'")
+        url = value if "://" in value else f"https://{value}/"
+        return domain_key(url), url
+
+    def _load_checkpoint(self, input_name):
+        if not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("input") != input_name:
+            print(f"檢查點 '{self.checkpoint_path}' 屬於其他輸入 ({checkpoint.get('input')})，從頭開始。")
+            return 0
+        print(f"從檢查點繼續：略過前 {checkpoint['lines']} 行 (先前已分類 {checkpoint.get('classified', 0)} 個域名)。")
+        if checkpoint.get("output_bytes") is not None:
+            self._written = self._load_written(checkpoint["output_bytes"])
+        return checkpoint["lines"]
+
+    def _load_written(self, offset):
+        """讀取檢查點之後已寫入輸出檔的域名 (上次中斷於一批的中途)，續跑時不再重複輸出；不完整的最後一行會被截斷"""
+        if not os.path.exists(self.output_path):
+            return set()
+        with open(self.output_path, "rb+") as f:
+            f.seek(offset)
+            tail = f.read()
+            complete = tail[:tail.rfind(b"\n") + 1]
+            if len(complete) < len(tail):
+                f.truncate(offset + len(complete))
+        text = complete.decode("utf-8", errors="replace")
+        if self.output_format == "csv":
+            domains = {row["domain"] for row in csv.DictReader(text.splitlines(keepends=True), fieldnames=self.OUTPUT_FIELDS)}
+        else:
+            domains = set()
+            for line in text.splitlines():
+                try:
+                    domains.add(json.loads(line)["domain"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        if domains:
+            print(f"輸出檔中已有檢查點之後的 {len(domains)} 個域名，續跑時不重複輸出。")
+        return domains
+
+    def _save_checkpoint(self, input_name, output_bytes):
+        self.db_manager.flush()
+        with open(self.checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"input": input_name, "lines": self.lines_done, "classified": self.classified,
+                       "output_bytes": output_bytes, "updated_at": time.time()}, f)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def _write(self, writer, record):
+        if record["domain"] in self._written:
+            return
+        if self.output_format == "csv":
+            writer.writerow(record)
+        else:
+            writer.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _record(domain, url, result, classified_by, cached):
+        main_code, sub_code = result.get("main_category_code"), result.get("subcategory_code")
+        return {"domain": domain, "url": url, "main_category_code": main_code, "main_category_name": MAIN_CATEGORY_MAP.get(main_code),
+                "subcategory_code": sub_code, "subcategory_name": SUBCATEGORY_MAP.get(sub_code), "summary": result.get("summary"),
+                "classified_by": classified_by, "cached": cached}
+
+    def _classify(self, url, domain):
+        return self.crawler._classify_url(url, domain)
+
+    def _process_chunk(self, chunk, writer, pool):
+        """處理一批 {分類鍵: URL}：已分類者直接輸出，其餘平行分類後於主執行緒寫入資料庫"""
+        existing = self.db_manager.get_classifications(list(chunk))
+        for domain, row in existing.items():
+            self.cached += 1
+            if self.include_existing:
+                self._write(writer, self._record(domain, row["source_url"], row, row["classified_by"] or "llm", True))
+        pending = {domain: url for domain, url in chunk.items() if domain not in existing}
+        if not pending:
+            return
+        # 已分類的域名已由上方的批次查詢排除，不再逐一查詢資料庫
+        self.crawler._prefetch_knowledge(self.crawler._knowledge_candidates(list(pending.values()), check_existing=False))
+        futures = {pool.submit(self._classify, url, domain): domain for domain, url in pending.items()}
+        failure = None
+        for future in as_completed(futures):
+            domain = futures[future]
+            try:
+                final_url, result, _ = future.result()
+            except OllamaUnavailableError as e:
+                failure = e
+                continue
+            except Exception as e:
+                print(f"  - ❌ 分類 {domain} 時發生錯誤: {e}")
+                continue
+            self.crawler._save_classification(domain, final_url, result)
+            self._write(writer, self._record(domain, final_url, result, result.get("source") or "llm", False))
+            self.classified += 1
+        if failure:
+            raise failure
+
+    def run(self, input_path):
+        """執行批次分類；input_path 為 '-' 時讀取標準輸入"""
+        input_name = "<stdin>" if input_path == "-" else os.path.abspath(input_path)
+        skip = self._load_checkpoint(input_name)
+        source = sys.stdin if input_path == "-" else open(input_path, encoding="utf-8", errors="replace")
+        mode = "a" if skip else "w"
+        output = open(self.output_path, mode, encoding="utf-8", newline="")
+        if self.output_format == "csv":
+            writer = csv.DictWriter(output, fieldnames=self.OUTPUT_FIELDS)
+            if mode == "w":
+                writer.writeheader()
+        else:
+            writer = output
+        started = time.monotonic()
+        chunk = {}
+        line_number = skip
+        print(f"開始批次分類 (平行 {self.workers}，每批 {self.chunk_size} 個域名)，輸出至 '{self.output_path}' ({self.output_format})")
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for line_number, line in enumerate(source, 1):
+                    if line_number <= skip:
+                        continue
+                    domain, url = self.parse_line(line)
+                    if domain and domain not in chunk:
+                        chunk[domain] = url
+                    if len(chunk) >= self.chunk_size:
+                        self._process_chunk(chunk, writer, pool)
+                        chunk = {}
+                        self._commit(line_number, output, input_name, started)
+                if chunk:
+                    self._process_chunk(chunk, writer, pool)
+                self._commit(line_number, output, input_name, started)
+        except OllamaUnavailableError:
+            print("⛔ Ollama 服務無法使用，停止批次分類；重新執行即可從最後的檢查點繼續。")
+        finally:
+            output.close()
+            if source is not sys.stdin:
+                source.close()
+        return self.classified
+
+    def _commit(self, line_number, output, input_name, started):
+        """整批結果寫入後才推進檢查點，中斷時最多重做一批；記錄輸出檔位置以便續跑時辨識已輸出的紀錄"""
+        self.lines_done = line_number
+        output.flush()
+        self._save_checkpoint(input_name, output.tell())
+        self._report_progress(started)
+
+    def _report_progress(self, started):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(f"📈 已讀取 {self.lines_done} 行，新分類 {self.classified} 個域名 ({self.classified / elapsed:.2f} 域名/秒)，"
+              f"已存在 {self.cached} 個")
+
+class FreshnessRecheckJob:
+    """
+    重新檢查到期的分類紀錄：以條件式請求 (ETag / Last-Modified) 抓取來源頁面，304 或 SimHash 指紋相近時只更新檢查時間，
+    內容改變時才重新執行 LLM 分類；先前無法訪問或分類失敗的網站依連續失敗次數指數退避後重試。
+    同一資料庫只應有一個 recheck 行程，到期紀錄不經租約認領。
+    """
+    def __init__(self, crawler, batch_size=None):
+        self.crawler = crawler
+        self.db_manager = crawler.db_manager
+        self.batch_size = batch_size or RECHECK_BATCH_SIZE
+        self.stats = {"checked": 0, "not_modified": 0, "unchanged": 0, "baseline": 0, "reclassified": 0, "failed": 0}
+
+    @staticmethod
+    def _fingerprint_changed(stored, fingerprint):
+        return bin(int(stored, 16) ^ fingerprint).count("1") > SIMHASH_MAX_DISTANCE
+
+    def _record(self, outcome):
+        self.stats["checked"] += 1
+        self.stats[outcome] += 1
+        METRICS.inc("recheck_total", outcome=outcome)
+
+    def check(self, domain, source_url, sub_code, stored_fingerprint, attempts):
+        """重新檢查單一域名並記錄結果"""
+        failed_before = sub_code in RECHECK_FAILURE_CODES
+        url = source_url or f"http://{domain}"
+        print(f"\n--- 重新檢查: {domain} ({f'第 {attempts + 1} 次重試' if failed_before else url}) ---")
+        # 失敗紀錄沒有可比較的內容，不送條件式請求
+        content, final_url = self.crawler.scraper.fetch(url, conditional=not failed_before)
+        if content is NOT_MODIFIED:
+            self.db_manager.record_recheck(domain)
+            self._record("not_modified")
+            return
+        if not content:
+            print(f"  - ⚠️ 無法訪問 {url}，保留原分類，{recheck_delay(attempts + 1) / 3600:.0f} 小時後再試。")
+            self.db_manager.record_recheck(domain, attempts=attempts + 1)
+            self._record("failed")
+            return
+
+        page = self.crawler._parse_page(content, final_url)
+        fingerprint = simhash_fingerprint(page["text_content"])
+        fingerprint_hex = format_fingerprint(fingerprint)
+        if not failed_before and fingerprint is not None:
+            if stored_fingerprint is None:
+                # 尚無指紋可比較 (知識庫或預分類直接分類、未抓取內容的網站，或舊版紀錄)：只記錄基準，不重新分類
+                self.db_manager.record_recheck(domain, fingerprint_hex)
+                self._record("baseline")
+                return
+            if not self._fingerprint_changed(stored_fingerprint, fingerprint):
+                print("  - 內容指紋相近，沿用原分類。")
+                self.db_manager.record_recheck(domain, fingerprint_hex)
+                self._record("unchanged")
+                return
+
+        print("  - 🔄 內容已改變或先前分類失敗，重新分類...")
+        result = self.crawler._classify_from_content(domain, final_url, page)
+        if result.get("subcategory_code") in RECHECK_FAILURE_CODES:
+            # 重新分類仍失敗時不覆寫原紀錄 (避免暫時性的 LLM 錯誤蓋掉有效分類)
+            self.db_manager.record_recheck(domain, fingerprint_hex if failed_before else None, attempts + 1)
+            self._record("failed")
+            return
+        source = result.get("source") or "llm"
+        self.db_manager.update_domain_classification(
+            domain, result["main_category_code"], MAIN_CATEGORY_MAP.get(result["main_category_code"]),
+            result["subcategory_code"], SUBCATEGORY_MAP.get(result["subcategory_code"]), result.get("summary"), final_url, source
+        )
+        self.db_manager.record_recheck(domain, fingerprint_hex)
+        METRICS.inc("classifications_total", source=source, outcome="reclassified")
+        self._record("reclassified")
+
+    def run(self, limit=None, loop=False):
+        """處理到期的紀錄直到沒有到期項目 (或達到 limit)；loop 時持續在背景定期檢查"""
+        processed = 0
+        try:
+            while limit is None or processed < limit:
+                batch_size = self.batch_size if limit is None else min(self.batch_size, limit - processed)
+                rows = self.db_manager.due_for_recheck(batch_size)
+                for row in rows:
+                    self.check(*row)
+                self.db_manager.flush()
+                processed += len(rows)
+                if len(rows) == batch_size:
+                    continue
+                if not loop:
+                    break
+                time.sleep(RECHECK_POLL_INTERVAL)
+        except OllamaUnavailableError:
+            print("⛔ Ollama 服務無法使用，停止重新檢查；未處理的紀錄維持到期狀態。")
+        finally:
+            self.db_manager.flush()
+        stats = self.stats
+        print(f"\n重新檢查完成：{stats['checked']} 個域名，304 未變更 {stats['not_modified']}、指紋相近 {stats['unchanged']}、"
+              f"建立指紋 {stats['baseline']}、重新分類 {stats['reclassified']}、失敗 {stats['failed']}。")
+        return stats
+
+SNAPSHOT_MAGIC = b"DOMSNAP1"
+SNAPSHOT_HEADER = struct.Struct("<8sIIQ")
+SNAPSHOT_BUCKET_BITS = 16
+
+def snapshot_hash(name):
+    """快照使用的 64 位元域名雜湊"""
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little")
+
+def _align8(offset):
+    return (offset + 7) & ~7
+
+def export_domain_snapshot(db_manager, path):
+    """
+    將 classified_domains 匯出為唯讀快照：排序後的 64 位元域名雜湊、對應的子類別代碼索引，
+    以及以雜湊最高 16 位元分桶的起始位置表。先寫入暫存檔再原子替換，供線上服務熱更新。
+    SNAPSHOT_EXCLUDED_CODES 中的失敗紀錄不匯出，查詢時改由上層域名或「查無分類」回應。
+    """
+    codes = sorted(SUBCATEGORY_MAP)
+    code_index = {code: i for i, code in enumerate(codes)}
+    records = {}
+    for _, domain, sub_code, _ in db_manager.iter_classified_rows():
+        if sub_code in code_index and sub_code not in SNAPSHOT_EXCLUDED_CODES:
+            records.setdefault(snapshot_hash(domain), code_index[sub_code])
+    hashes = sorted(records)
+    buckets = [0] * ((1 << SNAPSHOT_BUCKET_BITS) + 1)
+    for value in hashes:
+        buckets[(value >> (64 - SNAPSHOT_BUCKET_BITS)) + 1] += 1
+    for i in range(1, len(buckets)):
+        buckets[i] += buckets[i - 1]
+
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 1, len(codes), len(hashes))
+    code_table = b"".join(code.encode("ascii").ljust(8, b"\0") for code in codes)
+    bucket_table = struct.pack(f"<{len(buckets)}I", *buckets)
+    prefix = header + code_table + bucket_table
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(prefix + b"\0" * (_align8(len(prefix)) - len(prefix)))
+        for start in range(0, len(hashes), SNAPSHOT_WRITE_CHUNK):
+            chunk = hashes[start:start + SNAPSHOT_WRITE_CHUNK]
+            f.write(struct.pack(f"<{len(chunk)}Q", *chunk))
+        for start in range(0, len(hashes), SNAPSHOT_WRITE_CHUNK):
+            chunk = hashes[start:start + SNAPSHOT_WRITE_CHUNK]
+            f.write(struct.pack(f"<{len(chunk)}H", *(records[value] for value in chunk)))
+    os.replace(tmp_path, path)
+    print(f"已匯出域名快照 '{path}' ({len(hashes)} 筆)。")
+    return len(hashes)
+
+class DomainSnapshot:
+    """以 mmap 開啟的唯讀域名分類快照，支援由子網域逐層往上的後綴比對與批次查詢"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, code_count, record_count = SNAPSHOT_HEADER.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC or version != 1:
+            self._mmap.close()
+            raise ValueError(f"'{path}' 不是有效的域名快照檔")
+        offset = SNAPSHOT_HEADER.size
+        self.codes = [self._mmap[offset + i * 8:offset + i * 8 + 8].rstrip(b"\0").decode("ascii") for i in range(code_count)]
+        offset += code_count * 8
+        bucket_count = (1 << SNAPSHOT_BUCKET_BITS) + 1
+        view = memoryview(self._mmap)
+        self._buckets = view[offset:offset + bucket_count * 4].cast("I")
+        offset = _align8(offset + bucket_count * 4)
+        self._hashes = view[offset:offset + record_count * 8].cast("Q")
+        offset += record_count * 8
+        self._code_ids = view[offset:offset + record_count * 2].cast("H")
+        self.record_count = record_count
+
+    def __len__(self):
+        return self.record_count
+
+    def _find(self, name):
+        value = int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little")
+        bucket = value >> (64 - SNAPSHOT_BUCKET_BITS)
+        hashes = self._hashes
+        i = bisect.bisect_left(hashes, value, self._buckets[bucket], self._buckets[bucket + 1])
+        if i < self.record_count and hashes[i] == value:
+            return self.codes[self._code_ids[i]]
+        return None
+
+    def lookup(self, host):
+        """回傳 (比對到的域名, 子類別代碼)；由完整主機名稱逐層往上比對至二級域名，找不到時回傳 (None, None)"""
+        host = host.strip().lower().rstrip(".")
+        if "/" in host or ":" in host or "@" in host:
+            host = canonicalize_host(urlparse(host if "//" in host else "//" + host).netloc)
+        elif not host.isascii():
+            host = canonicalize_host(host)
+        while True:
+            code = self._find(host)
+            if code:
+                return host, code
+            dot = host.find(".")
+            if dot < 0 or host.find(".", dot + 1) < 0:
+                return None, None
+            host = host[dot + 1:]
+
+    def lookup_many(self, hosts):
+        """批次查詢，回傳與輸入同順序的 [(比對到的域名, 子類別代碼), ...]"""
+        lookup = self.lookup
+        return [lookup(host) for host in hosts]
+
+    def describe(self, host):
+        """回傳可序列化為 JSON 的查詢結果"""
+        matched, code = self.lookup(host)
+        if not code:
+            return None
+        return {"matched": matched, "main_category_code": code[:3], "subcategory_code": code,
+                "main_category_name": MAIN_CATEGORY_MAP.get(code[:3]), "subcategory_name": SUBCATEGORY_MAP.get(code)}
+
+    def close(self):
+        self._hashes.release()
+        self._code_ids.release()
+        self._buckets.release()
+        self._mmap.close()
+
+class LookupHTTPHandler(BaseHTTPRequestHandler):
+    """GET /lookup?domain=a&domain=b 或 POST /lookup (JSON 陣列) 查詢分類，GET /health 檢查狀態"""
+    protocol_version = "HTTP/1.1"
+    snapshot = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/health":
+            self._send_json(200, {"status": "ok", "records": len(self.snapshot)})
+        elif parsed.path == "/lookup":
+            domains = parse_qs(parsed.query).get("domain", [])
+            self._send_json(200, {domain: self.snapshot.describe(domain) for domain in domains})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/lookup":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            domains = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"[]")
+            if not isinstance(domains, list) or not all(isinstance(domain, str) for domain in domains):
+                raise ValueError("需要由字串組成的 JSON 陣列")
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, {domain: self.snapshot.describe(domain) for domain in domains})
+
+    def log_message(self, *args):
+        pass
+
+class LookupLineHandler(socketserver.StreamRequestHandler):
+    """Unix socket 逐行協定：每行一個域名，回覆「域名\\t子類別代碼」，查無分類時代碼為「-」"""
+    snapshot = None
+
+    def handle(self):
+        for line in self.rfile:
+            host = line.decode("utf-8", errors="replace").strip()
+            if not host:
+                continue
+            code = self.snapshot.lookup(host)[1]
+            self.wfile.write(f"{host}\t{code or '-'}\n".encode("utf-8"))
+
+def serve_lookup(snapshot_path, host=None, port=None, unix_path=None):
+    """啟動唯讀查詢服務：HTTP (host:port)，並可選擇同時提供 Unix socket 逐行協定"""
+    snapshot = DomainSnapshot(snapshot_path)
+    host = host or LOOKUP_HTTP_HOST
+    port = LOOKUP_HTTP_PORT if port is None else port
+    http_server = ThreadingHTTPServer((host, port), type("Handler", (LookupHTTPHandler,), {"snapshot": snapshot}))
+    http_server.daemon_threads = True
+    servers = [http_server]
+    print(f"查詢服務已啟動: http://{host}:{http_server.server_port}/lookup?domain=... ({len(snapshot)} 筆)")
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        unix_server = socketserver.ThreadingUnixStreamServer(unix_path, type("Handler", (LookupLineHandler,), {"snapshot": snapshot}))
+        unix_server.daemon_threads = True
+        threading.Thread(target=unix_server.serve_forever, daemon=True).start()
+        servers.append(unix_server)
+        print(f"Unix socket 查詢服務已啟動: {unix_path}")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers[1:]:
+            server.shutdown()
+        for server in servers:
+            server.server_close()
+        if unix_path and os.path.exists(unix_path):
+            os.remove(unix_path)
+        snapshot.close()
+
+class FrontierRPCHandler(BaseHTTPRequestHandler):
+    """
+    POST /rpc {"method", "args"}：將 RemoteDatabaseManager 的請求轉送至服務端的 DatabaseManager；GET /health 回報佇列狀態。
+    設定 token 時，/rpc 請求須帶有相同的 X-Frontier-Token 標頭。
+    """
+    db_manager = None
+    token = None
+    METHODS = {
+        "write_batch": "_write_batch",
+        "claim_batch": "claim_batch",
+        "release_leases": "release_leases",
+        "queue_size": "queue_size",
+        "leased_count": "leased_count",
+        "classified_count": "classified_count",
+        "seen_in_db": "_seen_in_db",
+        "known_domains_page": "_known_domains_page",
+        "classified_rows_page": "_classified_rows_page",
+        "classification_rows": "_classification_rows",
+        "any_classified": "_any_classified",
+        "due_rows": "_due_rows",
+    }
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-def main():
-    """主執行函數"""
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self._send_json(200, {"status": "ok", "queue": self.db_manager.queue_size(), "leased": self.db_manager.leased_count(),
+                                  "classified": self.db_manager.classified_count()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/rpc":
+            self._send_json(404, {"error": "not found"})
+            return
+        if self.token and not hmac.compare_digest(self.headers.get(FRONTIER_TOKEN_HEADER, "").encode("utf-8"),
+                                                  self.token.encode("utf-8")):
+            self._send_json(401, {"error": "unauthorized"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("需要 JSON 物件")
+            method = self.METHODS.get(request.get("method"))
+            if method is None:
+                raise ValueError(f"未知的方法: {request.get('method')}")
+            result = getattr(self.db_manager, method)(*request.get("args", []))
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            # 其他錯誤 (資料庫錯誤或非預期的參數內容) 回報 500，避免連線直接中斷
+            print(f"⚠️ frontier RPC 請求處理失敗: {e}")
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, {"result": result})
+
+    def log_message(self, *args):
+        pass
+
+def serve_frontier(db_path, host=None, port=None, token=None):
+    """
+    啟動共用 frontier 服務：由單一行程持有 SQLite 資料庫，依序處理各 worker 的認領、寫入與查詢，
+    讓多台機器上的分片 worker (crawl-worker --frontier URL) 協同爬取。
+    """
+    db_manager = DatabaseManager(db_path, batch_size=1)
+    db_manager.setup_tables()
+    host = host or FRONTIER_SERVICE_HOST
+    port = FRONTIER_SERVICE_PORT if port is None else port
+    token = token or FRONTIER_SERVICE_TOKEN
+    if not token and host not in ("127.0.0.1", "localhost", "::1"):
+        print("⚠️ 警告：frontier 服務未設定權杖 (--token 或 FRONTIER_SERVICE_TOKEN)，任何可連線者皆能讀寫資料庫。")
+    # 單執行緒伺服器：SQLite 連線只在同一執行緒使用，寫入本來就須序列化
+    server = HTTPServer((host, port), type("Handler", (FrontierRPCHandler,), {"db_manager": db_manager, "token": token}))
+    print(f"frontier 服務已啟動: http://{host}:{server.server_port}/rpc (待辦 {db_manager.queue_size()} 筆)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        db_manager.close()
+
+def run_crawl_workers(workers, shard_count=None, shard_offset=0, frontier_url=None, max_domains=None, frontier_token=None):
+    """在本機啟動多個分片 worker 子行程 (各自擁有抓取器與分類器)，等待全部結束；權杖以環境變數傳遞，不出現在命令列"""
+    shard_count = shard_count or workers
+    commands = []
+    for index in range(shard_offset, shard_offset + workers):
+        command = [sys.executable, os.path.abspath(__file__), "crawl-worker", "--shard", str(index), "--shards", str(shard_count)]
+        if frontier_url:
+            command += ["--frontier", frontier_url]
+        if max_domains:
+            command += ["--max-domains", str(max_domains)]
+        commands.append(command)
+    print(f"啟動 {workers} 個分片 worker (分片 {shard_offset}-{shard_offset + workers - 1} / 共 {shard_count} 個)"
+          f"，共用 {'frontier 服務 ' + frontier_url if frontier_url else '資料庫 ' + DB_NAME}。")
+    env = dict(os.environ, FRONTIER_SERVICE_TOKEN=frontier_token) if frontier_token else None
+    processes = [subprocess.Popen(command, env=env) for command in commands]
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    failed = [index for index, process in zip(range(shard_offset, shard_offset + workers), processes) if process.returncode]
+    if failed:
+        print(f"⚠️ 分片 {failed} 的 worker 異常結束。")
+
+def main(start_urls=None, job=None, shard=None, frontier_url=None, max_domains=None, frontier_token=None):
+    """
+    主執行函數；job 為接收 WebCrawler 的函式 (例如批次分類)，未提供時執行爬蟲。
+    shard 為 (分片索引, 分片數) 時以分片 worker 身分執行；frontier_url 指定時改經由 frontier 服務存取共用資料庫。
+    """
     if not SELENIUM_AVAILABLE:
         print("警告：未安裝 Selenium 相關套件，備援抓取功能將無法使用。")
         print("建議執行：pip install selenium webdriver-manager")
@@ -661,20 +4962,140 @@ def main():
         print("錯誤：目前的兩階段分類邏輯尚未為 Gemini API 進行優化。請將 USE_LOCAL_AI 設為 True。")
         return
         
-    classifier = LocalOllamaClassifier(model=LOCAL_AI_MODEL, api_url=LOCAL_AI_URL, schema_json=CLASSIFICATION_SCHEMA_JSON)
+    client = OllamaClient(OLLAMA_ENDPOINTS)
+    llm_cache = LLMResponseCache(LLM_CACHE_PATH) if USE_LLM_CACHE else None
+    classifier = LocalOllamaClassifier(model=LOCAL_AI_MODEL, api_url=LOCAL_AI_URL, schema_json=CLASSIFICATION_SCHEMA_JSON,
+                                       client=client, cache=llm_cache)
 
     db_manager = None
-    scraper = WebScraper()
+    seen_index = None
+    preclassifier = None
+    knn_classifier = None
+    duplicate_index = NearDuplicateIndex(SIMHASH_DB_PATH) if USE_NEAR_DUPLICATE_DETECTION else None
+    scraper = create_scraper()
+    metrics_port = METRICS_HTTP_PORT + shard[0] if shard and METRICS_HTTP_PORT is not None else None
+    metrics_exporter = MetricsExporter(port=metrics_port).start()
     try:
-        db_manager = DatabaseManager(DB_NAME)
+        if frontier_url:
+            db_manager = RemoteDatabaseManager(frontier_url, shard=shard, token=frontier_token)
+        else:
+            db_manager = DatabaseManager(DB_NAME, shard=shard)
         db_manager.setup_tables() 
-        crawler = WebCrawler(start_urls=START_URLS, db_manager=db_manager, classifier=classifier, scraper=scraper)
-        crawler.run(max_domains=MAX_DOMAINS_TO_CRAWL)
+        if shard:
+            print(f"以分片 worker 身分執行：分片 {shard[0]} / 共 {shard[1]} 個。")
+        seen_index = create_seen_domain_index(db_manager, shard_path(SEEN_FILTER_PATH, shard))
+        if USE_PRECLASSIFIER:
+            preclassifier = PreClassifier()
+            preclassifier.train(db_manager.iter_training_rows())
+        if USE_EMBEDDING_KNN and NUMPY_AVAILABLE:
+            vector_index = VectorIndex(shard_path(EMBEDDING_INDEX_PATH, shard))
+            vector_index.sync(db_manager)
+            knn_classifier = KnnClassifier(vector_index)
+        elif USE_EMBEDDING_KNN:
+            print("警告：未安裝 numpy，停用最近鄰分類。建議執行：pip install numpy")
+        crawler = WebCrawler(start_urls=START_URLS if start_urls is None else start_urls, db_manager=db_manager, classifier=classifier, scraper=scraper,
+                             seen_index=seen_index, preclassifier=preclassifier, knn_classifier=knn_classifier,
+                             duplicate_index=duplicate_index)
+        if job:
+            job(crawler)
+        elif USE_ASYNC_PIPELINE:
+            asyncio.run(crawler.run_pipeline(max_domains=max_domains or MAX_DOMAINS_TO_CRAWL))
+        else:
+            crawler.run(max_domains=max_domains or MAX_DOMAINS_TO_CRAWL)
     except Exception as e:
         print(f"程式執行時發生嚴重錯誤: {e}")
     finally:
+        scraper.close()
+        classifier.report_stats()
+        if preclassifier:
+            preclassifier.report()
+        if duplicate_index:
+            duplicate_index.report()
+            duplicate_index.close()
+        if knn_classifier:
+            knn_classifier.report()
+            knn_classifier.index.close()
+        if llm_cache:
+            llm_cache.report()
+            llm_cache.close()
+        if seen_index:
+            seen_index.close()
         if db_manager:
             db_manager.close()
+        metrics_exporter.close()
+
+def cli():
+    """命令列入口：預設執行爬蟲，另提供匯出快照、查詢服務、批次分類、分片 worker 與新鮮度重新檢查子命令"""
+    parser = argparse.ArgumentParser(description="網站分類爬蟲與分類查詢服務")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("crawl", help="執行爬蟲 (預設)")
+    export_parser = subparsers.add_parser("export-snapshot", help="將 classified_domains 匯出為唯讀查詢快照")
+    export_parser.add_argument("--db", default=DB_NAME)
+    export_parser.add_argument("--output", default=LOOKUP_SNAPSHOT_PATH)
+    serve_parser = subparsers.add_parser("serve-lookup", help="以 HTTP / Unix socket 提供快照查詢")
+    serve_parser.add_argument("--snapshot", default=LOOKUP_SNAPSHOT_PATH)
+    serve_parser.add_argument("--host", default=LOOKUP_HTTP_HOST)
+    serve_parser.add_argument("--port", type=int, default=LOOKUP_HTTP_PORT)
+    serve_parser.add_argument("--unix", default=None, help="Unix socket 路徑 (逐行協定)")
+    bulk_parser = subparsers.add_parser("classify-file", help="從檔案或標準輸入批次分類域名清單 (不做連結探索)")
+    bulk_parser.add_argument("input", help="域名清單檔案，'-' 表示標準輸入")
+    bulk_parser.add_argument("--output", default=BULK_OUTPUT_PATH)
+    bulk_parser.add_argument("--format", choices=["jsonl", "csv"], default=None, help="預設依輸出副檔名判斷")
+    bulk_parser.add_argument("--workers", type=int, default=BULK_WORKERS)
+    bulk_parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE)
+    bulk_parser.add_argument("--checkpoint", default=None, help="預設為 <output>.checkpoint")
+    bulk_parser.add_argument("--skip-existing", action="store_true", help="已分類的域名不寫入輸出")
+    worker_parser = subparsers.add_parser("crawl-worker", help="以分片 worker 身分執行爬蟲 (只處理 hash(域名) 屬於本分片的項目)")
+    worker_parser.add_argument("--shard", type=int, required=True)
+    worker_parser.add_argument("--shards", type=int, required=True)
+    worker_parser.add_argument("--frontier", default=None, help="frontier 服務 URL，未指定時直接共用本機資料庫")
+    worker_parser.add_argument("--token", default=None, help="frontier 服務權杖，預設讀取環境變數 FRONTIER_SERVICE_TOKEN")
+    worker_parser.add_argument("--max-domains", type=int, default=None)
+    workers_parser = subparsers.add_parser("crawl-workers", help="在本機啟動多個分片 worker 子行程")
+    workers_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    workers_parser.add_argument("--shards", type=int, default=None, help="總分片數 (多台機器時大於本機 worker 數)，預設等於 --workers")
+    workers_parser.add_argument("--shard-offset", type=int, default=0, help="本機第一個 worker 的分片索引")
+    workers_parser.add_argument("--frontier", default=None)
+    workers_parser.add_argument("--token", default=None, help="frontier 服務權杖，預設讀取環境變數 FRONTIER_SERVICE_TOKEN")
+    workers_parser.add_argument("--max-domains", type=int, default=None, help="每個 worker 的域名上限")
+    frontier_parser = subparsers.add_parser("serve-frontier", help="提供共用 frontier 服務，供多台機器上的 worker 協同爬取")
+    frontier_parser.add_argument("--db", default=DB_NAME)
+    frontier_parser.add_argument("--host", default=FRONTIER_SERVICE_HOST)
+    frontier_parser.add_argument("--port", type=int, default=FRONTIER_SERVICE_PORT)
+    frontier_parser.add_argument("--token", default=None, help="frontier 服務權杖，預設讀取環境變數 FRONTIER_SERVICE_TOKEN")
+    recheck_parser = subparsers.add_parser("recheck", help="重新檢查到期的分類紀錄，內容改變或先前失敗時才重新分類")
+    recheck_parser.add_argument("--limit", type=int, default=None, help="本次最多檢查的域名數")
+    recheck_parser.add_argument("--loop", action="store_true", help="持續在背景定期檢查到期紀錄")
+    recheck_parser.add_argument("--frontier", default=None, help="frontier 服務 URL，未指定時直接使用本機資料庫")
+    recheck_parser.add_argument("--token", default=None, help="frontier 服務權杖，預設讀取環境變數 FRONTIER_SERVICE_TOKEN")
+    args = parser.parse_args()
+
+    if args.command == "export-snapshot":
+        db_manager = DatabaseManager(args.db)
+        try:
+            db_manager.setup_tables()
+            export_domain_snapshot(db_manager, args.output)
+        finally:
+            db_manager.close()
+    elif args.command == "serve-lookup":
+        serve_lookup(args.snapshot, args.host, args.port, args.unix)
+    elif args.command == "classify-file":
+        main(start_urls=[], job=lambda crawler: BulkClassificationJob(
+            crawler, args.output, args.format, args.workers, args.chunk_size, args.checkpoint,
+            include_existing=not args.skip_existing).run(args.input))
+    elif args.command == "crawl-worker":
+        if not 0 <= args.shard < args.shards:
+            parser.error("--shard 必須介於 0 與 --shards - 1 之間")
+        main(shard=(args.shard, args.shards), frontier_url=args.frontier, max_domains=args.max_domains, frontier_token=args.token)
+    elif args.command == "crawl-workers":
+        run_crawl_workers(args.workers, args.shards, args.shard_offset, args.frontier, args.max_domains, args.token)
+    elif args.command == "serve-frontier":
+        serve_frontier(args.db, args.host, args.port, args.token)
+    elif args.command == "recheck":
+        main(start_urls=[], frontier_url=args.frontier, frontier_token=args.token,
+             job=lambda crawler: FreshnessRecheckJob(crawler).run(args.limit, args.loop))
+    else:
+        main()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
\ No newline at end of file